@@ -0,0 +1,160 @@
+"""Versioned JSON API for the mobile app, under /api/v1.
+
+The HTML routes answer every change with a redirect and a full page; these
+endpoints batch work into one request instead: many products in one query,
+many cart lines in one transaction, and order history a keyset page at a
+time. Responses are compact JSON, gzip-compressed for clients that accept
+it, and carry an ETag built from the versions of the rows in them, so a
+client that sends it back in If-None-Match gets an empty 304 when nothing
+changed, before anything is serialized. Clients log in through /login and
+send the session cookie.
+"""
+import gzip
+import hashlib
+import json
+import logging
+
+from flask import Blueprint, Response, current_app, jsonify, request, session
+
+from database import DatabaseError
+from pagination import history_cursor, page_size, parse_history_cursor
+from repositories import run_repos
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Product columns clients may ask for with ?fields=
+PRODUCT_FIELDS = ('id', 'name', 'price', 'quantity', 'description', 'category', 'contact', 'image', 'farmer_id',
+                  'latitude', 'longitude', 'version')
+
+# Order columns returned to each role
+ORDER_FIELDS = {
+    'customer': ('id', 'product_name', 'quantity', 'payment_option', 'status'),
+    'farmer': ('id', 'product_name', 'quantity', 'status'),
+}
+
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+
+def _json(payload, versions):
+    """A JSON response whose ETag is derived from ``versions``, or a 304 if the client has it."""
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+    digest = hashlib.sha256(json.dumps(versions, separators=(',', ':')).encode()).hexdigest()[:16]
+    response = Response(mimetype='application/json')
+    response.set_etag(f"{digest}-{encoding}", weak=True)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if request.if_none_match.contains_weak(f"{digest}-{encoding}"):
+        response.status_code = 304
+        return response
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    if encoding == 'gzip' and len(body) >= current_app.config.get('API_GZIP_MIN_SIZE', 512):
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_data(body)
+    return response
+
+
+def _logged_in(*roles):
+    return 'user_id' in session and session.get('role') in roles
+
+
+@bp.route('/products')
+async def products():
+    """Many products by id: ``?ids=1,2,3``, optionally only ``?fields=name,price``."""
+    try:
+        product_ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+    except ValueError:
+        return _error("ids must be comma-separated integers", 400)
+    if not product_ids:
+        return _error("ids required", 400)
+    max_ids = current_app.config.get('API_MAX_IDS', 100)
+    if len(product_ids) > max_ids:
+        return _error(f"at most {max_ids} ids per request", 400)
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or list(PRODUCT_FIELDS)
+    unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown:
+        return _error(f"unknown fields: {', '.join(unknown)}", 400)
+
+    try:
+        # Catalogue reads tolerate replica lag
+        rows = await run_repos(lambda repos: repos.products.get_many(product_ids, fields), readonly=True)
+    except DatabaseError as e:
+        logging.error("Database error while fetching products %s: %s", product_ids, e)
+        return _error("Database error", 500)
+    return _json({'products': [{field: row[field] for field in fields} for row in rows]},
+                 [fields, [(row['id'], row['version']) for row in rows]])
+
+
+def _cart_response(lines):
+    items = [{'product_id': line['product_id'], 'name': line['product_name'], 'quantity': line['quantity'],
+              'price': line['price'], 'total_price': line['total_price']} for line in lines]
+    # Cart lines have no version of their own; the content is small enough to be one
+    return _json({'items': items, 'total_price': sum(item['total_price'] for item in items)},
+                 [[item['product_id'], item['quantity'], item['price']] for item in items])
+
+
+@bp.route('/cart', methods=['GET', 'POST'])
+async def cart():
+    """The cart; a POST of ``{"items": [{"product_id": 1, "quantity": 2}, ...]}`` sets many
+    line quantities in one transaction (0 removes a line) and returns the new cart."""
+    if not _logged_in('customer'):
+        return _error("Login required", 401)
+    customer_id = session['user_id']
+
+    quantities = {}
+    if request.method == 'POST':
+        try:
+            for item in request.get_json(silent=True)['items']:
+                quantities[int(item['product_id'])] = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            logging.warning("API cart update failed: malformed items.")
+            return _error("Invalid items", 400)
+
+    def update_and_read(repos):
+        if quantities:
+            repos.cart.update_many(customer_id, quantities)
+        return repos.cart.items(customer_id)
+
+    try:
+        lines = await run_repos(update_and_read)
+    except DatabaseError as e:
+        logging.error("Database error while updating the cart of customer %s: %s", customer_id, e)
+        return _error("Database error", 500)
+    if quantities:
+        logging.debug("Updated %s cart lines for customer %s.", len(quantities), customer_id)
+    return _cart_response(lines)
+
+
+@bp.route('/orders')
+async def orders():
+    """The customer's orders, or the orders for a farmer's products, newest first.
+
+    Pages are keyed like the HTML order history: pass ``next`` back as ``?after=``.
+    """
+    if not _logged_in('customer', 'farmer'):
+        return _error("Login required", 401)
+    user_id = session['user_id']
+    per_page = page_size()
+    after = parse_history_cursor(request.args.get('after'))
+    role = session['role']
+    try:
+        if role == 'customer':
+            rows = await run_repos(lambda repos: repos.orders.for_customer(user_id, after, per_page + 1))
+        else:
+            rows = await run_repos(lambda repos: repos.orders.for_farmer(user_id, after, per_page + 1))
+    except DatabaseError as e:
+        logging.error("Database error while fetching orders for user %s: %s", user_id, e)
+        return _error("Database error", 500)
+
+    page = rows[:per_page]
+    next_cursor = history_cursor(page[-1]) if len(rows) > per_page else None
+    orders = [dict({field: row[field] for field in ORDER_FIELDS[role]}, archived=bool(row['archived'])) for row in page]
+    return _json({'orders': orders, 'next': next_cursor},
+                 [next_cursor, [(order['id'], order['status'], order['archived']) for order in orders]])
+
+
+def init_app(app):
+    app.register_blueprint(bp)
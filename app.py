@@ -1,59 +1,290 @@
+import asyncio
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-import sqlite3
+import click
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, session,
+                   get_flashed_messages, jsonify, stream_template, stream_with_context)
 import os
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import init_db  # Import the init_db from the database module
-from flask import Flask, flash, render_template, redirect, url_for
+import time
+import zipfile
+import database
+import geo
+from database import DatabaseError, init_db  # Import the database helpers from the database module
+import api
+import assets
+import auth
+import bulk
+import cache
+import metrics
+import request_log
+import sessions
+from auth import HasherBusy, get_password_hasher, login_allowed
+from cache import get_cache
+import images
+import jobs
+from images import ImagePipelineBusy, get_image_pipeline
+from markupsafe import Markup
+from migrations import MIGRATIONS, Migrator
+from pagination import (KeysetPage, RenderedPage, history_cursor, page_size, parse_history_cursor, parse_id_cursor,
+                        parse_ranked_cursor, ranked_cursor)
+from repositories import RANKINGS, get_repositories, price_buckets, price_range, run_repos, search_terms
 
 
-# Logging Configuration
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
 # App Configuration
 app = Flask(__name__)
-app.config['DATABASE'] = 'ecommerce.db'
+app.config['DATABASE'] = os.getenv("DATABASE", 'ecommerce.db')
+app.config['DATABASE_URL'] = os.getenv("DATABASE_URL")  # A postgresql:// URL replaces the SQLite file
+app.config['DATABASE_REPLICA_URL'] = os.getenv("DATABASE_REPLICA_URL")  # Optional PostgreSQL replica for catalogue reads
 app.secret_key = os.getenv("SECRET_KEY", "777419777")  # Use an environment variable for production
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
+app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Reject uploads over 16 MB
+app.config['IMAGE_WORKERS'] = int(os.getenv("IMAGE_WORKERS", 2))  # Background image-processing threads
+app.config['IMAGE_QUEUE_SIZE'] = 64  # Spooled uploads waiting for those threads before new ones are refused
+app.config['ASSET_MAX_AGE'] = 31536000  # Fingerprinted static files are cached for a year
 app.permanent_session_lifetime = 3600  # Session expires after 1 hour
+app.config['SESSION_BACKEND'] = os.getenv("SESSION_BACKEND", "database")  # Or 'memory' for a single process
+app.config['PASSWORD_HASH_METHOD'] = os.getenv("PASSWORD_HASH_METHOD", "scrypt")  # Older hashes are upgraded at login
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))  # Hashing processes per app worker
+app.config['PASSWORD_HASH_QUEUE'] = 4  # Hashes waiting per hashing process before logins get a 503 (auth.py)
+app.config['LOGIN_RATE_PER_IP'] = os.getenv("LOGIN_RATE_PER_IP", "20/60")  # Attempts/seconds, per process
+app.config['LOGIN_RATE_PER_EMAIL'] = os.getenv("LOGIN_RATE_PER_EMAIL", "5/60")
+# Sizing: under asgi.py every request in progress holds one of ASGI_THREADS, also while a slow client
+# uploads its body or has yet to read all but ASGI_SEND_QUEUE_SIZE chunks of the response. Async views
+# keep their thread while their queries wait for one of the DB_POOL_SIZE executor threads, one per
+# pooled connection. Keep ASGI_THREADS at several times DB_POOL_SIZE so slow clients cannot take every
+# thread while connections sit idle; asgi.py warns when it is not larger.
+app.config['DB_POOL_SIZE'] = int(os.getenv("DB_POOL_SIZE", 8))  # Also the number of async DB threads
+app.config['ASGI_THREADS'] = int(os.getenv("ASGI_THREADS", 32))  # Requests run at once per ASGI worker (asgi.py)
+app.config['ASGI_SEND_QUEUE_SIZE'] = 32  # Response chunks queued per request before its thread waits
+app.config['STREAM_CHUNK_SIZE'] = 16 * 1024  # Streamed pages are sent in pieces of about this many bytes
+app.config['PAGE_SIZE'] = int(os.getenv("PAGE_SIZE", 24))  # Listings per marketplace/dashboard page
+app.config['MAX_PAGE_SIZE'] = 100
+app.config['NEARBY_RADIUS_KM'] = 50  # Default ?radius= for ?near= marketplace searches
+app.config['MAX_NEARBY_RADIUS_KM'] = 500
+app.config['IMPORT_BATCH_SIZE'] = 500  # Products inserted per transaction by bulk imports
+app.config['IMPORT_MAX_IMAGE_SIZE'] = 16 * 1024 * 1024  # Largest image extracted from an import's zip archive
+app.config['ORDER_ARCHIVE_AFTER_DAYS'] = 90  # Completed orders older than this move to orders_archive
+app.config['JOB_WORKERS'] = int(os.getenv("JOB_WORKERS", 2))  # Processes started by `flask worker`
+app.config['JOB_BATCH_SIZE'] = 20  # Jobs leased per round trip
+app.config['JOB_VISIBILITY_TIMEOUT'] = 60  # Seconds before an unfinished leased job is handed out again
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_RETRY_DELAY'] = 5  # Seconds before the first retry; doubles with each attempt
+app.config['JOB_MAX_RETRY_DELAY'] = 600
+app.config['JOB_POLL_INTERVAL'] = 1.0  # Seconds an idle worker waits before looking again
+app.config['API_MAX_IDS'] = 100  # Products per /api/v1/products request
+app.config['API_GZIP_MIN_SIZE'] = 512  # Smaller API responses are sent uncompressed
+# Without CACHE_REDIS_URL every worker process caches and invalidates on its own, so with several
+# workers an edit made through one can take up to CACHE_TTL seconds to show on the others
+app.config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 300))  # Seconds a cached product or page stays fresh
+app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+app.config['CACHE_REDIS_URL'] = os.getenv("CACHE_REDIS_URL")  # Optional shared cache for multi-worker deployments
+
+# Logging Configuration: per-step logs are DEBUG; each request gets one JSON line
+app.config['LOG_LEVEL'] = os.getenv("LOG_LEVEL", "INFO")
+app.config['REQUEST_LOG_SAMPLE_RATE'] = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", 1.0))
+app.config['REQUEST_LOG_SAMPLE_RATES'] = {'static': 0.01, 'marketplace': 0.1}  # High-volume endpoints
+app.config['SLOW_QUERY_MS'] = float(os.environ["SLOW_QUERY_MS"]) if os.getenv("SLOW_QUERY_MS") else None
+app.config['N_PLUS_ONE_THRESHOLD'] = 5  # Flag requests that repeat one statement this often
+
+request_log.init_app(app)
+metrics.init_app(app)
+database.init_app(app)
+sessions.init_app(app)
+cache.init_app(app)
+auth.init_app(app)
+images.init_app(app)
+assets.init_app(app)
+api.init_app(app)
 
 # Initialize the database using the command from database.py
 @app.cli.command('initdb')
 def initdb_command():
     """Initialize the database."""
     logging.info("Initializing the database...")
-    init_db()
+    if database.get_pool(app).dialect == 'postgresql':
+        import postgres
+        postgres.init_schema(app.config['DATABASE_URL'])
+    else:
+        init_db(app.config['DATABASE'])
     logging.info("Database initialized successfully.")
 
+# Apply pending schema migrations without touching existing data
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, help="Stop after this version.")
+@click.option('--status', is_flag=True, help="List applied and pending migrations, then exit.")
+@click.option('--batch-size', default=1000, show_default=True, help="Rows per backfill transaction.")
+@click.option('--pause', default=0.0, show_default=True, help="Seconds to wait between backfill batches.")
+def migrate_command(target, status, batch_size, pause):
+    """Upgrade the database schema in place."""
+    pool = database.get_pool(app)
+    conn = pool.acquire()
+    try:
+        migrator = Migrator(conn, batch_size=batch_size, pause=pause)
+        if status:
+            applied = migrator.applied()
+            for version, step in sorted(MIGRATIONS.items()):
+                click.echo(f"{'applied' if version in applied else 'pending'}  {version:04d} {step.name}")
+            return
+        done = migrator.migrate(target)
+        logging.info("Applied %d migration(s).", len(done))
+    finally:
+        pool.release(conn)
+
+# Recompute the dashboard aggregates from products and orders
+@app.cli.command('rebuild-stats')
+@click.option('--batch-size', default=1000, show_default=True, help="Products recomputed per transaction.")
+def rebuild_stats_command(batch_size):
+    """Rebuild the dashboard totals, the marketplace facets and the best-seller rankings."""
+    pool = database.get_pool(app)
+    conn = pool.acquire()
+    try:
+        repos = get_repositories(conn)
+        counted = repos.stats.rebuild(batch_size=batch_size)
+        logging.info("Rebuilt dashboard totals for %d products.", counted)
+        counted = repos.facets.rebuild()
+        logging.info("Rebuilt %d marketplace facet counts.", counted)
+        counted = repos.rankings.rebuild()
+        logging.info("Rebuilt the best-seller rankings of %d products.", counted)
+    finally:
+        pool.release(conn)
+    get_cache(app).invalidate_products()
+
+# Move old completed orders to the archive; meant to run daily from cron
+@app.cli.command('archive-orders')
+@click.option('--older-than-days', default=app.config['ORDER_ARCHIVE_AFTER_DAYS'], show_default=True, type=float,
+              help="Archive orders completed at least this long ago.")
+@click.option('--batch-size', default=1000, show_default=True, help="Orders moved per transaction.")
+@click.option('--pause', default=0.0, show_default=True, help="Seconds to wait between batches.")
+def archive_orders_command(older_than_days, batch_size, pause):
+    """Move old completed orders out of the orders table."""
+    completed_before = time.time() - older_than_days * 86400
+    pool = database.get_pool(app)
+    conn = pool.acquire()
+    try:
+        repos = get_repositories(conn)
+        archived = 0
+        while True:
+            moved = repos.orders.archive(completed_before, batch_size)
+            archived += moved
+            logging.debug("Archived %d orders so far.", archived)
+            if moved < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        logging.info("Archived %d orders completed over %g days ago.", archived, older_than_days)
+    finally:
+        pool.release(conn)
+
+# Apply the time decay to the trending scores; meant to run hourly from cron
+@app.cli.command('compact-rankings')
+def compact_rankings_command():
+    """Decay the trending scores up to now and drop those that have faded away."""
+    pool = database.get_pool(app)
+    conn = pool.acquire()
+    try:
+        trending = get_repositories(conn).rankings.compact()
+        logging.info("Compacted the trending scores; %d products are still trending.", trending)
+    finally:
+        pool.release(conn)
+    get_cache(app).invalidate_products()
+
+# Run queued background jobs, e.g. the notifications queued at checkout
+@app.cli.command('worker')
+@click.option('--processes', default=app.config['JOB_WORKERS'], show_default=True,
+              help="Worker processes; 0 runs one worker in this process.")
+@click.option('--batch-size', default=app.config['JOB_BATCH_SIZE'], show_default=True, help="Jobs leased at a time.")
+@click.option('--burst', is_flag=True, help="Exit once no job is due instead of waiting for more.")
+def worker_command(processes, batch_size, burst):
+    """Run background jobs until interrupted."""
+    jobs.run_workers(app, processes, burst, batch_size)
+
+# Bulk-import products for one farmer; larger files than the upload form allows
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--farmer', 'email', required=True, help="Email of the farmer the products belong to.")
+@click.option('--images', type=click.Path(exists=True, dir_okay=False), help="Zip archive of the images named in the file.")
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), help="Defaults to the file extension.")
+@click.option('--batch-size', default=app.config['IMPORT_BATCH_SIZE'], show_default=True, help="Rows per transaction.")
+def import_products_command(path, email, images, fmt, batch_size):
+    """Import products from a CSV or JSONL file."""
+    fmt = fmt or bulk.detect_format(path)
+    if fmt is None:
+        raise click.UsageError("Cannot tell the file format from its name; pass --format.")
+    pool = database.get_pool(app)
+    conn = pool.acquire()
+    try:
+        repos = get_repositories(conn)
+        farmer = repos.users.by_email(email)
+        if farmer is None or farmer['role'] != 'farmer':
+            raise click.UsageError(f"{email} is not a farmer.")
+        with open(path, 'rb') as stream:
+            importer = bulk.ProductImporter(repos, farmer['id'], get_image_pipeline(app), images=images,
+                                            batch_size=batch_size,
+                                            max_image_size=app.config['IMPORT_MAX_IMAGE_SIZE'])
+            report = importer.run(bulk.read_rows(stream, fmt))
+    finally:
+        pool.release(conn)
+    get_image_pipeline(app).shutdown()  # Let queued images finish before the process exits
+    get_cache(app).invalidate_products()
+    for line_number, message in report.errors:
+        logging.warning("Line %s: %s", line_number or '-', message)
+    logging.info("Imported %d products; %d rows rejected.", report.imported, report.failed)
+
 # Ensure the uploads folder exists
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
-    logging.info(f"Uploads folder created at {app.config['UPLOAD_FOLDER']}.")
+    logging.info("Uploads folder created at %s.", app.config['UPLOAD_FOLDER'])
 
 # Helper function to check allowed file types
 def allowed_file(filename):
     allowed = '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-    logging.debug(f"File '{filename}' allowed: {allowed}")
+    logging.debug("File '%s' allowed: %s", filename, allowed)
     return allowed
 
-# Database connection helper
-def get_db_connection():
-    try:
-        logging.info("Connecting to the database...")
-        conn = sqlite3.connect(app.config['DATABASE'])
-        conn.row_factory = sqlite3.Row
-        logging.info("Database connection successful.")
-        return conn
-    except sqlite3.Error as e:
-        logging.error(f"Database connection error: {e}")
-        return None
+# Helper to stream a template; the async views hand it rows already fetched on the executor
+def stream_page(template_name, **context):
+    # The session cookie is sent before the body, so pop flashed messages now;
+    # Flask caches them for the template's get_flashed_messages() call.
+    get_flashed_messages(with_categories=True)
+    return Response(coalesce(stream_template(template_name, **context), app.config['STREAM_CHUNK_SIZE']),
+                    mimetype='text/html')
+
+# Jinja yields hundreds of tiny strings per page; join them so a page is a few ASGI messages
+# that fit in the send queue, instead of holding a request thread until the client reads it
+def coalesce(chunks, size):
+    pending, length = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(pending)
+            pending, length = [], 0
+    if pending:
+        yield ''.join(pending)
+
+# Marketplace filter choices from FacetRepository.counts(), as lists the cache can store
+def facet_options(counts):
+    prices = counts.get('price', {})
+    return {
+        'categories': [[value, *counts['category'][value]] for value in sorted(counts.get('category', {}))],
+        'prices': [[label, *prices[label]] for label, _, _ in price_buckets() if label in prices],
+        'in_stock': counts.get('all', {}).get('', (0, 0))[1],
+    }
+
+# Product lookups go through the read-through product cache
+def get_product(product_id, repos=None):
+    product_cache = get_cache()
+
+    def load():
+        row = (repos or get_repositories(readonly=True)).products.get(product_id)
+        return dict(row) if row else None
+
+    return product_cache.get_or_load(product_cache.product_key(product_id), load)
 
 # Routes
 @app.route('/')
 def index():
-    logging.info("Rendering index page.")
+    logging.debug("Rendering index page.")
     return render_template('index.html')
 
 @app.route('/signup', methods=['GET', 'POST'])
@@ -70,27 +301,28 @@ def signup():
             flash('All fields are required.', 'danger')
             return redirect(url_for('signup'))
 
-        hashed_password = generate_password_hash(password)
-        logging.info("Password hashed successfully.")
+        if not login_allowed(request.remote_addr, None):
+            flash('Too many attempts. Please wait a minute and try again.', 'danger')
+            return render_template('signup.html'), 429
+        try:
+            hashed_password = get_password_hasher().hash(password)
+        except HasherBusy:
+            logging.warning("Signup rejected: password hashing is saturated.")
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template('signup.html'), 503, {'Retry-After': '5'}
+        logging.debug("Password hashed successfully.")
 
         # Insert into the database
-        conn = get_db_connection()
-        if conn:
-            try:
-                logging.info("Inserting new user into the database...")
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)",
-                               (name, email, hashed_password, role))
-                conn.commit()
-                logging.info("User signed up successfully.")
-                flash('Signup successful! Please login.', 'success')
-            except sqlite3.Error as e:
-                logging.error(f"Database error during signup: {e}")
-                flash(f"Database error: {e}", 'danger')
-            finally:
-                conn.close()
+        try:
+            logging.debug("Inserting new user into the database...")
+            get_repositories().users.create(name, email, hashed_password, role)
+            logging.debug("User signed up successfully.")
+            flash('Signup successful! Please login.', 'success')
+        except DatabaseError as e:
+            logging.error("Database error during signup: %s", e)
+            flash(f"Database error: {e}", 'danger')
         return redirect(url_for('login'))
-    logging.info("Rendering signup page.")
+    logging.debug("Rendering signup page.")
     return render_template('signup.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -99,56 +331,82 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
 
-        conn = get_db_connection()
-        if conn:
-            try:
-                logging.info("Fetching user data from the database...")
-                user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-                conn.close()
-                if user and check_password_hash(user['password'], password):
-                    logging.info(f"User {user['email']} authenticated successfully.")
-                    session.permanent = True
-                    session['user_id'] = user['id']
-                    session['role'] = user['role']
-                    session['name'] = user['name']
-                    if user['role'] == 'farmer':
-                        return redirect(url_for('dashboard'))
-                    else:
-                        return redirect(url_for('marketplace'))
+        # Throttle before the lookup and the (slow) hash check
+        if not login_allowed(request.remote_addr, email):
+            flash('Too many login attempts. Please wait a minute and try again.', 'danger')
+            return render_template('login.html'), 429
+
+        hasher = get_password_hasher()
+        try:
+            logging.debug("Fetching user data from the database...")
+            repos = get_repositories()
+            user = repos.users.by_email(email)
+            if user and hasher.verify(user['password'], password or ''):
+                logging.debug("User %s authenticated successfully.", user['email'])
+                try:
+                    if hasher.needs_rehash(user['password']):
+                        repos.users.set_password(user['id'], hasher.hash(password))
+                        logging.info("Upgraded the password hash of user %s.", user['id'])
+                except HasherBusy:
+                    pass  # Upgrade on a later login instead of failing this one
+                session.regenerate()  # A new session id for the signed-in user
+                session.permanent = True
+                session['user_id'] = user['id']
+                session['role'] = user['role']
+                session['name'] = user['name']
+                if user['role'] == 'farmer':
+                    return redirect(url_for('dashboard'))
                 else:
-                    logging.warning("Invalid email or password.")
-                    flash('Invalid email or password!', 'danger')
-            except sqlite3.Error as e:
-                logging.error(f"Database error during login: {e}")
-                flash(f"Database error: {e}", 'danger')
-    logging.info("Rendering login page.")
+                    return redirect(url_for('marketplace'))
+            else:
+                logging.warning("Invalid email or password.")
+                flash('Invalid email or password!', 'danger')
+        except HasherBusy:
+            logging.warning("Login rejected: password hashing is saturated.")
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+        except DatabaseError as e:
+            logging.error("Database error during login: %s", e)
+            flash(f"Database error: {e}", 'danger')
+    logging.debug("Rendering login page.")
     return render_template('login.html')
 
 @app.route('/logout')
 def logout():
-    logging.info(f"User {session.get('user_id')} logged out.")
+    logging.debug("User %s logged out.", session.get('user_id'))
     session.clear()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
-def dashboard():
+async def dashboard():
     if 'user_id' not in session or session.get('role') != 'farmer':
         logging.warning("Unauthorized access to dashboard.")
         return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info("Fetching farmer's products and orders...")
-            products = conn.execute("SELECT * FROM products WHERE farmer_id = ?", (session['user_id'],)).fetchall()
-            orders = conn.execute("SELECT orders.*, products.name AS product_name FROM orders JOIN products ON orders.product_id = products.id WHERE products.farmer_id = ?", (session['user_id'],)).fetchall()
-            conn.close()
-            logging.info("Farmer's data fetched successfully.")
-            return render_template('dashboard.html', products=products, orders=orders)
-        except sqlite3.Error as e:
-            logging.error(f"Database error while fetching dashboard data: {e}")
-            flash("Database connection error!", "danger")
+
+    per_page = page_size()
+    products_after = parse_id_cursor(request.args.get('products_after'))
+    orders_after = request.args.get('orders_after')
+    orders_cursor = parse_history_cursor(orders_after)
+
+    try:
+        logging.debug("Fetching farmer's products and orders...")
+        # The totals and both pages are independent, so fetch them concurrently. Each page is
+        # fetched in full rather than streamed off a cursor, because run_repos returns its
+        # connection to the pool; page_size() caps that at MAX_PAGE_SIZE + 1 rows per page.
+        farmer_id = session['user_id']
+        stats, products, orders = await asyncio.gather(
+            run_repos(lambda repos: repos.stats.for_farmer(farmer_id)),
+            run_repos(lambda repos: repos.products.for_farmer(farmer_id, products_after, per_page + 1)),
+            run_repos(lambda repos: repos.orders.for_farmer(farmer_id, orders_cursor, per_page + 1)),
+        )
+        logging.debug("Farmer's data fetched.")
+        return stream_page('dashboard.html', stats=stats, products=KeysetPage(products, per_page),
+                           orders=KeysetPage(orders, per_page, key=history_cursor), products_after=products_after,
+                           orders_after=orders_after)
+    except DatabaseError as e:
+        logging.error("Database error while fetching dashboard data: %s", e)
+        flash("Database connection error!", "danger")
     return redirect(url_for('index'))
 
 @app.route('/addproduct', methods=['GET', 'POST'])
@@ -167,37 +425,135 @@ def addproduct():
         category = request.form['category']
         contact = request.form['contact']
 
-        # Handle file upload
-        image = request.files.get('image')
-        image_filename = None
-        if image and allowed_file(image.filename):
-            image_filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], image_filename))
-            logging.info(f"Image '{image_filename}' uploaded successfully.")
-
         if not name or not price or not category:
             logging.warning("Add product failed: Missing required fields.")
             flash('Name, price, and category are required!', 'danger')
             return redirect(request.url)
+        try:
+            price, quantity = float(price), int(quantity or 0)
+        except ValueError:
+            logging.warning("Add product failed: Invalid price or quantity.")
+            flash('Price and quantity must be numbers!', 'danger')
+            return redirect(request.url)
+        if price < 0 or quantity < 0:
+            logging.warning("Add product failed: Negative price or quantity.")
+            flash('Price and quantity cannot be negative!', 'danger')
+            return redirect(request.url)
+        try:
+            # Blank coordinates mean the product is at the farm
+            latitude, longitude = geo.coordinates(request.form.get('latitude'), request.form.get('longitude'))
+        except ValueError as e:
+            logging.warning("Add product failed: %s", e)
+            flash(f"Invalid location: {e}", 'danger')
+            return redirect(request.url)
+
+        # Handle file upload: resizing and metadata stripping happen on the image pool,
+        # the product is stored with the content-hashed name straight away
+        image = request.files.get('image')
+        image_filename = None
+        if image and allowed_file(image.filename):
+            try:
+                image_filename = get_image_pipeline().submit(image.stream)
+            except ImagePipelineBusy as e:
+                logging.warning("Add product failed: image pipeline busy (%s).", e)
+                flash('Too many images are being processed right now. Please try again shortly.', 'danger')
+                return redirect(request.url)
+            if image_filename is None:
+                logging.warning("Add product failed: '%s' is not a valid image.", image.filename)
+                flash('The uploaded file is not a valid image.', 'danger')
+                return redirect(request.url)
+            logging.debug("Image '%s' queued for processing as '%s'.", image.filename, image_filename)
 
-        conn = get_db_connection()
         try:
-            logging.info("Inserting new product into the database...")
-            conn.execute('''INSERT INTO products (name, price, quantity, description, contact, image, farmer_id, category)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-                         (name, price, quantity, description, contact, image_filename, farmer_id, category))
-            conn.commit()
-            logging.info("Product added successfully.")
+            logging.debug("Inserting new product into the database...")
+            get_repositories().products.create(name, price, quantity, description, contact,
+                                               image_filename, farmer_id, category, latitude, longitude)
+            logging.debug("Product added successfully.")
+            get_cache().invalidate_products()
             flash('Product added successfully!', 'success')
-        except sqlite3.Error as e:
-            logging.error(f"Error adding product: {e}")
+        except DatabaseError as e:
+            logging.error("Error adding product: %s", e)
             flash(f"Error adding product: {e}", 'danger')
-        finally:
-            conn.close()
         return redirect(url_for('dashboard'))
-    logging.info("Rendering add product page.")
+    logging.debug("Rendering add product page.")
     return render_template('addproduct.html')
 
+@app.route('/farm_location', methods=['POST'])
+def farm_location():
+    """Set the farm's coordinates, used for products without a location of their own."""
+    if 'user_id' not in session or session.get('role') != 'farmer':
+        logging.warning("Unauthorized access to farm location.")
+        return redirect(url_for('login'))
+
+    try:
+        latitude, longitude = geo.coordinates(request.form.get('latitude'), request.form.get('longitude'))
+    except ValueError as e:
+        flash(f"Invalid location: {e}", 'danger')
+        return redirect(url_for('dashboard'))
+    try:
+        get_repositories().users.set_location(session['user_id'], latitude, longitude)
+        get_cache().invalidate_products()
+        logging.debug("Farm location of user %s set to %s, %s.", session['user_id'], latitude, longitude)
+        flash('Farm location saved.', 'success')
+    except DatabaseError as e:
+        logging.error("Database error while saving farm location: %s", e)
+        flash(f"Database error: {e}", 'danger')
+    return redirect(url_for('dashboard'))
+
+@app.route('/import_products', methods=['GET', 'POST'])
+def import_products():
+    if 'user_id' not in session or session.get('role') != 'farmer':
+        logging.warning("Unauthorized access to import products.")
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        fmt = bulk.detect_format(upload.filename) if upload and upload.filename else None
+        if fmt is None:
+            flash('Please upload a .csv or .jsonl file.', 'danger')
+            return redirect(request.url)
+        images = request.files.get('images')
+        if images and images.filename and not images.filename.lower().endswith('.zip'):
+            flash('Images must be uploaded as a .zip archive.', 'danger')
+            return redirect(request.url)
+
+        try:
+            importer = bulk.ProductImporter(get_repositories(), session['user_id'], get_image_pipeline(),
+                                            images=images.stream if images and images.filename else None,
+                                            batch_size=app.config['IMPORT_BATCH_SIZE'],
+                                            max_image_size=app.config['IMPORT_MAX_IMAGE_SIZE'])
+        except zipfile.BadZipFile:
+            flash('The images archive is not a valid zip file.', 'danger')
+            return redirect(request.url)
+        report = importer.run(bulk.read_rows(upload.stream, fmt))
+        logging.debug("Imported %d products, rejected %d rows.", report.imported, report.failed)
+        if report.imported:
+            get_cache().invalidate_products()
+        flash(f"Imported {report.imported} products, {report.failed} rows rejected.",
+              'success' if not report.failed else 'warning')
+        return render_template('import_products.html', report=report)
+    logging.debug("Rendering import products page.")
+    return render_template('import_products.html', report=None)
+
+@app.route('/export/<any(products, orders):kind>.<any(csv, jsonl):fmt>')
+def export(kind, fmt):
+    """Stream the farmer's products or orders, a page of rows at a time."""
+    if 'user_id' not in session or session.get('role') != 'farmer':
+        logging.warning("Unauthorized access to export.")
+        return redirect(url_for('login'))
+
+    farmer_id = session['user_id']
+    repos = get_repositories()
+    if kind == 'products':
+        fetch_page, columns = repos.products.export_page, bulk.PRODUCT_EXPORT_COLUMNS
+    else:
+        fetch_page, columns = repos.orders.export_page, bulk.ORDER_EXPORT_COLUMNS
+    rows = bulk.iter_pages(lambda after, limit: fetch_page(farmer_id, after, limit))
+    logging.debug("Exporting %s for farmer %s as %s.", kind, farmer_id, fmt)
+    return Response(stream_with_context(bulk.export_lines(rows, columns, fmt)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
 @app.route('/delete_product/<int:product_id>')
 
 def delete_product(product_id):
@@ -205,146 +561,185 @@ def delete_product(product_id):
         logging.warning("Unauthorized access to delete product.")
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info(f"Deleting product with ID {product_id}...")
-            conn.execute("DELETE FROM products WHERE id = ? AND farmer_id = ?", (product_id, session['user_id']))
-            conn.commit()
-            logging.info("Product deleted successfully.")
-            flash('Product deleted successfully!', 'info')
-        except sqlite3.Error as e:
-            logging.error(f"Error deleting product: {e}")
-            flash(f"Database error: {e}", 'danger')
-        finally:
-            conn.close()
+    try:
+        logging.debug("Deleting product with ID %s...", product_id)
+        get_repositories().products.delete(product_id, session['user_id'])
+        get_cache().invalidate_products([product_id])
+        logging.debug("Product deleted successfully.")
+        flash('Product deleted successfully!', 'info')
+    except DatabaseError as e:
+        logging.error("Error deleting product: %s", e)
+        flash(f"Database error: {e}", 'danger')
     return redirect(url_for('dashboard'))
 
 @app.route('/marketplace')
-def marketplace():
+async def marketplace():
     """Display the marketplace for all users."""
     search_query = request.args.get('search', '').strip()
     category_filter = request.args.get('category', '').strip()
-
-    conn = get_db_connection()
-    products = []
-    if conn:
-        try:
-            logging.info("Fetching products from the marketplace...")
-            query = "SELECT * FROM products WHERE 1=1"
-            params = []
-
-            if search_query:
-                query += " AND name LIKE ?"
-                params.append(f"%{search_query}%")
-            
-            if category_filter:
-                query += " AND category = ?"
-                params.append(category_filter)
-            
-            products = conn.execute(query, params).fetchall()
-            logging.info("Products fetched successfully.")
-        except sqlite3.Error as e:
-            logging.error(f"Database error while fetching products: {e}")
-            flash(f"Database error: {e}", 'danger')
-        finally:
-            conn.close()
+    price_filter = request.args.get('price', '').strip()
+    price = price_range(price_filter)
+    if price is None:
+        price_filter = ''
+    in_stock = request.args.get('in_stock') == '1'
+    sort = request.args.get('sort', '').strip()
+    if sort not in RANKINGS:
+        sort = ''
+    near = geo.parse_point(request.args.get('near'))
+    radius = request.args.get('radius', app.config['NEARBY_RADIUS_KM'], type=float)
+    radius = max(0.1, min(radius, app.config['MAX_NEARBY_RADIUS_KM']))
+
+    per_page = page_size()
+    after = request.args.get('after', '')
 
     # Check if the user is logged in (optional, for displaying user-specific features)
     is_logged_in = 'user_id' in session and session.get('role') == 'customer'
 
-    return render_template('marketplace.html', products=products, is_logged_in=is_logged_in)
+    # Serve the rendered cards from the fragment cache when this page is unchanged
+    product_cache = get_cache()
+    fragment_key = product_cache.catalogue_key('marketplace', category_filter, price_filter, in_stock, sort, search_query,
+                                               near, radius if near else None, after, per_page, is_logged_in)
+    filters = dict(search=search_query, category=category_filter, price=price_filter, in_stock=in_stock,
+                   sort=sort, near=near, radius=radius)
+    # Facet counts are maintained on write, so this is one small read whatever the catalogue size
+    facets_key = product_cache.catalogue_key('facets')
+    facets = product_cache.get(facets_key)
+    if facets is None:
+        try:
+            facets = facet_options(await run_repos(lambda repos: repos.facets.counts(), readonly=True))
+            product_cache.set(facets_key, facets)
+        except DatabaseError as e:
+            logging.error("Database error while fetching facets: %s", e)
+            facets = facet_options({})
+    fragment = product_cache.get(fragment_key)
+    if fragment is not None:
+        return stream_page('marketplace.html', products=RenderedPage(Markup(fragment['html']), fragment['next_cursor']),
+                           is_logged_in=is_logged_in, facets=facets, **filters)
+
+    def cache_fragment(rows, next_cursor):
+        html = render_template('_product_cards.html', products=rows, is_logged_in=is_logged_in, near=near)
+        product_cache.set(fragment_key, {'html': html, 'next_cursor': next_cursor})
+
+    products = []
+    try:
+        logging.debug("Fetching products from the marketplace...")
+        terms = search_terms(search_query)
+        # Catalogue reads tolerate replica lag, so they may use a read replica. The page is
+        # fetched in full on the executor rather than streamed off a cursor, because the
+        # connection goes back to the pool when the call returns; page_size() caps that at
+        # MAX_PAGE_SIZE + 1 rows.
+        if near:
+            # Nearest first, paged on (distance, id); search and category narrow the results
+            cursor = parse_ranked_cursor(after)
+            rows = await run_repos(lambda repos: repos.products.nearby_page(near, radius, terms, category_filter,
+                                                                            cursor, per_page + 1, price, in_stock),
+                                   readonly=True)
+            key = ranked_cursor
+        elif terms:
+            # Ranked full-text search, paged on (score, id)
+            cursor = parse_ranked_cursor(after)
+            rows = await run_repos(lambda repos: repos.products.search_page(terms, category_filter, cursor, per_page + 1,
+                                                                            price, in_stock),
+                                   readonly=True)
+            key = ranked_cursor
+        elif sort:
+            # Served from the precomputed top products, paged on (score, id)
+            cursor = parse_ranked_cursor(after)
+            rows = await run_repos(lambda repos: repos.products.ranked_page(sort, category_filter, cursor, per_page + 1,
+                                                                            price, in_stock),
+                                   readonly=True)
+            key = ranked_cursor
+        else:
+            last_id = parse_id_cursor(after)
+            rows = await run_repos(lambda repos: repos.products.catalogue_page(category_filter, last_id, per_page + 1,
+                                                                               price, in_stock),
+                                   readonly=True)
+            key = lambda row: row['id']
+        products = KeysetPage(rows, per_page, key=key, on_complete=cache_fragment)
+        logging.debug("Fetched %d products.", len(rows))
+    except DatabaseError as e:
+        logging.error("Database error while fetching products: %s", e)
+        flash(f"Database error: {e}", 'danger')
+
+    return stream_page('marketplace.html', products=products, is_logged_in=is_logged_in, facets=facets, **filters)
 
 @app.route('/productpage/<int:product_id>', methods=['GET', 'POST'])
-def product_page(product_id):
+async def product_page(product_id):
     if 'user_id' not in session or session.get('role') != 'customer':
         logging.warning("Unauthorized access to product page.")
         return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    if conn:
-        if request.method == 'GET':
-            # Fetch product details to display
-            logging.info(f"Fetching product details for product ID {product_id}...")
-            product = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
-            conn.close()
-            if not product:
-                logging.warning(f"Product with ID {product_id} not found.")
-                flash("Product not found!", "warning")
-                return redirect(url_for('marketplace'))
-            logging.info(f"Product with ID {product_id} fetched successfully.")
-            return render_template('productpage.html', product=product)
-
-        elif request.method == 'POST':
-            # Add to Cart functionality
-            quantity = int(request.form.get('quantity', 1))
-            cart = session.get('cart', {})
-            
-            # Update the cart
-            if str(product_id) in cart:
-                cart[str(product_id)] += quantity
-            else:
-                cart[str(product_id)] = quantity
 
-            session['cart'] = cart
-            session.modified = True
-            logging.info(f"Product ID {product_id} added to cart with quantity {quantity}. Current cart: {cart}.")
+    if request.method == 'GET':
+        # Fetch product details to display
+        logging.debug("Fetching product details for product ID %s...", product_id)
+        try:
+            product = await run_repos(lambda repos: get_product(product_id, repos), readonly=True)
+        except DatabaseError as e:
+            logging.error("Database error while fetching product %s: %s", product_id, e)
+            flash("Database connection error!", "danger")
+            return redirect(url_for('marketplace'))
+        if not product:
+            logging.warning("Product with ID %s not found.", product_id)
+            flash("Product not found!", "warning")
+            return redirect(url_for('marketplace'))
+        logging.debug("Product with ID %s fetched successfully.", product_id)
+        return render_template('productpage.html', product=product)
+
+    elif request.method == 'POST':
+        # Add to Cart functionality (stored in the cart table, not the session cookie)
+        quantity = request.form.get('quantity', 1, type=int)
+        try:
+            if quantity <= 0 or not await run_repos(lambda repos: get_product(product_id, repos), readonly=True):
+                flash("Invalid product or quantity!", "danger")
+                return redirect(url_for('marketplace'))
+            customer_id = session['user_id']
+            new_quantity = await run_repos(lambda repos: repos.cart.add(customer_id, product_id, quantity))
+            logging.debug("Product ID %s added to cart with quantity %s. Now %s in cart.", product_id, quantity, new_quantity)
             flash('Product added to cart successfully!', 'success')
-            return redirect(url_for('product_page', product_id=product_id))
+        except DatabaseError as e:
+            logging.error("Database error while adding product to cart: %s", e)
+            flash("An error occurred while adding the product to your cart.", "danger")
+        return redirect(url_for('product_page', product_id=product_id))
 
     return redirect(url_for('marketplace'))
 
 
 @app.route('/orders')
 
-def orders():
+async def orders():
     if 'user_id' not in session or session.get('role') != 'customer':
-        logging.warning(f"Unauthorized access attempt to orders page by user {session.get('user_id')}.")
+        logging.warning("Unauthorized access attempt to orders page by user %s.", session.get('user_id'))
         return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info(f"Fetching orders for customer {session['user_id']}...")
-            orders = conn.execute("""
-                SELECT orders.id, products.name AS product_name, orders.quantity, orders.payment_option, orders.status
-                FROM orders
-                JOIN products ON orders.product_id = products.id
-                WHERE orders.customer_id = ?
-            """, (session['user_id'],)).fetchall()
-            conn.close()
-            logging.info(f"Fetched {len(orders)} orders for customer {session['user_id']}.")
-            return render_template('orders.html', orders=orders)
-        except sqlite3.Error as e:
-            logging.error(f"Database error while fetching orders: {e}")
-            flash(f"Database error: {e}", "danger")
-            conn.close()
-            return redirect(url_for('index'))
-    else:
-        logging.error("Database connection error in orders route.")
-        flash("Database connection error!", "danger")
+
+    per_page = page_size()
+    after = parse_history_cursor(request.args.get('after'))
+    try:
+        logging.debug("Fetching orders for customer %s...", session['user_id'])
+        customer_id = session['user_id']
+        # Newest first; older pages continue into the archive
+        orders = await run_repos(lambda repos: repos.orders.for_customer(customer_id, after, per_page + 1))
+        logging.debug("Fetched %s orders for customer %s.", len(orders), session['user_id'])
+        return render_template('orders.html', orders=KeysetPage(orders, per_page, key=history_cursor))
+    except DatabaseError as e:
+        logging.error("Database error while fetching orders: %s", e)
+        flash(f"Database error: {e}", "danger")
         return redirect(url_for('index'))
 
 @app.route('/delete_order/<int:order_id>')
 
 def delete_order(order_id):
     if 'user_id' not in session or session.get('role') != 'customer':
-        logging.warning(f"Unauthorized access attempt to delete order with ID {order_id} by user {session.get('user_id')}.")
+        logging.warning("Unauthorized access attempt to delete order with ID %s by user %s.", order_id, session.get('user_id'))
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info(f"Attempting to delete order with ID {order_id} for customer {session['user_id']}...")
-            conn.execute("DELETE FROM orders WHERE id = ? AND customer_id = ?", (order_id, session['user_id']))
-            conn.commit()
-            logging.info(f"Order with ID {order_id} deleted successfully for customer {session['user_id']}.")
-            flash('Order deleted successfully!', 'info')
-        except sqlite3.Error as e:
-            logging.error(f"Database error while deleting order with ID {order_id}: {e}")
-            flash(f"Database error: {e}", 'danger')
-        finally:
-            conn.close()
+    try:
+        logging.debug("Attempting to delete order with ID %s for customer %s...", order_id, session['user_id'])
+        get_repositories().orders.delete(order_id, session['user_id'])
+        logging.debug("Order with ID %s deleted successfully for customer %s.", order_id, session['user_id'])
+        flash('Order deleted successfully!', 'info')
+    except DatabaseError as e:
+        logging.error("Database error while deleting order with ID %s: %s", order_id, e)
+        flash(f"Database error: {e}", 'danger')
     return redirect(url_for('orders'))
 
 @app.route('/confirm_delivery/<int:order_id>', methods=['GET'])
@@ -352,80 +747,51 @@ def delete_order(order_id):
 def confirm_delivery(order_id):
     # Check if user is logged in and is a customer
     if 'user_id' not in session or session.get('role') != 'customer':
-        logging.warning(f"Unauthorized access attempt to confirm delivery for order ID {order_id} by user {session.get('user_id')}.")
+        logging.warning("Unauthorized access attempt to confirm delivery for order ID %s by user %s.", order_id, session.get('user_id'))
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info(f"Attempting to confirm delivery for order with ID {order_id} for customer {session['user_id']}...")
-
-            # Update the status of the order to 'Completed' for the given order_id and customer_id
-            # Only change status if the current status is 'Pending'
-            result = conn.execute("""
-                UPDATE orders
-                SET status = 'Completed'
-                WHERE id = ? AND customer_id = ? AND status = 'Pending'
-            """, (order_id, session['user_id']))
-            conn.commit()
-
-            # Check if the update was successful (i.e., any rows were affected)
-            if conn.total_changes > 0:
-                logging.info(f"Order with ID {order_id} confirmed as delivered for customer {session['user_id']}.")
-                flash('Order confirmed as delivered!', 'info')
-            else:
-                logging.warning(f"Order with ID {order_id} was not in Pending status or was not found for customer {session['user_id']}.")
-                flash('No pending order found to confirm delivery or the order has already been completed.', 'warning')
+    try:
+        logging.debug("Attempting to confirm delivery for order with ID %s for customer %s...", order_id, session['user_id'])
+        # Only a Pending order of this customer is changed to 'Completed'
+        if get_repositories().orders.confirm_delivery(order_id, session['user_id']):
+            logging.debug("Order with ID %s confirmed as delivered for customer %s.", order_id, session['user_id'])
+            flash('Order confirmed as delivered!', 'info')
+        else:
+            logging.warning("Order with ID %s was not in Pending status or was not found for customer %s.", order_id, session['user_id'])
+            flash('No pending order found to confirm delivery or the order has already been completed.', 'warning')
 
-        except sqlite3.Error as e:
-            logging.error(f"Database error while confirming delivery for order with ID {order_id}: {e}")
-            flash(f"Database error: {e}", 'danger')
-        finally:
-            conn.close()
+    except DatabaseError as e:
+        logging.error("Database error while confirming delivery for order with ID %s: %s", order_id, e)
+        flash(f"Database error: {e}", 'danger')
 
     return redirect(url_for('orders'))
 
 @app.route('/cart')
 
-def cart():
+async def cart():
     """Display items in the user's cart."""
     if 'user_id' not in session or session.get('role') != 'customer':
         logging.warning("Unauthorized access to cart.")
         return redirect(url_for('login'))
-    
-    conn = get_db_connection()
+
     cart_items = []
     total_price = 0
-    if conn:
-        try:
-            logging.info("Fetching items from the cart...")
-
-            # Run the query to get cart items along with total price for each item
-            query = """
-                SELECT cart.id AS cart_id, products.name AS product_name, cart.quantity, products.price, 
-                       (cart.quantity * products.price) AS total_price 
-                FROM cart 
-                JOIN products ON cart.product_id = products.id 
-                WHERE cart.customer_id = ?
-            """
-            cart_items = conn.execute(query, (session['user_id'],)).fetchall()
-
-            # Log the fetched cart items
-            logging.info(f"Fetched cart items: {cart_items}")
-
-            # Calculate the total price for all items in the cart
-            total_price = sum(item['total_price'] for item in cart_items)
-            logging.info(f"Total price for the cart: {total_price}")
-
-            conn.close()
-            logging.info("Cart items fetched successfully.")
-        except sqlite3.Error as e:
-            logging.error(f"Database error while fetching cart items: {e}")
-            flash("Database connection error!", "danger")
-            return redirect(url_for('marketplace'))
-    
-    # Log the total price
-    logging.info(f"Final total price: {total_price}")
+    try:
+        logging.debug("Fetching items from the cart...")
+
+        # Cart items along with the total price for each item
+        customer_id = session['user_id']
+        cart_items = await run_repos(lambda repos: repos.cart.items(customer_id))
+
+        # Calculate the total price for all items in the cart
+        total_price = sum(item['total_price'] for item in cart_items)
+        logging.debug("Total price for the cart: %s", total_price)
+
+        logging.debug("Cart items fetched successfully.")
+    except DatabaseError as e:
+        logging.error("Database error while fetching cart items: %s", e)
+        flash("Database connection error!", "danger")
+        return redirect(url_for('marketplace'))
 
     return render_template('cart.html', cart_items=cart_items, total_price=total_price)
 
@@ -444,59 +810,79 @@ def add_to_cart():
 
         # Validate input
         if not product_id or quantity is None or quantity <= 0:
-            logging.error(f"Invalid product or quantity: product_id={product_id}, quantity={quantity}.")
+            logging.error("Invalid product or quantity: product_id=%s, quantity=%s.", product_id, quantity)
             flash("Invalid product or quantity!", "danger")
             return redirect(url_for('marketplace'))
 
-        # Connect to the database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Check if the product exists in the database
-        product = cursor.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+        # Check if the product exists
+        product = get_product(product_id)
         if not product:
-            logging.error(f"Product with ID {product_id} not found in the database.")
+            logging.error("Product with ID %s not found in the database.", product_id)
             flash("Product not found!", "danger")
             return redirect(url_for('marketplace'))
 
-        # Check if the product already exists in the cart
-        cart_item = cursor.execute('''
-            SELECT * FROM cart WHERE customer_id = ? AND product_id = ?
-        ''', (session['user_id'], product_id)).fetchone()
-
-        if cart_item:
-            # If the product is already in the cart, update the quantity
-            new_quantity = cart_item['quantity'] + quantity
-            cursor.execute('''
-                UPDATE cart SET quantity = ? WHERE customer_id = ? AND product_id = ?
-            ''', (new_quantity, session['user_id'], product_id))
-            logging.info(f"Updated quantity of product ID {product_id} in cart. New quantity: {new_quantity}")
+        # Insert the line, or add to its quantity if the product is already in the cart
+        new_quantity = get_repositories().cart.add(session['user_id'], product_id, quantity)
+        if new_quantity > quantity:
+            logging.debug("Updated quantity of product ID %s in cart. New quantity: %s", product_id, new_quantity)
             flash(f"Updated quantity of {product['name']} in your cart.", "success")
         else:
-            # If the product is not in the cart, add a new entry
-            cursor.execute('''
-                INSERT INTO cart (customer_id, product_id, quantity) 
-                VALUES (?, ?, ?)
-            ''', (session['user_id'], product_id, quantity))
-            logging.info(f"Added product ID {product_id} to cart with quantity {quantity}.")
+            logging.debug("Added product ID %s to cart with quantity %s.", product_id, quantity)
             flash("Product added to your cart!", "success")
 
-        # Commit changes and close connection
-        conn.commit()
-
-    except sqlite3.Error as e:
-        logging.error(f"Database error while adding product to cart: {e}")
+    except DatabaseError as e:
+        logging.error("Database error while adding product to cart: %s", e)
         flash("An error occurred while adding the product to your cart.", "danger")
     except Exception as e:
-        logging.error(f"Unexpected error in add_to_cart route: {e}")
+        logging.error("Unexpected error in add_to_cart route: %s", e)
         flash("An unexpected error occurred. Please try again.", "danger")
-    finally:
-        if conn:
-            conn.close()
 
     return redirect(url_for('marketplace'))  # Redirect to the marketplace after adding to the cart
 
 
+@app.route('/update_cart', methods=['POST'])
+
+def update_cart():
+    """Change the quantities of several cart lines in one request."""
+    if 'user_id' not in session or session.get('role') != 'customer':
+        logging.warning("Unauthorized access to update cart.")
+        if request.is_json:
+            return jsonify(error="Login required"), 401
+        return redirect(url_for('login'))
+
+    # JSON clients send {"items": [{"product_id": 1, "quantity": 2}, ...]};
+    # the cart form sends one quantity-<product_id> field per line.
+    quantities = {}
+    try:
+        if request.is_json:
+            for item in request.get_json().get('items', []):
+                quantities[int(item['product_id'])] = int(item['quantity'])
+        else:
+            for field, value in request.form.items():
+                if field.startswith('quantity-'):
+                    quantities[int(field[len('quantity-'):])] = int(value)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        logging.warning("Update cart failed: malformed quantities.")
+        if request.is_json:
+            return jsonify(error="Invalid items"), 400
+        flash("Invalid quantities!", "danger")
+        return redirect(url_for('cart'))
+
+    try:
+        get_repositories().cart.update_many(session['user_id'], quantities)
+        logging.debug("Updated %s cart lines for customer %s.", len(quantities), session['user_id'])
+    except DatabaseError as e:
+        logging.error("Database error while updating cart: %s", e)
+        if request.is_json:
+            return jsonify(error="Database error"), 500
+        flash("Database connection error!", "danger")
+        return redirect(url_for('cart'))
+
+    if request.is_json:
+        return jsonify(updated=len(quantities))
+    flash('Cart updated!', 'info')
+    return redirect(url_for('cart'))
+
 @app.route('/remove_from_cart/<int:cart_id>', methods=['POST'])
 
 def remove_from_cart(cart_id):
@@ -504,20 +890,15 @@ def remove_from_cart(cart_id):
     if 'user_id' not in session or session.get('role') != 'customer':
         logging.warning("Unauthorized access to remove from cart.")
         return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    if conn:
-        try:
-            logging.info(f"Removing item with cart ID {cart_id} from cart...")
-            conn.execute("DELETE FROM cart WHERE id = ? AND customer_id = ?", (cart_id, session['user_id']))
-            conn.commit()
-            logging.info(f"Item with cart ID {cart_id} removed from cart successfully.")
-            flash('Item removed from cart!', 'info')
-        except sqlite3.Error as e:
-            logging.error(f"Database error while removing from cart: {e}")
-            flash("Database connection error!", "danger")
-        finally:
-            conn.close()
+
+    try:
+        logging.debug("Removing item with cart ID %s from cart...", cart_id)
+        get_repositories().cart.remove(cart_id, session['user_id'])
+        logging.debug("Item with cart ID %s removed from cart successfully.", cart_id)
+        flash('Item removed from cart!', 'info')
+    except DatabaseError as e:
+        logging.error("Database error while removing from cart: %s", e)
+        flash("Database connection error!", "danger")
     return redirect(url_for('cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
@@ -531,71 +912,37 @@ def checkout():
 
     # Handle GET request
     if request.method == 'GET':
-        logging.info("GET request to /checkout - redirecting to cart.")
+        logging.debug("GET request to /checkout - redirecting to cart.")
         flash("Please use the checkout button to proceed.", "warning")
         return redirect(url_for('cart'))
 
     # Handle POST request
-    logging.info("POST request received at /checkout.")
-    conn = get_db_connection()
-    if conn:
-        try:
-            # Retrieve payment option from the form
-            payment_option = request.form.get('payment_option')
-            logging.info(f"Received payment option: {payment_option}")
-            if payment_option not in ['credit', 'debit', 'cash']:
-                logging.warning("Invalid payment option selected.")
-                flash("Invalid payment option selected!", "danger")
-                return redirect(url_for('cart'))
-
-            # Fetch cart items
-            cart_items = conn.execute(
-                "SELECT * FROM cart WHERE customer_id = ?", 
-                (session['user_id'],)
-            ).fetchall()
-
-            if not cart_items:
-                logging.warning("No items in the cart during checkout.")
-                flash("Your cart is empty. Add items before checking out.", "danger")
-                return redirect(url_for('cart'))
-
-            # Process each cart item
-            for item in cart_items:
-                product = conn.execute(
-                    "SELECT * FROM products WHERE id = ?", 
-                    (item['product_id'],)
-                ).fetchone()
-
-                if product['quantity'] < item['quantity']:
-                    flash(f"Not enough stock for {product['name']}!", "danger")
-                    return redirect(url_for('cart'))
-
-                # Insert order
-                conn.execute(
-                    """
-                    INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (item['product_id'], session['user_id'], item['quantity'], 
-                     item['quantity'] * product['price'], payment_option)
-                )
-
-                # Update product stock
-                conn.execute(
-                    "UPDATE products SET quantity = quantity - ? WHERE id = ?",
-                    (item['quantity'], item['product_id'])
-                )
-
-            # Clear cart
-            conn.execute("DELETE FROM cart WHERE customer_id = ?", (session['user_id'],))
-            conn.commit()
-            logging.info("Checkout completed successfully.")
-            flash("Checkout successful! Your order has been placed.", "success")
-        except sqlite3.Error as e:
-            logging.error(f"Database error during checkout: {e}")
-            flash("An error occurred during checkout. Please try again.", "danger")
-        finally:
-            conn.close()
+    logging.debug("POST request received at /checkout.")
+    try:
+        # Retrieve payment option from the form
+        payment_option = request.form.get('payment_option')
+        logging.debug("Received payment option: %s", payment_option)
+        if payment_option not in ['credit', 'debit', 'cash']:
+            logging.warning("Invalid payment option selected.")
+            flash("Invalid payment option selected!", "danger")
+            return redirect(url_for('cart'))
+
+        placed, out_of_stock = get_repositories().orders.place(session['user_id'], payment_option)
+        if out_of_stock:
+            logging.warning("Checkout failed: not enough stock for %s.", out_of_stock)
+            flash(f"Not enough stock for {', '.join(out_of_stock)}!", "danger")
+            return redirect(url_for('cart'))
+        if not placed:
+            logging.warning("No items in the cart during checkout.")
+            flash("Your cart is empty. Add items before checking out.", "danger")
+            return redirect(url_for('cart'))
+        get_cache().invalidate_products(placed)
+
+        logging.debug("Checkout completed successfully.")
+        flash("Checkout successful! Your order has been placed.", "success")
+    except DatabaseError as e:
+        logging.error("Database error during checkout: %s", e)
+        flash("An error occurred during checkout. Please try again.", "danger")
 
     return redirect(url_for('orders'))
 
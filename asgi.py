@@ -0,0 +1,25 @@
+"""ASGI entry point.
+
+Runs the Flask app on a pool of ASGI_THREADS threads behind an event loop,
+which handles the sockets and keep-alive connections. Start it with the
+bundled gunicorn settings:
+
+    gunicorn -c gunicorn_asgi.conf.py asgi:application
+"""
+import logging
+
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+# A request holds its thread for as long as the view runs (async views included,
+# Flask runs them on the thread), while its body is still arriving, and while the
+# client is more than ASGI_SEND_QUEUE_SIZE chunks behind the response. Pages fit
+# in the queue (see stream_page), so only uploads and long exports pin a thread
+# per slow client; see the sizing note next to ASGI_THREADS.
+application = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'],
+                             send_queue_size=app.config['ASGI_SEND_QUEUE_SIZE'])
+
+if app.config['ASGI_THREADS'] <= app.config['DB_POOL_SIZE']:
+    logging.warning("ASGI_THREADS (%d) should be larger than DB_POOL_SIZE (%d); slow clients can hold every "
+                    "request thread while connections sit idle.", app.config['ASGI_THREADS'], app.config['DB_POOL_SIZE'])
@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+
+from flask import Response, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are produced
+    brotli = None
+
+# Text assets that are kept in memory and precompressed at startup
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+MIN_COMPRESS_SIZE = 512
+
+# Uploads written by the image pipeline are already named after their content
+CONTENT_ADDRESSED = re.compile(r'^uploads/[0-9a-f]{24}-\w+\.\w+$')
+# A fingerprinted name: 'css/style.1a2b3c4d5e6f.css' -> ('css/style', '1a2b3c4d5e6f', '.css')
+HASHED_NAME = re.compile(r'^(.+)\.([0-9a-f]{12})(\.\w+)$')
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _hashed_name(filename, digest):
+    root, ext = posixpath.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+class TextAsset:
+    """A small text asset held in memory with its precompressed variants."""
+
+    def __init__(self, body, digest):
+        self.digest = digest
+        self.bodies = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=11)
+
+
+class AssetManifest:
+    """Maps static filenames to content-hashed URLs and back.
+
+    Text assets are hashed and precompressed when the app starts. Anything
+    else, including uploads added later, is hashed the first time a URL for
+    it is built or requested.
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._hashed = {}  # 'css/style.css' -> 'css/style.1a2b3c4d5e6f.css'
+        self._original = {}  # the reverse mapping, plus the digest
+        self._text = {}  # 'css/style.css' -> TextAsset
+        self._lock = threading.Lock()
+
+    def build(self):
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                if posixpath.splitext(filename)[1] in COMPRESSIBLE:
+                    self._add_text(filename)
+        logging.debug("Fingerprinted %d static text assets.", len(self._text))
+
+    def _add_text(self, filename):
+        with open(os.path.join(self.static_folder, filename), 'rb') as asset:
+            body = asset.read()
+        if filename.endswith('.css'):
+            body = self._rewrite_css(filename, body)
+        digest = _digest(body)
+        self._text[filename] = TextAsset(body, digest)
+        self._register(filename, digest)
+
+    def _rewrite_css(self, filename, body):
+        """Point url(...) references at fingerprinted names so they cache too."""
+        base = posixpath.dirname(filename)
+
+        def replace(match):
+            target = match.group(2)
+            if ':' in target or target.startswith(('/', '#')):
+                return match.group(0)
+            hashed = self.hashed(posixpath.normpath(posixpath.join(base, target)))
+            return "url('{}')".format(posixpath.relpath(hashed, base or '.'))
+
+        return CSS_URL.sub(replace, body.decode('utf-8')).encode('utf-8')
+
+    def _register(self, filename, digest):
+        hashed = _hashed_name(filename, digest)
+        with self._lock:
+            self._hashed[filename] = hashed
+            self._original[hashed] = (filename, digest)
+
+    def hashed(self, filename):
+        """The fingerprinted name for ``filename``, or ``filename`` if it is missing."""
+        hashed = self._hashed.get(filename)
+        if hashed is not None:
+            return hashed
+        if CONTENT_ADDRESSED.match(filename):
+            return filename
+        try:
+            with open(os.path.join(self.static_folder, filename), 'rb') as asset:
+                digest = _digest(asset.read())
+        except OSError:
+            return filename  # Not written yet (e.g. an image still processing); retry next time
+        self._register(filename, digest)
+        return self._hashed[filename]
+
+    def resolve(self, requested):
+        """Return ``(filename, digest)`` for a request path; digest is None if unhashed."""
+        with self._lock:
+            found = self._original.get(requested)
+        if found is not None:
+            return found
+        if CONTENT_ADDRESSED.match(requested):
+            return requested, posixpath.splitext(posixpath.basename(requested))[0]
+        # Other processes (or this one before a restart) may have fingerprinted a file this
+        # one has not linked yet; hash it now and serve it if the digest still matches
+        match = HASHED_NAME.match(requested)
+        if match:
+            filename = match.group(1) + match.group(3)
+            if safe_join(self.static_folder, filename) is not None and self.hashed(filename) == requested:
+                return filename, match.group(2)
+        return requested, None
+
+    def text_asset(self, filename):
+        return self._text.get(filename)
+
+
+def get_manifest(app=None):
+    app = app or current_app
+    return app.extensions['asset_manifest']
+
+
+def _hash_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = get_manifest().hashed(values['filename'])
+
+
+def send_static(filename):
+    """Static handler: immutable caching for fingerprinted URLs, precompressed text."""
+    manifest = get_manifest()
+    max_age = current_app.config.get('ASSET_MAX_AGE', 31536000)
+    filename, digest = manifest.resolve(filename)
+
+    if digest is None:
+        # Unhashed URL: keep Flask's default revalidation behaviour
+        return send_from_directory(manifest.static_folder, filename)
+
+    asset = manifest.text_asset(filename)
+    if asset is not None:
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.bodies and candidate in request.accept_encodings:
+                encoding = candidate
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = Response(asset.bodies[encoding], mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f"{digest}-{encoding}")
+        response = response.make_conditional(request)
+    else:
+        # Without max_age, send_from_directory marks the response no-cache
+        response = send_from_directory(manifest.static_folder, filename, etag=digest, max_age=max_age)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """Fingerprint static assets and take over the ``static`` endpoint."""
+    manifest = AssetManifest(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    manifest.build()
+    app.url_defaults(_hash_static_urls)
+    app.view_functions['static'] = send_static
@@ -0,0 +1,185 @@
+"""Password hashing off the request threads, and login rate limiting.
+
+Password hashes are deliberately slow, so they run in a small process pool
+(``PASSWORD_HASH_WORKERS``) rather than on the request worker. At most
+``PASSWORD_HASH_QUEUE`` hashes wait per process, and never so many that the
+threads waiting on them are more than half of ``ASGI_THREADS``; beyond that
+logins are turned away at once instead of queueing behind a burst, which
+leaves the other request threads and remaining cores to ordinary page
+traffic. A hash keeps its slot until the process has finished it, even when
+the login waiting on it has timed out. The pool uses
+the fork server, so the entry script must be safe to import (gunicorn's and
+flask's are).
+
+Login attempts are also limited per client IP and per email with token
+buckets, checked before the user lookup and any hashing.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Too many hashes are queued; the caller should ask the client to retry."""
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_queue=4, timeout=10.0, max_in_flight=None):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        # Hashes running or queued; each may have a request thread waiting on it
+        self.max_in_flight = workers * (1 + max_queue)
+        if max_in_flight is not None:
+            self.max_in_flight = min(self.max_in_flight, max_in_flight)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._method_prefix = None
+        self._counts = {'hashed': 0, 'verified': 0, 'rejected': 0, 'in_flight': 0}
+
+    def _pool(self):
+        # Started on first use, after gunicorn has forked its workers. The fork
+        # server gives the hashing processes a clean start, free of this
+        # process's threads and locks.
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['werkzeug.security'])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts['rejected'] += 1
+            raise HasherBusy()
+        with self._lock:
+            self._counts['in_flight'] += 1
+        try:
+            future = self._pool().submit(func, *args)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._counts['rejected'] += 1
+            raise HasherBusy() from None
+
+    def _finished(self, future):
+        # Only now is the process free of the hash, whether or not its caller is still waiting
+        with self._lock:
+            self._counts['in_flight'] -= 1
+        self._slots.release()
+
+    def hash(self, password):
+        password_hash = self._run(generate_password_hash, password, self.method)
+        with self._lock:
+            self._counts['hashed'] += 1
+        return password_hash
+
+    def verify(self, password_hash, password):
+        matches = self._run(check_password_hash, password_hash, password)
+        with self._lock:
+            self._counts['verified'] += 1
+        return matches
+
+    def needs_rehash(self, password_hash):
+        """True if ``password_hash`` was made with other parameters than ``method``."""
+        if self._method_prefix is None:
+            # Werkzeug fills in default parameters, so learn the full prefix from a sample hash
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+class RateLimiter:
+    """Token buckets keyed by string: ``limit`` attempts per ``period`` seconds."""
+
+    def __init__(self, limit, period, max_keys=100000):
+        self.limit = limit
+        self.rate = limit / period
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return True
+
+    def _prune(self, now):
+        # Buckets that have refilled are the same as no bucket at all
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.limit]
+        for key in full:
+            del self._buckets[key]
+
+
+def parse_rate(text):
+    """'20/60' -> (20, 60.0): 20 attempts per 60 seconds."""
+    limit, period = text.split('/')
+    return int(limit), float(period)
+
+
+def get_password_hasher(app=None):
+    app = app or current_app
+    return app.extensions['password_hasher']
+
+
+def login_allowed(ip, email, app=None):
+    """Spend one attempt from the IP's and the email's buckets; False if either is empty."""
+    app = app or current_app
+    limiters = app.extensions['login_limiters']
+    if not limiters['ip'].allow(ip):
+        logging.warning("Login rate limit reached for %s.", ip)
+        return False
+    if email and not limiters['email'].allow(email.lower()):
+        logging.warning("Login rate limit reached for %s.", email)
+        return False
+    return True
+
+
+def limiter_stats(app=None):
+    app = app or current_app
+    return {f'{name}_rejected': limiter.rejected for name, limiter in app.extensions['login_limiters'].items()}
+
+
+def init_app(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config.get('PASSWORD_HASH_METHOD', 'scrypt'),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_queue=app.config.get('PASSWORD_HASH_QUEUE', 4),
+        max_in_flight=max(1, app.config.get('ASGI_THREADS', 32) // 2),
+    )
+    app.extensions['login_limiters'] = {
+        'ip': RateLimiter(*parse_rate(app.config.get('LOGIN_RATE_PER_IP', '20/60'))),
+        'email': RateLimiter(*parse_rate(app.config.get('LOGIN_RATE_PER_EMAIL', '5/60'))),
+    }
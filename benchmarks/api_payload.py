@@ -0,0 +1,117 @@
+"""Bytes and round trips of one shopping session: HTML pages vs the JSON API.
+
+Runs the same session against a throwaway database through Flask's test
+client, once through the HTML routes (following every redirect) and once
+through /api/v1 with gzip accepted: look at a few products, put them in the
+cart, change a quantity, then look at the cart and the order history. A
+return visit then re-reads the same products, cart and orders; the API
+client revalidates them with If-None-Match. Bytes are response bodies as
+sent, so HTML that a proxy would gzip is also shown compressed.
+
+    python benchmarks/api_payload.py --products 200 --viewed 5 --orders 20
+"""
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Password hashing runs in worker processes that re-import this module
+os.environ.setdefault('DATABASE', os.path.join(tempfile.mkdtemp(), 'api_payload.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from app import app  # noqa: E402
+from database import init_db  # noqa: E402
+
+
+class Meter:
+    """A test client that counts requests and response body bytes."""
+
+    def __init__(self, client, **headers):
+        self.client = client
+        self.headers = headers
+        self.requests = 0
+        self.bytes = 0
+        self.gzipped = 0
+        self.etags = {}
+
+    def send(self, method, url, follow=True, revalidate=False, **kwargs):
+        headers = dict(self.headers)
+        if revalidate and url in self.etags:
+            headers['If-None-Match'] = self.etags[url]
+        response = self.client.open(url, method=method, headers=headers, **kwargs)
+        self.requests += 1
+        self.bytes += len(response.data)
+        compressed = response.headers.get('Content-Encoding') == 'gzip'
+        self.gzipped += len(response.data) if compressed else min(len(response.data), len(gzip.compress(response.data)))
+        if response.headers.get('ETag'):
+            self.etags[url] = response.headers['ETag']
+        if follow and response.status_code in (301, 302, 303):
+            return self.send('GET', response.headers['Location'])
+        return response
+
+
+def seed(products, orders):
+    init_db(app.config['DATABASE'])
+    farmer, customer = app.test_client(), app.test_client()
+    farmer.post('/signup', data=dict(role='farmer', name='Farmer', email='farmer@example.com', password='secret'))
+    customer.post('/signup', data=dict(role='customer', name='Customer', email='customer@example.com', password='secret'))
+    farmer.post('/login', data=dict(email='farmer@example.com', password='secret'))
+    customer.post('/login', data=dict(email='customer@example.com', password='secret'))
+    for n in range(products):
+        farmer.post('/addproduct', data=dict(name=f'Produce {n}', description='Fresh from the farm this morning.',
+                                             price='2.5', quantity='1000000', category='Vegetables', contact='0700000000'))
+    for n in range(orders):
+        customer.post('/update_cart', json={'items': [{'product_id': n % products + 1, 'quantity': 1}]})
+        customer.post('/checkout', data=dict(payment_option='cash'))
+    return customer
+
+
+def html_session(client, viewed, return_visit):
+    if not return_visit:
+        for product_id in viewed:
+            client.send('GET', f'/productpage/{product_id}')
+            client.send('POST', f'/productpage/{product_id}', data={'quantity': 1})
+        client.send('POST', '/update_cart', data={f'quantity-{viewed[0]}': 2})
+    else:
+        for product_id in viewed:
+            client.send('GET', f'/productpage/{product_id}')
+        client.send('GET', '/cart')
+    client.send('GET', '/orders')
+
+
+def api_session(client, viewed, return_visit):
+    products = '/api/v1/products?ids={}&fields=id,name,price,quantity,description,image'.format(
+        ','.join(map(str, viewed)))
+    client.send('GET', products, revalidate=return_visit)
+    if not return_visit:
+        client.send('POST', '/api/v1/cart', json={'items': [{'product_id': product_id, 'quantity': 1}
+                                                            for product_id in viewed]})
+        client.send('POST', '/api/v1/cart', json={'items': [{'product_id': viewed[0], 'quantity': 2}]})
+    client.send('GET', '/api/v1/cart', revalidate=return_visit)
+    client.send('GET', '/api/v1/orders', revalidate=return_visit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--viewed', type=int, default=5, help="Products looked at and put in the cart")
+    parser.add_argument('--orders', type=int, default=20, help="Orders already in the customer's history")
+    args = parser.parse_args()
+
+    customer = seed(args.products, args.orders)
+    viewed = list(range(1, args.viewed + 1))
+    for label, session, client in (('HTML', html_session, Meter(customer)),
+                                   ('API', api_session, Meter(customer, **{'Accept-Encoding': 'gzip'}))):
+        for visit in ('first visit', 'return visit'):
+            client.requests = client.bytes = client.gzipped = 0
+            session(client, viewed, visit == 'return visit')
+            print(f"{label:4} {visit:12}: {client.requests:3} requests  {client.bytes:8} bytes  "
+                  f"({client.gzipped} gzipped)")
+        customer.post('/update_cart', json={'items': [{'product_id': product_id, 'quantity': 0} for product_id in viewed]})
+
+
+if __name__ == '__main__':
+    main()
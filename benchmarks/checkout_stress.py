@@ -0,0 +1,195 @@
+"""Concurrent checkout stress test, against scarce and against ample stock.
+
+Many customers fill their carts with the same few products, then N threads
+check them out at once. Each scenario reports throughput and the share of
+checkouts placed and rejected for three paths:
+
+- ``legacy``: the original per-item loop, which does nothing but the orders
+  and the stock (and oversells under contention);
+- ``legacy+stats``: the same loop also keeping the sales stats, facet counts,
+  rankings and job queue current one cart line at a time, i.e. the same work
+  as place_order();
+- ``place_order``: the set-based checkout.
+
+With scarce stock most checkouts are rejected, so the numbers mostly measure
+the stock check; the ample scenario places every order and measures the full
+write path. The bare legacy loop stays faster there because it skips the
+bookkeeping, so the like-for-like comparison is with legacy+stats.
+
+The run fails if place_order() oversells in either scenario, or if its ample
+stock throughput is below --min-ratio (default 1.0) of legacy+stats.
+
+    python benchmarks/checkout_stress.py --threads 16 --customers 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ConnectionPool, init_db  # noqa: E402
+from repositories import get_repositories  # noqa: E402
+
+
+def legacy_checkout(conn, customer_id, payment_option):
+    """The original per-item checkout loop (3N statements, stock checked in Python)."""
+    cart_items = conn.execute("SELECT * FROM cart WHERE customer_id = ?", (customer_id,)).fetchall()
+    for item in cart_items:
+        product = conn.execute("SELECT * FROM products WHERE id = ?", (item['product_id'],)).fetchone()
+        if product['quantity'] < item['quantity']:
+            conn.rollback()
+            return 0, [product['name']]
+        conn.execute("""
+            INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option)
+            VALUES (?, ?, ?, ?, ?)
+        """, (item['product_id'], customer_id, item['quantity'], item['quantity'] * product['price'], payment_option))
+        conn.execute("UPDATE products SET quantity = quantity - ? WHERE id = ?", (item['quantity'], item['product_id']))
+    conn.execute("DELETE FROM cart WHERE customer_id = ?", (customer_id,))
+    conn.commit()
+    return len(cart_items), []
+
+
+def legacy_tracked_checkout(conn, customer_id, payment_option):
+    """The legacy loop also doing place_order()'s bookkeeping, one cart line at a time.
+
+    Sales stats, low-stock and facet counts, rankings and the orders.placed
+    job are updated through the same repositories, so the two paths do the
+    same work and differ only in per-line versus set-based statements.
+    """
+    repos = get_repositories(conn)
+    cart_items = conn.execute("SELECT * FROM cart WHERE customer_id = ?", (customer_id,)).fetchall()
+    for item in cart_items:
+        product = conn.execute("SELECT * FROM products WHERE id = ?", (item['product_id'],)).fetchone()
+        if product['quantity'] < item['quantity']:
+            conn.rollback()
+            return 0, [product['name']]
+        order = conn.execute("""
+            INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING id, product_id, quantity, total_price, status
+        """, (item['product_id'], customer_id, item['quantity'], item['quantity'] * product['price'],
+              payment_option)).fetchone()
+        conn.execute("UPDATE products SET quantity = quantity - ?, version = version + 1 WHERE id = ?",
+                     (item['quantity'], item['product_id']))
+        remaining = product['quantity'] - item['quantity']
+        repos.stats.orders_changed([order])
+        repos.stats.stock_changed([(product['id'], product['quantity'], remaining)])
+        repos.facets.stock_changed([(dict(product, quantity=remaining), product['quantity'])])
+        repos.rankings.orders_placed([order])
+        repos.jobs.enqueue('orders.placed', {'order_ids': [order['id']]})
+    conn.execute("DELETE FROM cart WHERE customer_id = ?", (customer_id,))
+    conn.commit()
+    return len(cart_items), []
+
+
+def place_order(conn, customer_id, payment_option):
+    return get_repositories(conn).orders.place(customer_id, payment_option)
+
+
+def seed(db_path, products, stock, customers, items_per_cart):
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Farmer', 'farmer@example.com', 'x', 'farmer')")
+    conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, 'x', 'customer')",
+                     [(f"Customer {i}", f"customer{i}@example.com") for i in range(customers)])
+    conn.executemany('''INSERT INTO products (name, price, quantity, description, contact, image, farmer_id, category)
+                        VALUES (?, 1.0, ?, 'stress', '000', NULL, 1, 'Fruit')''',
+                     [(f"Product {i}", stock) for i in range(products)])
+    rng = random.Random(1)
+    rows = []
+    for customer_id in range(2, customers + 2):
+        for product_id in rng.sample(range(1, products + 1), items_per_cart):
+            rows.append((customer_id, product_id, rng.randint(1, 3)))
+    conn.executemany("INSERT INTO cart (customer_id, product_id, quantity) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def run(label, checkout, db_path, threads, customers, stock):
+    pool = ConnectionPool(db_path, size=threads)
+    pending = list(range(2, customers + 2))
+    lock = threading.Lock()
+    results = {'placed': 0, 'rejected': 0, 'errors': 0}
+
+    def worker():
+        conn = pool.acquire()
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    customer_id = pending.pop()
+                try:
+                    placed, out_of_stock = checkout(conn, customer_id, 'cash')
+                    key = 'rejected' if out_of_stock else 'placed'
+                except sqlite3.Error:
+                    conn.rollback()
+                    key = 'errors'
+                with lock:
+                    results[key] += 1
+        finally:
+            pool.release(conn)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = pool.acquire()
+    oversold = conn.execute("""
+        SELECT COUNT(*) FROM products
+        WHERE quantity < 0
+           OR ? < (SELECT COALESCE(SUM(orders.quantity), 0) FROM orders WHERE orders.product_id = products.id)
+    """, (stock,)).fetchone()[0]
+    pool.release(conn)
+    pool.close_all()
+
+    throughput = customers / elapsed
+    print(f"{label:12} {throughput:8.0f} checkouts/s  placed={results['placed'] / customers:6.1%} "
+          f"rejected={results['rejected'] / customers:6.1%} errors={results['errors']} oversold_products={oversold}")
+    return throughput, oversold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--stock', type=int, default=100, help="Units per product in the scarce scenario")
+    parser.add_argument('--items', type=int, default=5, help="Cart lines per customer")
+    parser.add_argument('--min-ratio', type=float, default=1.0,
+                        help="Fail if place_order's ample stock throughput falls below this share of legacy+stats'")
+    args = parser.parse_args()
+
+    # Every cart line asks for at most 3 units, so this much stock never runs out
+    scenarios = (('scarce', args.stock), ('ample', args.customers * 3))
+    paths = (('legacy', legacy_checkout), ('legacy+stats', legacy_tracked_checkout), ('place_order', place_order))
+    failures = []
+    for scenario, stock in scenarios:
+        print(f"{scenario} stock ({stock} units per product)")
+        throughput = {}
+        for label, checkout in paths:
+            db_path = os.path.join(tempfile.mkdtemp(), 'checkout_stress.db')
+            seed(db_path, args.products, stock, args.customers, args.items)
+            throughput[label], oversold = run(label, checkout, db_path, args.threads, args.customers, stock)
+            if checkout is place_order and oversold:
+                failures.append(f"place_order oversold stock ({scenario})")
+        ratio = throughput['place_order'] / throughput['legacy+stats']
+        print(f"{'ratio':12} {ratio:8.2f}x legacy+stats, {throughput['place_order'] / throughput['legacy']:.2f}x legacy")
+        if scenario == 'ample' and ratio < args.min_ratio:
+            failures.append(f"place_order throughput is {ratio:.2f}x legacy+stats, below --min-ratio {args.min_ratio}")
+
+    if failures:
+        sys.exit('; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Synthetic marketplace data for the benchmarks.
+
+Builds a fresh database from database/schema.sql through init_db() and fills
+it with farmers, customers, products and orders, then rebuilds the totals the
+app keeps alongside them. Every user shares one password (PASSWORD) so
+logins can be scripted.
+"""
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from database import init_db  # noqa: E402
+from repositories import get_repositories  # noqa: E402
+
+PASSWORD = 'benchmark'
+CATEGORIES = ['Fruit', 'Vegetable', 'Roots', 'Dairy', 'Animals']
+WORDS = ['banana', 'carrot', 'cassava', 'yam', 'tomato', 'pepper', 'okra', 'mango', 'orange',
+         'plantain', 'goat', 'cow', 'milk', 'cheese', 'onion', 'garlic', 'ginger', 'maize',
+         'beans', 'rice', 'fresh', 'organic', 'local', 'sweet', 'ripe', 'dried', 'smoked']
+
+
+def farmer_email(index):
+    return f"farmer{index}@example.com"
+
+
+def customer_email(index):
+    return f"customer{index}@example.com"
+
+
+def seed(db_path, farmers=50, customers=500, products=5000, orders=20000, stock=1000000, batch=10000, seed=42):
+    """Create ``db_path`` from the schema and fill it. Returns the id ranges used."""
+    rng = random.Random(seed)
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    password = generate_password_hash(PASSWORD)
+
+    conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, 'farmer')",
+                     [(f"Farmer {i}", farmer_email(i), password) for i in range(farmers)])
+    conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, 'customer')",
+                     [(f"Customer {i}", customer_email(i), password) for i in range(customers)])
+    farmer_ids = range(1, farmers + 1)
+    customer_ids = range(farmers + 1, farmers + customers + 1)
+
+    for start in range(0, products, batch):
+        conn.executemany('''INSERT INTO products (name, price, quantity, description, contact, image, farmer_id, category)
+                            VALUES (?, ?, ?, ?, '000', NULL, ?, ?)''', [
+            (' '.join(rng.sample(WORDS, 2)).title(), round(rng.uniform(0.5, 50), 2), stock,
+             ' '.join(rng.sample(WORDS, 8)), rng.choice(farmer_ids), rng.choice(CATEGORIES))
+            for _ in range(min(batch, products - start))
+        ])
+    product_ids = range(1, products + 1)
+
+    for start in range(0, orders, batch):
+        rows = []
+        for _ in range(min(batch, orders - start)):
+            quantity = rng.randint(1, 5)
+            rows.append((rng.choice(product_ids), rng.choice(customer_ids), quantity, quantity * 2.5,
+                         rng.choice(['credit', 'debit', 'cash']), rng.choice(['Pending', 'Completed'])))
+        conn.executemany('''INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option, status)
+                            VALUES (?, ?, ?, ?, ?, ?)''', rows)
+    conn.commit()
+    # Rows were inserted directly, so derive the dashboard totals, facets and rankings from them
+    conn.row_factory = sqlite3.Row
+    repos = get_repositories(conn)
+    repos.stats.rebuild()
+    repos.facets.rebuild()
+    repos.rankings.rebuild()
+    conn.close()
+    return {'farmers': farmer_ids, 'customers': customer_ids, 'products': product_ids}
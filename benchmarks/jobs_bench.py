@@ -0,0 +1,101 @@
+"""Throughput of the background job queue (jobs.py).
+
+Seeds a throwaway database with orders, times enqueueing one job per write
+transaction as checkout does, then drains the same number of real
+``orders.placed`` jobs with `flask worker --burst` style runs for each
+process count and batch size. Those handlers are cheap, so the single SQLite
+writer is the limit; ``--handler-ms`` makes each job wait as if it called a
+mail service, which is where more processes pay off. Times include starting
+the worker processes.
+
+    python benchmarks/jobs_bench.py --jobs 20000 --processes 1 2 4 --batch-sizes 1 20 100
+    python benchmarks/jobs_bench.py --jobs 2000 --handler-ms 5
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configure the app before it is imported; worker processes inherit these and
+# re-import this module, so they must not pick a database of their own
+os.environ.setdefault('DATABASE', os.path.join(tempfile.mkdtemp(), 'jobs_bench.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')  # Each job logs a notification at INFO
+
+import jobs  # noqa: E402
+from app import app  # noqa: E402
+from database import init_db  # noqa: E402
+from repositories import get_repositories  # noqa: E402
+
+ORDERS = 1000
+
+
+@jobs.handler('bench.io')
+def wait_for_io(repos, payload):
+    # Worker processes re-import this module, so they register this handler too
+    time.sleep(float(os.environ['BENCH_HANDLER_MS']) / 1000)
+
+
+def seed(db_path):
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Farmer', 'farmer@example.com', 'x', 'farmer')")
+    conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Customer', 'customer@example.com', 'x', 'customer')")
+    conn.execute('''INSERT INTO products (name, price, quantity, description, farmer_id, category)
+                    VALUES ('Mango', 1.0, 1000000, 'bench', 1, 'Fruit')''')
+    conn.executemany("INSERT INTO orders (product_id, customer_id, quantity, payment_option) VALUES (1, 2, 1, 'cash')",
+                     [()] * ORDERS)
+    conn.commit()
+    conn.close()
+
+
+def enqueue(repos, kind, count, per_transaction):
+    """Queue ``count`` jobs; returns the milliseconds each transaction took."""
+    samples = []
+    for start in range(0, count, per_transaction):
+        started = time.perf_counter()
+        with repos.jobs.transaction():
+            for n in range(start, min(count, start + per_transaction)):
+                repos.jobs.enqueue(kind, {'order_ids': [n % ORDERS + 1]})
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=20000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 20, 100])
+    parser.add_argument('--handler-ms', type=float, default=0, help="Simulated I/O wait per job")
+    args = parser.parse_args()
+    kind = 'bench.io' if args.handler_ms else 'orders.placed'
+    os.environ['BENCH_HANDLER_MS'] = str(args.handler_ms)
+
+    seed(app.config['DATABASE'])
+    pool = app.extensions['db_pool']
+    conn = pool.acquire()
+    repos = get_repositories(conn)
+
+    samples = enqueue(repos, kind, args.jobs, 1)
+    print(f"enqueue, one job per transaction: {args.jobs / (sum(samples) / 1000):8.0f} jobs/s  "
+          f"p50={statistics.median(samples):.2f}ms")
+
+    for batch_size in args.batch_sizes:
+        for processes in args.processes:
+            if repos.jobs.stats()['due'] < args.jobs:
+                enqueue(repos, kind, args.jobs, 1000)
+            started = time.perf_counter()
+            jobs.run_workers(app, processes, burst=True, batch_size=batch_size)
+            elapsed = time.perf_counter() - started
+            left = repos.jobs.stats()
+            print(f"drain, {processes} processes, batch {batch_size:4}: {args.jobs / elapsed:8.0f} jobs/s "
+                  f"({elapsed:.2f}s, {left['due'] + left['scheduled']} left)")
+    pool.release(conn)
+
+
+if __name__ == '__main__':
+    main()
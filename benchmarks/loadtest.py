@@ -0,0 +1,285 @@
+"""Load test of the customer and farmer journeys against a local gunicorn.
+
+Seeds a synthetic database (see dataset.py), starts gunicorn on it, and runs
+concurrent virtual users through the real routes for a fixed duration:
+
+    customer: login, marketplace (plain / search / category), productpage,
+              add_to_cart, checkout, orders
+    farmer:   login, dashboard
+
+Throughput and p50/p95/p99 latency per route are printed as JSON. If a
+baseline file exists the run is compared against it and exits non-zero when
+a route's p95 or the overall throughput regress beyond --tolerance.
+
+    python benchmarks/loadtest.py --users 32 --duration 60
+    python benchmarks/loadtest.py --save-baseline   # record this machine's numbers
+    python benchmarks/loadtest.py --asgi            # serve through asgi.py instead
+
+Baselines are machine-specific, so record them on the host that runs the
+comparison. Run from the repository root.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from http.cookiejar import CookieJar
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest_baseline.json')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses so each route is timed on its own."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class VirtualUser:
+    def __init__(self, base_url, recorder, rng):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, route, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            status = error.code
+        except OSError:
+            status = 0
+        self.recorder.record(route, time.perf_counter() - started, status)
+        return status
+
+    def login(self, email):
+        return self.request('POST /login', '/login', {'email': email, 'password': dataset.PASSWORD})
+
+
+class Customer(VirtualUser):
+    def __init__(self, base_url, recorder, rng, email, product_ids):
+        super().__init__(base_url, recorder, rng)
+        self.email = email
+        self.product_ids = product_ids
+
+    def journey(self):
+        self.login(self.email)
+        self.request('GET /marketplace', '/marketplace')
+        term = self.rng.choice(dataset.WORDS)
+        self.request('GET /marketplace?search', '/marketplace?' + urllib.parse.urlencode({'search': term}))
+        category = self.rng.choice(dataset.CATEGORIES)
+        self.request('GET /marketplace?category', '/marketplace?' + urllib.parse.urlencode({'category': category}))
+        for product_id in self.rng.sample(self.product_ids, 2):
+            self.request('GET /productpage/<id>', f'/productpage/{product_id}')
+            self.request('POST /add_to_cart', '/add_to_cart',
+                         {'product_id': product_id, 'quantity': self.rng.randint(1, 3)})
+        self.request('POST /checkout', '/checkout', {'payment_option': self.rng.choice(['credit', 'debit', 'cash'])})
+        self.request('GET /orders', '/orders')
+
+
+class Farmer(VirtualUser):
+    def __init__(self, base_url, recorder, rng, email):
+        super().__init__(base_url, recorder, rng)
+        self.email = email
+
+    def journey(self):
+        self.login(self.email)
+        for _ in range(3):
+            self.request('GET /dashboard', '/dashboard')
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            self.samples[route].append(seconds)
+            if status == 0 or status >= 500:
+                self.errors[route] += 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            samples.sort()
+            routes[route] = {
+                'requests': len(samples),
+                'errors': self.errors[route],
+                'rps': round(len(samples) / elapsed, 2),
+                'p50_ms': _percentile(samples, 50),
+                'p95_ms': _percentile(samples, 95),
+                'p99_ms': _percentile(samples, 99),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'duration_s': round(elapsed, 2),
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'rps': round(total / elapsed, 2),
+            'routes': routes,
+        }
+
+
+def _percentile(samples, pct):
+    index = min(len(samples) - 1, max(0, round(pct / 100 * len(samples)) - 1))
+    return round(samples[index] * 1000, 2)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, workers, threads, port, asgi=False):
+    # Virtual users log in far more often than people do, all from 127.0.0.1
+    env = dict(os.environ, DATABASE=db_path, LOG_LEVEL='WARNING',
+               LOGIN_RATE_PER_IP='1000000/1', LOGIN_RATE_PER_EMAIL='1000000/1')
+    command = ['gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}']
+    if asgi:
+        env['ASGI_THREADS'] = str(threads)
+        command += ['-c', 'gunicorn_asgi.conf.py', 'asgi:application']
+    else:
+        command += ['--threads', str(threads), 'app:app']
+    server = subprocess.Popen(command, env=env, stdout=sys.stderr)  # Keep stdout for the report
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("gunicorn exited during startup")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("gunicorn did not start within 30 seconds")
+
+
+def run_users(base_url, args, ids, recorder):
+    customers = [dataset.customer_email(i) for i in range(args.customers)]
+    farmers = [dataset.farmer_email(i) for i in range(args.farmers)]
+    product_ids = list(ids['products'])
+    stop_at = time.perf_counter() + args.duration
+
+    def worker(index):
+        rng = random.Random(index)
+        while time.perf_counter() < stop_at:
+            if rng.random() < args.farmer_share:
+                user = Farmer(base_url, recorder, rng, rng.choice(farmers))
+            else:
+                user = Customer(base_url, recorder, rng, rng.choice(customers), product_ids)
+            user.journey()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of regressions of ``report`` against ``baseline``."""
+    regressions = []
+    if report['rps'] < baseline['rps'] * (1 - tolerance):
+        regressions.append(f"throughput {report['rps']} rps < baseline {baseline['rps']} rps")
+    for route, expected in baseline['routes'].items():
+        actual = report['routes'].get(route)
+        if actual is None:
+            regressions.append(f"{route}: no requests recorded")
+        elif actual['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {actual['p95_ms']} ms > baseline {expected['p95_ms']} ms")
+    for route, actual in report['routes'].items():
+        if actual['errors']:
+            regressions.append(f"{route}: {actual['errors']} server errors")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--farmers', type=int, default=50)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=32, help="Concurrent virtual users")
+    parser.add_argument('--farmer-share', type=float, default=0.1, help="Fraction of journeys run by farmers")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="Request threads per worker")
+    parser.add_argument('--asgi', action='store_true', help="Serve asgi:application with gunicorn_asgi.conf.py")
+    parser.add_argument('--url', help="Test an already running server instead (the database is still seeded)")
+    parser.add_argument('--db', help="Database file to seed (default: a temporary file)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Write this run's results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression as a fraction")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.db')
+    print(f"Seeding {db_path} ...", file=sys.stderr)
+    with contextlib.redirect_stdout(sys.stderr):
+        ids = dataset.seed(db_path, farmers=args.farmers, customers=args.customers,
+                           products=args.products, orders=args.orders)
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = _free_port()
+        server = start_server(os.path.abspath(db_path), args.workers, args.threads, port, asgi=args.asgi)
+        base_url = f'http://127.0.0.1:{port}'
+    try:
+        recorder = Recorder()
+        elapsed = run_users(base_url.rstrip('/'), args, ids, recorder)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = recorder.report(elapsed)
+    report['config'] = {key: getattr(args, key) for key in
+                        ('farmers', 'customers', 'products', 'orders', 'users', 'farmer_share', 'workers', 'threads', 'asgi')}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline found; skipping comparison.", file=sys.stderr)
+        return 0
+    with open(args.baseline) as stored:
+        regressions = compare(report, json.load(stored), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Compare proximity search latency: a haversine scan of every product vs the R*Tree.
+
+Seeds a throwaway database from database/schema.sql with products spread
+over a country-sized area and times both query paths for the same points.
+
+    python benchmarks/nearby_bench.py --products 1000000 --queries 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import add_math_functions, init_db  # noqa: E402
+from repositories import DISTANCE_KM, ProductRepository  # noqa: E402
+
+# Roughly the extent of Kenya
+LATITUDES = (-4.7, 5.0)
+LONGITUDES = (33.9, 41.9)
+
+SCAN_QUERY = f"""
+    SELECT * FROM (SELECT id, {DISTANCE_KM} AS distance FROM products WHERE latitude IS NOT NULL)
+    WHERE distance <= ? ORDER BY distance, id LIMIT 25
+"""
+
+
+def seed(conn, count, batch=50000):
+    rng = random.Random(42)
+    for start in range(0, count, batch):
+        conn.executemany('''INSERT INTO products (name, price, quantity, description, farmer_id, category, latitude, longitude)
+                            VALUES ('produce', 1.0, 10, 'fresh', 1, 'Fruit', ?, ?)''',
+                         [(rng.uniform(*LATITUDES), rng.uniform(*LONGITUDES)) for _ in range(min(batch, count - start))])
+        conn.commit()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_calls(call, points):
+    samples = []
+    for point in points:
+        started = time.perf_counter()
+        call(point)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=25, help="Search radius in km")
+    parser.add_argument('--db', help="Database file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'nearby_bench.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    add_math_functions(conn)
+
+    started = time.perf_counter()
+    seed(conn, args.products)
+    print(f"Seeded {args.products} products in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(7)
+    points = [(rng.uniform(*LATITUDES), rng.uniform(*LONGITUDES)) for _ in range(args.queries)]
+    products = ProductRepository(conn)
+    scan = time_calls(lambda point: conn.execute(SCAN_QUERY, (point[0], point[0], point[1], args.radius)).fetchall(),
+                      points)
+    rtree = time_calls(lambda point: products.nearby_page(point, args.radius, [], None, None, 25), points)
+
+    for label, samples in (('scan', scan), ('R*Tree', rtree)):
+        print(f"{label:6} p50={statistics.median(samples):8.2f}ms  p99={percentile(samples, 99):8.2f}ms")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
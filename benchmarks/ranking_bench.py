@@ -0,0 +1,113 @@
+"""Trending reads from the precomputed rankings vs aggregating the orders table, as orders grow.
+
+Seeds a throwaway database from database/schema.sql with products in a few
+categories, then places orders in steps (skewed towards popular products).
+Each order goes through RankingRepository.orders_placed as checkout does,
+which times the incremental update. After every step the first marketplace
+page of ``sort=trending`` is read both ways: from top_products, and by
+summing units per product over every order.
+
+    python benchmarks/ranking_bench.py --products 10000 --steps 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import PRAGMAS, TimedConnection, init_db  # noqa: E402
+from repositories import PRODUCT_CARD_COLUMNS, Repositories  # noqa: E402
+
+CATEGORIES = ('Fruit', 'Vegetables', 'Grains', 'Dairy', 'Poultry', 'Herbs')
+PAGE = 24
+
+# What sort=trending would cost without the rankings (all-time units, without the decay)
+AGGREGATE_QUERY = f"""
+    SELECT {PRODUCT_CARD_COLUMNS}, sold.units
+    FROM (SELECT product_id, SUM(quantity) AS units FROM orders GROUP BY product_id) AS sold
+    JOIN products ON products.id = sold.product_id
+    WHERE ? = '' OR products.category = ?
+    ORDER BY sold.units DESC, products.id LIMIT ?
+"""
+
+
+def seed(conn, count):
+    rng = random.Random(42)
+    conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Customer', 'customer@example.com', 'x', 'customer')")
+    conn.executemany('''INSERT INTO products (name, price, quantity, description, farmer_id, category)
+                        VALUES ('produce', ?, 1000000000, 'fresh', 1, ?)''',
+                     [(round(rng.uniform(1, 80), 2), rng.choice(CATEGORIES)) for _ in range(count)])
+    conn.commit()
+
+
+def place_orders(repos, products, count, rng, per_transaction=500):
+    """Insert ``count`` single-line orders and rank them; returns the microseconds per ranking update."""
+    samples = []
+    # Popularity falls off with the product's rank, like real sales
+    weights = [1 / rank for rank in range(1, len(products) + 1)]
+    for start in range(0, count, per_transaction):
+        batch = [{'product_id': product_id, 'quantity': rng.randint(1, 5)}
+                 for product_id in rng.choices(products, weights, k=min(per_transaction, count - start))]
+        with repos.rankings.transaction():
+            repos.conn.executemany("""
+                INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option)
+                VALUES (?, 1, ?, 0, 'cash')
+            """, [(order['product_id'], order['quantity']) for order in batch])
+            started = time.perf_counter()
+            for order in batch:
+                repos.rankings.orders_placed([order])
+            samples.append((time.perf_counter() - started) * 1e6 / len(batch))
+    return samples
+
+
+def time_calls(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--steps', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="Total orders after each step")
+    parser.add_argument('--repeat', type=int, default=20, help="Reads timed per query and step")
+    parser.add_argument('--db', help="Database file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'ranking_bench.db')
+    init_db(db_path)
+    # Connected like the app's pool, so checkout's write transactions behave the same
+    conn = sqlite3.connect(db_path, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(';'.join(PRAGMAS))
+    seed(conn, args.products)
+    repos = Repositories(conn)
+    rng = random.Random(7)
+    products = list(range(1, args.products + 1))
+    rng.shuffle(products)
+
+    placed = 0
+    for total in args.steps:
+        updates = place_orders(repos, products, total - placed, rng)
+        placed = total
+        category = rng.choice(CATEGORIES)
+        ranked = time_calls(lambda: repos.products.ranked_page('trending', '', None, PAGE + 1), args.repeat)
+        ranked_category = time_calls(lambda: repos.products.ranked_page('trending', category, None, PAGE + 1),
+                                     args.repeat)
+        scan = time_calls(lambda: conn.execute(AGGREGATE_QUERY, ('', '', PAGE + 1)).fetchall(), max(1, args.repeat // 10))
+        print(f"{placed:>9} orders: top_products {ranked:6.2f}ms ({ranked_category:.2f}ms in a category)  "
+              f"aggregate {scan:9.2f}ms  ranking update p50={statistics.median(updates):.0f}us/order")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compare marketplace search latency: ``name LIKE '%q%'`` vs the FTS5 index.
+
+Seeds a throwaway database from database/schema.sql and times both query
+paths with the same search terms.
+
+    python benchmarks/search_bench.py --products 1000000 --queries 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db  # noqa: E402
+from repositories import ProductRepository, search_terms  # noqa: E402
+
+SYLLABLES = ['ba', 'ka', 'ro', 'ta', 'mi', 'ng', 'yo', 'pe', 'la', 'so', 'du', 'ke',
+             'ni', 'ma', 'go', 'ri', 'ze', 'fu', 'wa', 'ti']
+# A catalogue-sized vocabulary of made-up product words ("bakaro", "mingo", ...)
+WORDS = sorted({a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES})
+CATEGORIES = ['Fruit', 'Vegetable', 'Roots', 'Dairy', 'Animals']
+
+OLD_QUERY = "SELECT * FROM products WHERE 1=1 AND name LIKE ? AND category = ?"
+NEW_QUERY = """
+    SELECT products.* FROM products_fts
+    JOIN products ON products.id = products_fts.rowid
+    WHERE products_fts MATCH ? AND products.category = ?
+    ORDER BY bm25(products_fts, 10.0, 1.0, 2.0)
+"""
+
+
+def seed(conn, count, batch=50000):
+    rng = random.Random(42)
+    for start in range(0, count, batch):
+        rows = []
+        for _ in range(min(batch, count - start)):
+            name = ' '.join(rng.sample(WORDS, 2))
+            description = ' '.join(rng.sample(WORDS, 6))
+            rows.append((name, round(rng.uniform(0.5, 50), 2), rng.randint(0, 500),
+                         description, '000', None, rng.randint(1, 1000), rng.choice(CATEGORIES)))
+        conn.executemany('''INSERT INTO products (name, price, quantity, description, contact, image, farmer_id, category)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        conn.commit()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_queries(conn, query, params_list):
+    samples = []
+    for params in params_list:
+        started = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', help="Database file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'search_bench.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+
+    started = time.perf_counter()
+    seed(conn, args.products)
+    print(f"Seeded {args.products} products in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(7)
+    terms = [(rng.choice(WORDS)[:rng.randint(3, 6)], rng.choice(CATEGORIES)) for _ in range(args.queries)]
+    old = time_queries(conn, OLD_QUERY, [(f"%{term}%", category) for term, category in terms])
+    new = time_queries(conn, NEW_QUERY, [(ProductRepository.match_query(search_terms(term)), category) for term, category in terms])
+
+    for label, samples in (('LIKE', old), ('FTS5', new)):
+        print(f"{label:5} p50={statistics.median(samples):8.2f}ms  p99={percentile(samples, 99):8.2f}ms")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
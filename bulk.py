@@ -0,0 +1,197 @@
+"""Bulk product import and streaming exports for farmers.
+
+Imports read CSV or JSONL one row at a time, validate each row, and insert
+the valid ones ``batch_size`` at a time with ``executemany`` in one short
+transaction per batch. Images can be supplied as a zip archive whose member
+names appear in the ``image`` column. Exports page through the database by
+id and yield the file in chunks, so neither side holds the whole data set in
+memory.
+"""
+import csv
+import io
+import json
+import logging
+import re
+import zipfile
+
+from database import DatabaseError
+from geo import coordinates
+
+# Import columns, in the order ProductRepository.create_many takes them
+PRODUCT_FIELDS = ('name', 'price', 'quantity', 'category', 'description', 'contact', 'image', 'latitude', 'longitude')
+REQUIRED_FIELDS = ('name', 'price', 'category')
+FORMATS = ('csv', 'jsonl')
+
+PRODUCT_EXPORT_COLUMNS = ('id',) + PRODUCT_FIELDS
+ORDER_EXPORT_COLUMNS = ('id', 'product_id', 'product_name', 'quantity', 'total_price', 'payment_option', 'status')
+
+MAX_REPORTED_ERRORS = 100  # Further row errors are counted but not listed
+CHUNK_SIZE = 64 * 1024  # Bytes of export text buffered per yielded chunk
+
+
+def detect_format(filename):
+    """'csv' or 'jsonl' from a file name, or None."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext)
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row)`` from a binary CSV or JSONL stream.
+
+    A JSONL line that does not decode to an object is yielded as its error
+    message so the import can report it and carry on.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError(f"missing columns: {', '.join(missing)}")
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as e:
+            # The reader cannot resume after malformed CSV, so this ends the file like a bad header
+            raise ValueError(f"malformed CSV after line {reader.line_num}: {e}") from None
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"invalid JSON: {e}"
+                continue
+            yield line_number, row if isinstance(row, dict) else "expected a JSON object"
+
+
+def parse_product(row):
+    """Validate one import row; returns a PRODUCT_FIELDS tuple or raises ValueError."""
+    if isinstance(row, str):
+        raise ValueError(row)
+    values = {field: '' if row.get(field) is None else str(row.get(field)).strip() for field in PRODUCT_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not values[field]]
+    if missing:
+        raise ValueError(f"{', '.join(missing)} required")
+    try:
+        price = float(values['price'])
+    except ValueError:
+        raise ValueError(f"invalid price {values['price']!r}") from None
+    try:
+        quantity = int(values['quantity'] or 0)
+    except ValueError:
+        raise ValueError(f"invalid quantity {values['quantity']!r}") from None
+    if price < 0 or quantity < 0:
+        raise ValueError("price and quantity cannot be negative")
+    latitude, longitude = coordinates(values['latitude'], values['longitude'])
+    return (values['name'], price, quantity, values['category'], values['description'],
+            values['contact'] or None, values['image'] or None, latitude, longitude)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []  # (line_number or None for the whole file, message), at most MAX_REPORTED_ERRORS
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+
+class ProductImporter:
+    """Validates rows and inserts them for one farmer in batches."""
+
+    def __init__(self, repos, farmer_id, pipeline, images=None, batch_size=500, max_image_size=None):
+        self.repos = repos
+        self.farmer_id = farmer_id
+        self.pipeline = pipeline
+        self.images = zipfile.ZipFile(images) if images is not None else None
+        self.members = set(self.images.namelist()) if self.images is not None else set()
+        self.batch_size = batch_size
+        self.max_image_size = max_image_size  # Bytes per uncompressed archive member; None for no limit
+        self.report = ImportReport()
+
+    def run(self, rows):
+        """Import ``(line_number, row)`` pairs; returns the ImportReport."""
+        batch = []
+        try:
+            for line_number, row in rows:
+                try:
+                    product = list(parse_product(row))
+                    product[6] = self._image(product[6])
+                except ValueError as e:
+                    self.report.error(line_number, str(e))
+                    continue
+                batch.append((line_number, product))
+                if len(batch) >= self.batch_size:
+                    self._insert(batch)
+                    batch = []
+        except ValueError as e:
+            # The file itself could not be read (bad header, encoding or CSV); keep what was read
+            self.report.error(None, str(e))
+        if batch:
+            self._insert(batch)
+        return self.report
+
+    def _image(self, filename):
+        """Queue the named archive member; names of stored uploads are kept as they are."""
+        if filename is None:
+            return None
+        if self.images is not None and filename in self.members:
+            # file_size comes from the archive's directory; reads stop there, so it bounds memory
+            if self.max_image_size is not None and self.images.getinfo(filename).file_size > self.max_image_size:
+                raise ValueError(f"{filename} is larger than {self.max_image_size} bytes")
+            try:
+                # Imports wait for a queue slot rather than failing rows while the pool catches up
+                with self.images.open(filename) as member:
+                    stored = self.pipeline.submit(member, block=True)
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"{filename} could not be extracted: {e}") from None
+            if stored is None:
+                raise ValueError(f"{filename} is not a valid image")
+            return stored
+        if re.fullmatch(r'[0-9a-f]{24}', filename) and self.pipeline.is_processed(filename):
+            return filename
+        raise ValueError(f"image {filename} not found")
+
+    def _insert(self, batch):
+        try:
+            self.repos.products.create_many(self.farmer_id, [product for _, product in batch])
+        except DatabaseError as e:
+            logging.error("Bulk import batch at line %d failed: %s", batch[0][0], e)
+            for line_number, _ in batch:
+                self.report.error(line_number, f"database error: {e}")
+            return
+        self.report.imported += len(batch)
+        logging.debug("Imported %d products up to line %d.", self.report.imported, batch[-1][0])
+
+
+def iter_pages(fetch_page, batch_size=1000):
+    """Yield every row of ``fetch_page(after_id, limit)``, one id-ordered page at a time."""
+    after = 0
+    while True:
+        rows = fetch_page(after, batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]['id']
+
+
+def export_lines(rows, columns, fmt):
+    """Yield ``rows`` as CSV (with a header) or JSONL text in chunks of about CHUNK_SIZE."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(columns)
+    for row in rows:
+        if fmt == 'csv':
+            writer.writerow([row[column] for column in columns])
+        else:
+            buffer.write(json.dumps({column: row[column] for column in columns}) + '\n')
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,183 @@
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LocalBackend:
+    """In-process stand-in for a shared cache such as Redis or memcached.
+
+    Only used for the version counters (and as the second tier when nothing
+    shared is configured), so a single-node deployment needs no extra service.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def incr(self, key):
+        with self._lock:
+            value = (self._data.get(key, (0, None))[0] or 0) + 1
+            self._data[key] = (value, None)
+            return value
+
+
+class RedisBackend:
+    """Shared backend so every worker sees the same versions and entries."""
+
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed for a shared cache
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, json.dumps(value), ex=ttl)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+class ProductCache:
+    """Read-through cache for product rows and rendered marketplace fragments.
+
+    Entries live in a bounded in-process LRU with a TTL, backed by an optional
+    shared backend. Writers never delete entries; they bump a version counter
+    that is part of every key, so stale entries simply stop being read and age
+    out of the LRU.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend or LocalBackend()
+        self._shared = not isinstance(self.backend, LocalBackend)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Version keys
+    def version(self, name):
+        return self.backend.get(f"version:{name}") or 0
+
+    def bump(self, *names):
+        for name in names:
+            self.backend.incr(f"version:{name}")
+
+    def product_key(self, product_id):
+        return f"product:{product_id}:v{self.version(f'product:{product_id}')}"
+
+    def catalogue_key(self, *parts):
+        return "catalogue:v{}:{}".format(self.version('catalogue'), ':'.join(str(part) for part in parts))
+
+    def invalidate_products(self, product_ids=()):
+        """Called by every write that changes what the catalogue shows."""
+        self.bump('catalogue', *(f'product:{product_id}' for product_id in product_ids))
+
+    # Entries
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                value, expires, size = item
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+
+        value = self.backend.get(key) if self._shared else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not None:
+            self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self._shared:
+            self.backend.set(key, value, self.ttl)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def _store(self, key, value):
+        size = _approximate_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _approximate_size(value):
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions['product_cache']
+
+
+def init_app(app):
+    """Create the product cache, using Redis when CACHE_REDIS_URL is set."""
+    redis_url = app.config.get('CACHE_REDIS_URL')
+    app.extensions['product_cache'] = ProductCache(
+        max_entries=app.config.get('CACHE_MAX_ENTRIES', 1024),
+        ttl=app.config.get('CACHE_TTL', 300),
+        backend=RedisBackend(redis_url) if redis_url else None,
+    )
@@ -1,16 +1,303 @@
+import asyncio
+import contextvars
+import logging
+import math
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import sqlite3
 import os
+import threading
+import time
 
-def init_db():
-    db_path = 'ecommerce.db'
+from flask import current_app, g
+
+try:
+    import psycopg
+except ImportError:  # Optional: only needed for a PostgreSQL DATABASE_URL
+    psycopg = None
+
+# Driver exceptions the views catch, whichever backend is configured
+DatabaseError = (sqlite3.Error,) if psycopg is None else (sqlite3.Error, psycopg.Error)
+
+# Connection settings applied once when a pooled connection is opened.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",  # 256 MB
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# SQL math functions used by the distance queries, as (name, arguments, function).
+# SQLite only has them when compiled with SQLITE_ENABLE_MATH_FUNCTIONS.
+MATH_FUNCTIONS = (
+    ('asin', 1, math.asin),
+    ('sqrt', 1, math.sqrt),
+    ('power', 2, math.pow),
+    ('sin', 1, math.sin),
+    ('cos', 1, math.cos),
+    ('radians', 1, math.radians),
+)
+
+
+def _null_safe(func):
+    """Wrap a math function to return NULL for NULL or out-of-domain input, as SQLite's do."""
+    def call(*args):
+        if None in args:
+            return None
+        try:
+            return func(*args)
+        except (ValueError, OverflowError):
+            return None
+    return call
+
+
+def add_math_functions(conn):
+    """Register Python versions of MATH_FUNCTIONS when this SQLite build lacks them."""
+    try:
+        conn.executescript("SELECT asin(0)")  # Untimed, like the pragmas
+    except sqlite3.OperationalError:
+        for name, arguments, func in MATH_FUNCTIONS:
+            conn.create_function(name, arguments, _null_safe(func), deterministic=True)
+
+
+def init_db(db_path='ecommerce.db'):
     schema_path = 'database/schema.sql'
 
     if os.path.exists(db_path):
         os.remove(db_path)  # Delete the existing database
 
     connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
     with open(schema_path, 'r') as schema_file:
         connection.executescript(schema_file.read())
+    # The schema file is already at the latest version
+    from migrations import Migrator
+    Migrator(connection).stamp()
     connection.close()
     print("Database initialized with the new schema.")
 
+
+# Callables invoked as listener(sql, seconds) after every statement run through
+# a pooled connection; used for request logging and metrics.
+query_listeners = []
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that reports how long each execute()/executemany() call took."""
+
+    dialect = 'sqlite'
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify(sql, time.perf_counter() - started)
+
+
+def _notify(sql, seconds):
+    for listener in query_listeners:
+        listener(sql, seconds)
+
+
+class ConnectionPool:
+    """A bounded pool of pre-configured SQLite connections.
+
+    Each worker thread borrows one connection for the lifetime of its app
+    context and hands it back on teardown, so connections are opened once per
+    worker instead of once per request.
+    """
+
+    dialect = 'sqlite'
+    has_replica = False
+
+    def __init__(self, db_path, size=8, timeout=10.0, cached_statements=256):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=TimedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.executescript(';'.join(PRAGMAS))
+        add_math_functions(conn)
+        return conn
+
+    def acquire(self, readonly=False):
+        """Borrow a connection, opening a new one while under ``size``."""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a pooled database connection")
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'idle': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+            }
+
+
+# Writers in this process queue on a lock instead of SQLite's busy handler,
+# which backs off with sleeps while another thread holds the write lock.
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_transaction(conn):
+    """Run the block inside BEGIN IMMEDIATE, committing unless it rolled back."""
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        if conn.in_transaction:
+            conn.commit()
+
+
+def get_pool(app=None):
+    app = app or current_app
+    return app.extensions['db_pool']
+
+
+def get_db(readonly=False):
+    """Return the connection bound to the current app context.
+
+    With ``readonly`` the connection may come from a read replica.
+    """
+    pool = get_pool()
+    key = 'db_replica' if readonly and pool.has_replica else 'db'
+    if key not in g:
+        setattr(g, key, pool.acquire(readonly=key == 'db_replica'))
+    return g.get(key)
+
+
+def close_db(exc=None):
+    for key in ('db', 'db_replica'):
+        conn = g.pop(key, None)
+        if conn is not None:
+            get_pool().release(conn)
+
+
+def _call_with_connection(pool, func, args, readonly):
+    conn = pool.acquire(readonly=readonly)
+    try:
+        return func(conn, *args)
+    finally:
+        pool.release(conn)
+
+
+async def run_db(func, *args, readonly=False):
+    """Await ``func(conn, *args)`` on the database executor with its own pooled connection.
+
+    Async views use this so the event loop never blocks on SQLite. The
+    connection goes back to the pool when ``func`` returns, so it must return
+    plain data (e.g. ``fetchall()`` rows), not a live cursor. ``readonly``
+    calls may run on a read replica.
+    """
+    app = current_app._get_current_object()
+    # Copy the context so query listeners still see the request's ``g``
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        app.extensions['db_executor'], context.run, _call_with_connection, get_pool(app), func, args, readonly)
+
+
+def init_app(app):
+    """Create the connection pool and release connections on teardown."""
+    size = app.config.get('DB_POOL_SIZE', 8)
+    url = app.config.get('DATABASE_URL')
+    if url and url.startswith(('postgres://', 'postgresql://')):
+        import postgres
+        app.extensions['db_pool'] = postgres.PostgresPool(
+            url,
+            replica_url=app.config.get('DATABASE_REPLICA_URL'),
+            size=size,
+            timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+            prepare_threshold=app.config.get('PG_PREPARE_THRESHOLD', 1),
+        )
+    else:
+        app.extensions['db_pool'] = ConnectionPool(
+            app.config['DATABASE'],
+            size=size,
+            timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+        )
+    # One thread per pooled connection, so async DB calls queue here rather than on the pool; they
+    # only wait on the pool (up to DB_POOL_TIMEOUT) while sync views hold connections in g.db
+    app.extensions['db_executor'] = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db')
+    app.teardown_appcontext(close_db)
+    logging.debug("Database pool configured: %s", type(app.extensions['db_pool']).__name__)
@@ -4,7 +4,9 @@ CREATE TABLE IF NOT EXISTS users (
     name TEXT NOT NULL,
     email TEXT NOT NULL UNIQUE,
     password TEXT NOT NULL,
-    role TEXT CHECK(role IN ('farmer', 'customer')) NOT NULL
+    role TEXT CHECK(role IN ('farmer', 'customer')) NOT NULL,
+    latitude REAL, -- Farm location, optional
+    longitude REAL
 );
 
 -- Create products table
@@ -18,6 +20,9 @@ CREATE TABLE IF NOT EXISTS products (
     image TEXT,
     farmer_id INTEGER,
     category TEXT,
+    latitude REAL, -- Where the product is offered; defaults to the farm location
+    longitude REAL,
+    version INTEGER NOT NULL DEFAULT 0, -- Bumped by every update; API ETags are built from it
     FOREIGN KEY(farmer_id) REFERENCES users(id)
 );
 
@@ -27,12 +32,35 @@ CREATE TABLE IF NOT EXISTS orders (
     product_id INTEGER,
     customer_id INTEGER,
     quantity INTEGER NOT NULL,
+    total_price REAL NOT NULL DEFAULT 0, -- Price paid for the line at checkout
     payment_option TEXT CHECK(payment_option IN ('credit', 'debit', 'cash')) NOT NULL,
     status TEXT DEFAULT 'Pending', -- Added status column for tracking orders
+    completed_at REAL, -- When delivery was confirmed; old completed orders are archived
     FOREIGN KEY(product_id) REFERENCES products(id),
     FOREIGN KEY(customer_id) REFERENCES users(id)
 );
 
+-- Completed orders moved out of orders by `flask archive-orders`, keeping the
+-- table that checkout and the order pages read small
+CREATE TABLE IF NOT EXISTS orders_archive (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER,
+    customer_id INTEGER,
+    quantity INTEGER NOT NULL,
+    total_price REAL NOT NULL DEFAULT 0,
+    payment_option TEXT NOT NULL,
+    status TEXT,
+    completed_at REAL
+);
+
+-- The full order history; filters on its columns reach the indexes of both tables
+CREATE VIEW IF NOT EXISTS order_history AS
+    SELECT id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at, 0 AS archived
+    FROM orders
+    UNION ALL
+    SELECT id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at, 1 AS archived
+    FROM orders_archive;
+
 -- Create cart table
 CREATE TABLE IF NOT EXISTS cart (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,5 +69,140 @@ CREATE TABLE IF NOT EXISTS cart (
     quantity INTEGER NOT NULL, -- Quantity of the product
     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Timestamp when the product was added to the cart
     FOREIGN KEY(customer_id) REFERENCES users(id),
-    FOREIGN KEY(product_id) REFERENCES products(id)
+    FOREIGN KEY(product_id) REFERENCES products(id),
+    UNIQUE(customer_id, product_id) -- One line per product; add_to_cart upserts into it
+);
+
+-- Indexes for the marketplace filters, dashboards and cart lookups
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, id);
+CREATE INDEX IF NOT EXISTS idx_products_farmer ON products(farmer_id, id);
+CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id, product_id);
+CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id);
+CREATE INDEX IF NOT EXISTS idx_orders_completed ON orders(completed_at);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive(customer_id, id);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_product ON orders_archive(product_id, id);
+
+-- Full-text index over the searchable product columns (external content table)
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name,
+    description,
+    category,
+    content='products',
+    content_rowid='id',
+    prefix='2 3'
+);
+
+-- Keep products_fts in sync with products. Stock changes from checkout do not
+-- touch the indexed columns, so the update trigger is limited to those.
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, name, description, category)
+    VALUES (new.id, new.name, new.description, new.category);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, description, category)
+    VALUES ('delete', old.id, old.name, old.description, old.category);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description, category ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, description, category)
+    VALUES ('delete', old.id, old.name, old.description, old.category);
+    INSERT INTO products_fts(rowid, name, description, category)
+    VALUES (new.id, new.name, new.description, new.category);
+END;
+
+-- Dashboard aggregates, kept current by the repositories' write paths
+-- (`flask rebuild-stats` recomputes them from products and orders)
+CREATE TABLE IF NOT EXISTS product_stats (
+    product_id INTEGER PRIMARY KEY,
+    farmer_id INTEGER,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    pending_orders INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS farmer_stats (
+    farmer_id INTEGER PRIMARY KEY,
+    products INTEGER NOT NULL DEFAULT 0,
+    low_stock_products INTEGER NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    pending_orders INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0
+);
+
+-- Marketplace facet counts per category, price bucket and in total (facet
+-- 'all'), kept current by the same write paths as the dashboard aggregates
+CREATE TABLE IF NOT EXISTS catalogue_facets (
+    facet TEXT NOT NULL,
+    value TEXT NOT NULL,
+    products INTEGER NOT NULL DEFAULT 0,
+    in_stock INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (facet, value)
+);
+
+-- Server-side sessions; the cookie only holds the id
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+
+-- Spatial index of product locations for proximity search; each point is a
+-- zero-size box, maintained by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS products_location USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+
+CREATE TRIGGER IF NOT EXISTS products_location_insert AFTER INSERT ON products
+WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+    INSERT INTO products_location VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_location_delete AFTER DELETE ON products BEGIN
+    DELETE FROM products_location WHERE id = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_location_update AFTER UPDATE OF latitude, longitude ON products BEGIN
+    DELETE FROM products_location WHERE id = old.id;
+    INSERT INTO products_location
+    SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+    WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+END;
+
+-- Background jobs run by `flask worker` (jobs.py); finished jobs are deleted
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    run_at REAL NOT NULL, -- When due; while leased, when the lease runs out
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    failed_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at, id) WHERE failed_at IS NULL;
+
+-- Sales rankings maintained by checkout; see RankingRepository
+CREATE TABLE IF NOT EXISTS product_rankings (
+    product_id INTEGER PRIMARY KEY,
+    category TEXT,
+    trending REAL NOT NULL DEFAULT 0, -- Units ordered, decayed, in the units of ranking_epoch
+    units INTEGER NOT NULL DEFAULT 0 -- Units ordered, all time
+);
+
+-- The best RANKING_SIZE products of each ranking, per category and overall (category '')
+CREATE TABLE IF NOT EXISTS top_products (
+    ranking TEXT NOT NULL,
+    category TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (ranking, category, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_top_products_order ON top_products(ranking, category, score DESC, product_id);
+
+-- When trending scores were last decayed; a single row
+CREATE TABLE IF NOT EXISTS ranking_epoch (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch REAL NOT NULL
 );
@@ -0,0 +1,148 @@
+-- PostgreSQL version of schema.sql, used when DATABASE_URL points at PostgreSQL
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    role TEXT CHECK(role IN ('farmer', 'customer')) NOT NULL,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL,
+    price DOUBLE PRECISION NOT NULL,
+    quantity INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    contact TEXT,
+    image TEXT,
+    farmer_id INTEGER REFERENCES users(id),
+    category TEXT,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    version INTEGER NOT NULL DEFAULT 0,
+    -- Replaces the SQLite products_fts table; weights mirror its bm25 weights
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', name), 'A') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('simple', description), 'C')
+    ) STORED
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    product_id INTEGER REFERENCES products(id),
+    customer_id INTEGER REFERENCES users(id),
+    quantity INTEGER NOT NULL,
+    total_price DOUBLE PRECISION NOT NULL DEFAULT 0,
+    payment_option TEXT CHECK(payment_option IN ('credit', 'debit', 'cash')) NOT NULL,
+    status TEXT DEFAULT 'Pending',
+    completed_at DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS orders_archive (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER,
+    customer_id INTEGER,
+    quantity INTEGER NOT NULL,
+    total_price DOUBLE PRECISION NOT NULL DEFAULT 0,
+    payment_option TEXT NOT NULL,
+    status TEXT,
+    completed_at DOUBLE PRECISION
+);
+
+CREATE OR REPLACE VIEW order_history AS
+    SELECT id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at, 0 AS archived
+    FROM orders
+    UNION ALL
+    SELECT id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at, 1 AS archived
+    FROM orders_archive;
+
+CREATE TABLE IF NOT EXISTS cart (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES users(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    quantity INTEGER NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(customer_id, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, id);
+CREATE INDEX IF NOT EXISTS idx_products_farmer ON products(farmer_id, id);
+CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector);
+-- Replaces the SQLite products_location R*Tree for proximity search
+CREATE INDEX IF NOT EXISTS idx_products_location ON products USING GIST (point(longitude, latitude));
+CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id, product_id);
+CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id);
+CREATE INDEX IF NOT EXISTS idx_orders_completed ON orders(completed_at);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive(customer_id, id);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_product ON orders_archive(product_id, id);
+
+CREATE TABLE IF NOT EXISTS product_stats (
+    product_id INTEGER PRIMARY KEY,
+    farmer_id INTEGER,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+    pending_orders INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS farmer_stats (
+    farmer_id INTEGER PRIMARY KEY,
+    products INTEGER NOT NULL DEFAULT 0,
+    low_stock_products INTEGER NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+    pending_orders INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS catalogue_facets (
+    facet TEXT NOT NULL,
+    value TEXT NOT NULL,
+    products INTEGER NOT NULL DEFAULT 0,
+    in_stock INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (facet, value)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    run_at DOUBLE PRECISION NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at DOUBLE PRECISION NOT NULL,
+    failed_at DOUBLE PRECISION,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at, id) WHERE failed_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS product_rankings (
+    product_id INTEGER PRIMARY KEY,
+    category TEXT,
+    trending DOUBLE PRECISION NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS top_products (
+    ranking TEXT NOT NULL,
+    category TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (ranking, category, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_top_products_order ON top_products(ranking, category, score DESC, product_id);
+
+CREATE TABLE IF NOT EXISTS ranking_epoch (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch DOUBLE PRECISION NOT NULL
+);
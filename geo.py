@@ -0,0 +1,58 @@
+"""Coordinates for proximity search: parsing, bounding boxes and distances.
+
+Nearby queries first select the rows inside a latitude/longitude bounding
+box through a spatial index (an R*Tree on SQLite, GiST on PostgreSQL), then
+compute the exact great-circle distance only for those candidates.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180  # Along a meridian, about 111.2 km
+
+
+def coordinates(latitude, longitude):
+    """Validate a latitude/longitude pair; blank values give (None, None)."""
+    if latitude in (None, '') and longitude in (None, ''):
+        return None, None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must both be numbers") from None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("latitude must be within ±90 and longitude within ±180")
+    return latitude, longitude
+
+
+def parse_point(value):
+    """Decode ``near=<lat>,<lon>``; anything invalid means no proximity filter."""
+    try:
+        latitude, longitude = value.split(',', 1)
+        point = coordinates(latitude.strip(), longitude.strip())
+    except (AttributeError, ValueError):
+        return None
+    return point if point[0] is not None else None
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing the circle of ``radius_km``.
+
+    Boxes that reach a pole or cross the antimeridian are widened to every
+    longitude; the exact distance check removes the extra rows.
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(math.radians(delta_lat)) / math.cos(math.radians(latitude)))))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    """Haversine great-circle distance, as computed in SQL by the repositories."""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
@@ -0,0 +1,18 @@
+# gunicorn settings for the ASGI mode: gunicorn -c gunicorn_asgi.conf.py asgi:application
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Event-loop workers are not pinned by slow connections, so one per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+keepalive = 5  # Seconds to hold idle keep-alive connections from mobile clients
+timeout = 30
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # The in-process product cache is per worker; invalidations only reach the others through Redis
+    if server.cfg.workers > 1 and not os.getenv("CACHE_REDIS_URL"):
+        server.log.warning("%d workers without CACHE_REDIS_URL: edits may be served stale by other workers "
+                           "for up to CACHE_TTL seconds.", server.cfg.workers)
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from cache import get_cache
+from database import DatabaseError
+from repositories import get_repositories
+
+# Resized variants written for every upload: name -> max width in pixels
+VARIANTS = {'thumb': 160, 'card': 400, 'full': 1200}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+# Uploads are copied to disk this many bytes at a time
+COPY_CHUNK = 1024 * 1024
+
+# Leading bytes of the image types we accept
+SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+
+def looks_like_image(data):
+    """Cheap magic-number check done in the request before queueing the upload."""
+    return data.startswith(SIGNATURES) or (data[:4] == b'RIFF' and data[8:12] == b'WEBP')
+
+
+def variant_filename(name, variant, ext):
+    return f"{name}-{variant}.{ext}"
+
+
+class ImagePipelineBusy(Exception):
+    """Raised when ``max_queued`` uploads are already waiting for the pool."""
+
+
+class ImagePipeline:
+    """Background pool that turns raw uploads into stripped, resized variants.
+
+    Uploads are spooled to a temporary file before they are queued, so the
+    queue holds paths rather than image bytes, and at most ``max_queued`` of
+    them wait at once. When an upload cannot be processed, ``on_failure`` is
+    called with its stored name.
+    """
+
+    def __init__(self, upload_folder, workers=2, max_queued=64, on_failure=None):
+        self.upload_folder = upload_folder
+        self.on_failure = on_failure
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image')
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, stream, block=False):
+        """Queue an upload read from a binary stream and return its stored name, or None if it is not an image.
+
+        Raises ImagePipelineBusy when the queue is full, unless ``block`` is set,
+        in which case it waits for a slot.
+        """
+        if not self._slots.acquire(blocking=block):
+            raise ImagePipelineBusy(f"{len(self._pending)} uploads are waiting to be processed")
+        queued = False
+        try:
+            name, path = self._spool(stream)
+            if name is None:
+                return None
+            with self._lock:
+                duplicate = name in self._pending or self.is_processed(name)
+                if not duplicate:
+                    self._pending.add(name)
+            if duplicate:
+                logging.debug("Upload %s already stored, skipping processing.", name)
+                os.remove(path)
+                return name
+            try:
+                self._executor.submit(self._process, name, path)
+            except RuntimeError:  # Shut down
+                with self._lock:
+                    self._pending.discard(name)
+                os.remove(path)
+                raise
+            queued = True
+            return name
+        finally:
+            if not queued:
+                self._slots.release()
+
+    def _spool(self, stream):
+        """Copy an upload to a temporary file; returns (name, path), or (None, None) if it is not an image."""
+        head = stream.read(12)
+        if not looks_like_image(head):
+            return None, None
+        # Stored uploads are named after their content, so identical files share variants
+        digest = hashlib.sha256(head)
+        fd, path = tempfile.mkstemp(suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                spool.write(head)
+                for chunk in iter(partial(stream.read, COPY_CHUNK), b''):
+                    digest.update(chunk)
+                    spool.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        try:
+            # Reject what is clearly broken before a product points at it
+            with Image.open(path) as probe:
+                probe.verify()
+        except Exception as e:
+            logging.debug("Upload is not a readable image: %s", e)
+            os.remove(path)
+            return None, None
+        return digest.hexdigest()[:24], path
+
+    def is_processed(self, name):
+        # The largest JPEG is written last, so its presence means every variant exists
+        return os.path.exists(os.path.join(self.upload_folder, variant_filename(name, 'full', 'jpg')))
+
+    def _process(self, name, path):
+        try:
+            with Image.open(path) as original:
+                # Apply the EXIF orientation, then drop EXIF/ICC/comments by re-encoding
+                image = ImageOps.exif_transpose(original).convert('RGB')
+            for variant, width in sorted(VARIANTS.items(), key=lambda item: item[1]):
+                resized = image.copy()
+                resized.thumbnail((width, width * 4), Image.LANCZOS)
+                for ext, (fmt, options) in FORMATS.items():
+                    self._write(variant_filename(name, variant, ext), resized, fmt, options)
+            logging.debug("Processed upload %s.", name)
+        except Exception:
+            logging.exception("Failed to process uploaded image %s", name)
+            if self.on_failure is not None:
+                self.on_failure(name)
+        finally:
+            os.remove(path)
+            with self._lock:
+                self._pending.discard(name)
+            self._slots.release()
+
+    def _write(self, filename, image, fmt, options):
+        path = os.path.join(self.upload_folder, filename)
+        tmp_path = path + '.tmp'
+        image.save(tmp_path, fmt, **options)
+        os.replace(tmp_path, path)  # Never serve a half-written file
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def get_image_pipeline(app=None):
+    app = app or current_app
+    return app.extensions['image_pipeline']
+
+
+def clear_failed_image(app, name):
+    """Point products at no image rather than at variants that will never be written."""
+    with app.app_context():
+        try:
+            product_ids = get_repositories().products.clear_image(name)
+        except DatabaseError as e:
+            logging.error("Could not clear failed image %s: %s", name, e)
+            return
+        if product_ids:
+            logging.warning("Cleared image %s from products %s.", name, product_ids)
+            get_cache(app).invalidate_products(product_ids)
+
+
+def init_app(app):
+    app.extensions['image_pipeline'] = ImagePipeline(
+        app.config['UPLOAD_FOLDER'],
+        workers=app.config.get('IMAGE_WORKERS', 2),
+        max_queued=app.config.get('IMAGE_QUEUE_SIZE', 64),
+        on_failure=partial(clear_failed_image, app),
+    )
+    app.jinja_env.globals['IMAGE_VARIANTS'] = VARIANTS
@@ -0,0 +1,155 @@
+"""Durable background jobs, queued in the ``jobs`` table.
+
+Write paths enqueue a job in the same transaction as the change it reports,
+so a job exists exactly when its change was committed, and the request does
+no more than that insert. ``flask worker`` runs ``JOB_WORKERS`` processes;
+each leases up to ``JOB_BATCH_SIZE`` due jobs at a time and hides them from
+the others for ``JOB_VISIBILITY_TIMEOUT`` seconds. Finished jobs are
+deleted. A failed job is retried after ``JOB_RETRY_DELAY`` seconds, doubling
+with every attempt, and is kept with its error once it has failed
+``JOB_MAX_ATTEMPTS`` times. A worker that dies only loses its lease, so
+delivery is at least once and handlers must be safe to run twice.
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+
+from database import get_pool
+from repositories import get_repositories
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register ``func(repos, payload)`` to run ``kind`` jobs."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+@handler('orders.placed')
+@handler('delivery.confirmed')
+def notify_farmers(repos, payload):
+    # There is no mail service yet, so the notification is logged
+    for order in repos.orders.with_farmers(payload['order_ids']):
+        logging.info("Notify %s <%s>: order %s for %d x %s is %s.", order['farmer_name'], order['farmer_email'],
+                     order['id'], order['quantity'], order['product_name'], order['status'])
+
+
+class JobWorker:
+    """Leases batches of jobs and runs their handlers on one connection."""
+
+    def __init__(self, repos, batch_size=20, visibility_timeout=60, max_attempts=5, retry_delay=5, max_retry_delay=600):
+        self.repos = repos
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.processed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_config(cls, repos, config):
+        return cls(repos, batch_size=config['JOB_BATCH_SIZE'], visibility_timeout=config['JOB_VISIBILITY_TIMEOUT'],
+                   max_attempts=config['JOB_MAX_ATTEMPTS'], retry_delay=config['JOB_RETRY_DELAY'],
+                   max_retry_delay=config['JOB_MAX_RETRY_DELAY'])
+
+    def run_batch(self):
+        """Lease and run one batch; returns the number of jobs leased."""
+        jobs = self.repos.jobs.lease(self.batch_size, self.visibility_timeout)
+        done = []
+        for job in jobs:
+            try:
+                func = HANDLERS.get(job['kind'])
+                if func is None:
+                    raise LookupError(f"no handler for {job['kind']!r} jobs")
+                func(self.repos, json.loads(job['payload']))
+            except Exception as e:
+                self._failed(job, e)
+            else:
+                done.append(job)
+        self.repos.jobs.complete(done)
+        self.processed += len(done)
+        return len(jobs)
+
+    def _failed(self, job, error):
+        self.failed += 1
+        if self.repos.conn.in_transaction:
+            self.repos.conn.rollback()
+        if job['attempts'] >= self.max_attempts:
+            logging.error("Job %s (%s) failed %d times, giving up: %s", job['id'], job['kind'], job['attempts'], error)
+            self.repos.jobs.fail(job, str(error))
+            return
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (job['attempts'] - 1))
+        logging.warning("Job %s (%s) failed, retrying in %ss: %s", job['id'], job['kind'], delay, error)
+        self.repos.jobs.retry(job, delay, str(error))
+
+    def run(self, stop, poll_interval=1.0, burst=False):
+        """Run batches until ``stop`` is set; with ``burst``, also once no job is due."""
+        while not stop.is_set():
+            if self.run_batch():
+                continue
+            if burst:
+                return
+            stop.wait(poll_interval)
+
+
+def run_worker(app, stop, burst=False, batch_size=None):
+    """Run one worker in this process; returns it for its counts."""
+    pool = get_pool(app)
+    conn = pool.acquire()
+    try:
+        with app.app_context():
+            worker = JobWorker.from_config(get_repositories(conn), app.config)
+            worker.batch_size = batch_size or worker.batch_size
+            worker.run(stop, app.config['JOB_POLL_INTERVAL'], burst)
+    finally:
+        pool.release(conn)
+    logging.info("Job worker %d stopped after %d jobs (%d failed attempts).", os.getpid(), worker.processed, worker.failed)
+    return worker
+
+
+def _worker_process(import_name, stop, burst, batch_size):
+    # The parent turns SIGINT/SIGTERM into ``stop``, so a batch in progress is finished
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    app = importlib.import_module(import_name).app
+    try:
+        run_worker(app, stop, burst, batch_size)
+    finally:
+        # Child processes exit without running atexit, which flushes queued log records
+        if 'log_listener' in app.extensions:
+            app.extensions['log_listener'].stop()
+
+
+def run_workers(app, processes, burst=False, batch_size=None):
+    """Run ``processes`` workers until SIGINT or SIGTERM (with ``burst``, until no job is due).
+
+    ``processes=0`` runs a single worker in this process. Worker processes
+    come from the fork server and import the app module afresh, so settings
+    changed at run time must be passed in, like ``batch_size``.
+    """
+    context = multiprocessing.get_context('forkserver')
+    stop = context.Event() if processes else threading.Event()
+    previous = {signum: signal.signal(signum, lambda signum, frame: stop.set())
+                for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        if not processes:
+            run_worker(app, stop, burst, batch_size)
+            return
+        workers = [context.Process(target=_worker_process, args=(app.import_name, stop, burst, batch_size), name=f'job-worker-{n}')
+                   for n in range(processes)]
+        for worker in workers:
+            worker.start()
+        logging.info("Started %d job workers.", processes)
+        for worker in workers:
+            worker.join()
+    finally:
+        for signum, previous_handler in previous.items():
+            signal.signal(signum, previous_handler)
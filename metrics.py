@@ -0,0 +1,191 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+
+import auth
+import database
+from repositories import get_repositories
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class Histogram:
+    """A labelled Prometheus histogram kept in process memory."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            for labels, series in items:
+                base = _labels(self.label_names, labels)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{base}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _labels(names, values):
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _gauges(name, help_text, values):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f'{name}{{stat="{key}"}} {value}' for key, value in sorted(values.items()))
+    return lines
+
+
+# A placeholder list such as "IN (?, ?, ?)", whose length varies with the call
+IN_LIST = re.compile(r'\bIN \(\?(?:, ?\?)*\)', re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and IN lists so one statement is one label, whatever its indentation or arguments."""
+    return IN_LIST.sub('IN (...)', re.sub(r'\s+', ' ', sql).strip())[:200]
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', "Request latency, including streamed bodies.",
+                            ('endpoint', 'method', 'status'))
+QUERY_LATENCY = Histogram('db_query_duration_seconds', "SQL statement latency.", ('statement',))
+QUERIES_PER_REQUEST = Histogram('db_queries_per_request', "SQL statements run per request.",
+                                ('endpoint',), buckets=COUNT_BUCKETS)
+TEMPLATE_LATENCY = Histogram('template_render_duration_seconds', "Template render time.", ('template',))
+REPEATED_QUERIES = CounterMetric('db_repeated_statement_requests_total',
+                                 "Requests that ran one statement at least N_PLUS_ONE_THRESHOLD times.",
+                                 ('endpoint', 'statement'))
+SLOW_QUERIES = CounterMetric('db_slow_queries_total', "Statements slower than SLOW_QUERY_MS.", ('statement',))
+
+HISTOGRAMS = (REQUEST_LATENCY, QUERY_LATENCY, QUERIES_PER_REQUEST, TEMPLATE_LATENCY)
+COUNTERS = (REPEATED_QUERIES, SLOW_QUERIES)
+
+
+def _record_query(sql, seconds):
+    statement = normalize_sql(sql)
+    QUERY_LATENCY.observe((statement,), seconds)
+    if not has_app_context():
+        return
+    slow_ms = current_app.config.get('SLOW_QUERY_MS')
+    if slow_ms is not None and seconds * 1000 >= slow_ms:
+        SLOW_QUERIES.inc((statement,))
+        logging.warning("Slow query (%.1f ms): %s", seconds * 1000, statement)
+    if 'metrics_statements' in g:
+        # Async views run queries on several executor threads that share this g
+        with g.metrics_lock:
+            g.metrics_statements[statement] += 1
+
+
+def _template_started(sender, template, context, **extra):
+    if has_app_context():
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    if has_app_context() and g.get('metrics_templates'):
+        TEMPLATE_LATENCY.observe((template.name,), time.perf_counter() - g.metrics_templates.pop())
+
+
+def render_metrics():
+    lines = []
+    for metric in HISTOGRAMS + COUNTERS:
+        lines.extend(metric.render())
+    lines.extend(_gauges('db_pool', "Connection pool counters.", database.get_pool().stats()))
+    if 'product_cache' in current_app.extensions:
+        lines.extend(_gauges('product_cache', "Product cache counters.", current_app.extensions['product_cache'].stats()))
+    if hasattr(current_app.session_interface, 'stats'):
+        lines.extend(_gauges('sessions', "Server-side session store counters.", current_app.session_interface.stats()))
+    if 'password_hasher' in current_app.extensions:
+        lines.extend(_gauges('password_hasher', "Password hashing pool counters.",
+                             current_app.extensions['password_hasher'].stats()))
+        lines.extend(_gauges('login_limiter', "Login attempts turned away by the rate limiter.", auth.limiter_stats()))
+    try:
+        lines.extend(_gauges('job_queue', "Background jobs by state, and seconds the oldest due job has waited.",
+                             get_repositories().jobs.stats()))
+    except database.DatabaseError as e:
+        logging.error("Could not read job queue stats: %s", e)
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Record request, SQL and template timings and serve them on /metrics."""
+    database.query_listeners.append(_record_query)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_statements = Counter()
+        g.metrics_lock = threading.Lock()
+
+    @app.after_request
+    def observe_request(response):
+        if 'metrics_started' not in g:
+            return response
+        started, statements = g.metrics_started, g.metrics_statements
+        endpoint = request.endpoint or 'unmatched'
+        labels = (endpoint, request.method, response.status_code)
+
+        def finish():
+            # Runs when the server closes the response, so streamed bodies are timed too
+            REQUEST_LATENCY.observe(labels, time.perf_counter() - started)
+            QUERIES_PER_REQUEST.observe((endpoint,), sum(statements.values()))
+            for statement, count in statements.items():
+                if count >= threshold:
+                    REPEATED_QUERIES.inc((endpoint, statement))
+                    logging.warning("Possible N+1: %s ran %d times in %s", statement, count, endpoint)
+
+        response.call_on_close(finish)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', render_metrics)
@@ -0,0 +1,439 @@
+"""Versioned, non-destructive schema migrations, applied with ``flask migrate``.
+
+Each migration is a function registered with ``@migration(version, name)``
+that receives a Migrator, and every step is safe to re-run so an interrupted
+migration simply resumes. Applied versions are recorded in the
+schema_migrations table. Databases created from the current schema file
+(``flask initdb``) are stamped with every version, so only older databases
+replay them.
+
+Long-running work is split so live traffic keeps flowing: backfills update
+``batch_size`` rows per short write transaction, and indexes are built one
+per transaction (``CREATE INDEX CONCURRENTLY`` on PostgreSQL). On SQLite an
+index build still holds the write lock while it runs, but WAL readers are
+never blocked.
+"""
+import logging
+import time
+from collections import namedtuple
+
+from database import write_transaction
+from repositories import get_repositories
+
+Migration = namedtuple('Migration', 'version name apply dialects')
+
+MIGRATIONS = {}
+
+
+def migration(version, name, dialects=('sqlite', 'postgresql')):
+    """Register ``func(migrator)`` as schema version ``version``."""
+    def register(func):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = Migration(version, name, func, dialects)
+        return func
+    return register
+
+
+class Migrator:
+    """Applies pending migrations to one connection and provides their building blocks."""
+
+    def __init__(self, conn, batch_size=1000, pause=0.0):
+        self.conn = conn
+        self.dialect = getattr(conn, 'dialect', 'sqlite')
+        self.batch_size = batch_size
+        self.pause = pause  # Seconds between backfill batches, to leave room for other writers
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.commit()
+
+    def applied(self):
+        return {row['version'] for row in self.conn.execute("SELECT version FROM schema_migrations")}
+
+    def pending(self):
+        applied = self.applied()
+        return [MIGRATIONS[version] for version in sorted(MIGRATIONS) if version not in applied]
+
+    def migrate(self, target=None):
+        """Apply pending migrations up to ``target``; returns the versions applied."""
+        done = []
+        for step in self.pending():
+            if target is not None and step.version > target:
+                break
+            if self.dialect in step.dialects:
+                logging.info("Applying migration %04d %s...", step.version, step.name)
+                started = time.perf_counter()
+                step.apply(self)
+                logging.info("Migration %04d applied in %.1fs.", step.version, time.perf_counter() - started)
+            else:
+                logging.info("Skipping migration %04d %s (not needed on %s).", step.version, step.name, self.dialect)
+            self._record(step)
+            done.append(step.version)
+        if done and self.dialect == 'sqlite':
+            self.conn.execute("PRAGMA optimize")
+        return done
+
+    def stamp(self):
+        """Mark every migration as applied, for a database built from the current schema."""
+        for step in self.pending():
+            self._record(step)
+
+    def _record(self, step):
+        self.conn.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (step.version, step.name))
+        self.conn.commit()
+
+    # Building blocks for migrations
+
+    def transaction(self):
+        if self.dialect == 'sqlite':
+            return write_transaction(self.conn)
+        return self.conn.transaction()
+
+    def script(self, sql):
+        """Run several DDL statements atomically."""
+        if self.dialect == 'sqlite':
+            self.conn.executescript(f"BEGIN IMMEDIATE;\n{sql}\nCOMMIT;")
+        else:
+            with self.conn.transaction():
+                self.conn.execute(sql)
+
+    def has_column(self, table, column):
+        if self.dialect == 'sqlite':
+            return any(row['name'] == column for row in self.conn.execute(f"PRAGMA table_info({table})"))
+        return self.conn.execute("""
+            SELECT 1 FROM information_schema.columns WHERE table_name = ? AND column_name = ?
+        """, (table, column)).fetchone() is not None
+
+    def add_column(self, table, column, definition):
+        # Adding a column with a constant default is a metadata-only change on both backends
+        if not self.has_column(table, column):
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            self.conn.commit()
+
+    def create_index(self, name, table, columns, unique=False, using=None):
+        """Build one index without holding up readers (or, on PostgreSQL, writers)."""
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        if using:
+            table = f"{table} USING {using}"
+        if self.dialect == 'postgresql':
+            # A failed concurrent build leaves an invalid index behind; drop it and retry
+            invalid = self.conn.execute("""
+                SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+                WHERE pg_class.relname = ? AND NOT pg_index.indisvalid
+            """, (name,)).fetchone()
+            if invalid:
+                self.conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            self.conn.execute(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table}({columns})")
+        else:
+            self.conn.execute(f"CREATE {kind} IF NOT EXISTS {name} ON {table}({columns})")
+            self.conn.execute(f"ANALYZE {name}")
+            self.conn.commit()
+
+    def backfill(self, table, assignments, where, params=()):
+        """``UPDATE table SET assignments WHERE where`` in batches of ``batch_size`` ids.
+
+        ``where`` should stop matching a row once it has been updated, so a
+        re-run only touches rows an interrupted backfill did not reach.
+        Returns the number of rows updated.
+        """
+        last_id = 0
+        updated = 0
+        while True:
+            ids = self.conn.execute(f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                                    (last_id, self.batch_size)).fetchall()
+            if not ids:
+                break
+            first_id, last_id = ids[0]['id'], ids[-1]['id']
+            with self.transaction():
+                result = self.conn.execute(
+                    f"UPDATE {table} SET {assignments} WHERE ({where}) AND id BETWEEN ? AND ?",
+                    (*params, first_id, last_id))
+            updated += max(result.rowcount, 0)
+            logging.debug("Backfilled %s up to id %s (%d rows so far).", table, last_id, updated)
+            if self.pause:
+                time.sleep(self.pause)
+        return updated
+
+
+# Migrations. Versions 1-5 bring databases created before versioning up to
+# database/schema.sql; PostgreSQL databases started from the current schema.
+
+@migration(1, 'initial schema', dialects=('sqlite',))
+def initial_schema(m):
+    m.script("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            role TEXT CHECK(role IN ('farmer', 'customer')) NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            contact TEXT,
+            image TEXT,
+            farmer_id INTEGER,
+            category TEXT,
+            FOREIGN KEY(farmer_id) REFERENCES users(id)
+        );
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            customer_id INTEGER,
+            quantity INTEGER NOT NULL,
+            payment_option TEXT CHECK(payment_option IN ('credit', 'debit', 'cash')) NOT NULL,
+            status TEXT DEFAULT 'Pending',
+            FOREIGN KEY(product_id) REFERENCES products(id),
+            FOREIGN KEY(customer_id) REFERENCES users(id)
+        );
+        CREATE TABLE IF NOT EXISTS cart (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(customer_id) REFERENCES users(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        );
+    """)
+
+
+@migration(2, 'orders.total_price', dialects=('sqlite',))
+def orders_total_price(m):
+    m.add_column('orders', 'total_price', 'REAL NOT NULL DEFAULT 0')
+    # Historical prices were never stored, so price old orders at today's price
+    m.backfill('orders', "total_price = quantity * (SELECT price FROM products WHERE products.id = orders.product_id)",
+               "total_price = 0 AND product_id IN (SELECT id FROM products)")
+
+
+@migration(3, 'one cart line per product', dialects=('sqlite',))
+def cart_unique_lines(m):
+    with m.transaction():
+        m.conn.execute("""
+            UPDATE cart SET quantity = (SELECT SUM(quantity) FROM cart AS line
+                                        WHERE line.customer_id = cart.customer_id AND line.product_id = cart.product_id)
+            WHERE id IN (SELECT MIN(id) FROM cart GROUP BY customer_id, product_id HAVING COUNT(*) > 1)
+        """)
+        m.conn.execute("DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY customer_id, product_id)")
+    m.create_index('idx_cart_customer_product', 'cart', 'customer_id, product_id', unique=True)
+
+
+@migration(4, 'catalogue and order indexes', dialects=('sqlite',))
+def performance_indexes(m):
+    m.create_index('idx_products_category', 'products', 'category, id')
+    m.create_index('idx_products_farmer', 'products', 'farmer_id, id')
+    m.create_index('idx_orders_customer', 'orders', 'customer_id, product_id')
+    m.create_index('idx_orders_product', 'orders', 'product_id')
+
+
+@migration(5, 'products full-text index', dialects=('sqlite',))
+def products_fts(m):
+    m.script("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, category, content='products', content_rowid='id', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description, new.category);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, category)
+            VALUES ('delete', old.id, old.name, old.description, old.category);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description, category ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, category)
+            VALUES ('delete', old.id, old.name, old.description, old.category);
+            INSERT INTO products_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description, new.category);
+        END;
+        INSERT INTO products_fts(products_fts) VALUES ('rebuild');
+    """)
+
+
+@migration(6, 'dashboard aggregates')
+def dashboard_aggregates(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    m.script(f"""
+        CREATE TABLE IF NOT EXISTS product_stats (
+            product_id INTEGER PRIMARY KEY,
+            farmer_id INTEGER,
+            units_sold INTEGER NOT NULL DEFAULT 0,
+            revenue {real} NOT NULL DEFAULT 0,
+            pending_orders INTEGER NOT NULL DEFAULT 0,
+            completed_orders INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS farmer_stats (
+            farmer_id INTEGER PRIMARY KEY,
+            products INTEGER NOT NULL DEFAULT 0,
+            low_stock_products INTEGER NOT NULL DEFAULT 0,
+            units_sold INTEGER NOT NULL DEFAULT 0,
+            revenue {real} NOT NULL DEFAULT 0,
+            pending_orders INTEGER NOT NULL DEFAULT 0,
+            completed_orders INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    get_repositories(m.conn).stats.rebuild(batch_size=m.batch_size, history='orders')
+
+
+@migration(7, 'server-side sessions')
+def server_sessions(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    m.script(f"""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at {real} NOT NULL
+        );
+    """)
+    m.create_index('idx_sessions_expires', 'sessions', 'expires_at')
+
+
+@migration(8, 'product locations')
+def product_locations(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    for table in ('users', 'products'):
+        m.add_column(table, 'latitude', real)
+        m.add_column(table, 'longitude', real)
+    if m.dialect == 'postgresql':
+        m.create_index('idx_products_location', 'products', 'point(longitude, latitude)', using='GIST')
+        return
+    m.script("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_location USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+        CREATE TRIGGER IF NOT EXISTS products_location_insert AFTER INSERT ON products
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO products_location VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_location_delete AFTER DELETE ON products BEGIN
+            DELETE FROM products_location WHERE id = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_location_update AFTER UPDATE OF latitude, longitude ON products BEGIN
+            DELETE FROM products_location WHERE id = old.id;
+            INSERT INTO products_location
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END;
+        INSERT OR REPLACE INTO products_location
+        SELECT id, latitude, latitude, longitude, longitude FROM products
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
+    """)
+
+
+@migration(9, 'marketplace facets')
+def marketplace_facets(m):
+    m.script("""
+        CREATE TABLE IF NOT EXISTS catalogue_facets (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            products INTEGER NOT NULL DEFAULT 0,
+            in_stock INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (facet, value)
+        );
+    """)
+    get_repositories(m.conn).facets.rebuild()
+
+
+@migration(10, 'background jobs')
+def background_jobs(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    identity = ('INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY' if m.dialect == 'postgresql'
+                else 'INTEGER PRIMARY KEY AUTOINCREMENT')
+    m.script(f"""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id {identity},
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            run_at {real} NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at {real} NOT NULL,
+            failed_at {real},
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at, id) WHERE failed_at IS NULL;
+    """)
+
+
+@migration(11, 'order archive')
+def order_archive(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    columns = "id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at"
+    m.add_column('orders', 'completed_at', real)
+    # Orders completed before completion times were recorded count as completed now
+    m.backfill('orders', 'completed_at = ?', "status = 'Completed' AND completed_at IS NULL", (time.time(),))
+    m.script(f"""
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            product_id INTEGER,
+            customer_id INTEGER,
+            quantity INTEGER NOT NULL,
+            total_price {real} NOT NULL DEFAULT 0,
+            payment_option TEXT NOT NULL,
+            status TEXT,
+            completed_at {real}
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive(customer_id, id);
+        CREATE INDEX IF NOT EXISTS idx_orders_archive_product ON orders_archive(product_id, id);
+        {'CREATE OR REPLACE VIEW' if m.dialect == 'postgresql' else 'CREATE VIEW IF NOT EXISTS'} order_history AS
+            SELECT {columns}, 0 AS archived FROM orders
+            UNION ALL
+            SELECT {columns}, 1 AS archived FROM orders_archive;
+    """)
+    m.create_index('idx_orders_completed', 'orders', 'completed_at')
+
+
+@migration(12, 'product versions')
+def product_versions(m):
+    m.add_column('products', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(13, 'sales rankings')
+def sales_rankings(m):
+    real = 'DOUBLE PRECISION' if m.dialect == 'postgresql' else 'REAL'
+    m.script(f"""
+        CREATE TABLE IF NOT EXISTS product_rankings (
+            product_id INTEGER PRIMARY KEY,
+            category TEXT,
+            trending {real} NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_product_rankings_trending ON product_rankings(category, trending);
+        CREATE INDEX IF NOT EXISTS idx_product_rankings_trending_all ON product_rankings(trending);
+        CREATE INDEX IF NOT EXISTS idx_product_rankings_units ON product_rankings(category, units);
+        CREATE INDEX IF NOT EXISTS idx_product_rankings_units_all ON product_rankings(units);
+        CREATE TABLE IF NOT EXISTS top_products (
+            ranking TEXT NOT NULL,
+            category TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            score {real} NOT NULL,
+            PRIMARY KEY (ranking, category, product_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_top_products_score ON top_products(ranking, category, score);
+        CREATE TABLE IF NOT EXISTS ranking_epoch (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch {real} NOT NULL
+        );
+    """)
+    # Best-sellers start from the order history; trending starts with the next checkout
+    get_repositories(m.conn).rankings.rebuild()
+
+
+@migration(14, 'ranking indexes')
+def ranking_indexes(m):
+    # Lists are read and trimmed best first, ties by product id, straight off this index
+    m.create_index('idx_top_products_order', 'top_products', 'ranking, category, score DESC, product_id')
+    # Every checkout rewrites the scores, while only rebuilds and removed products read them in order
+    m.script("""
+        DROP INDEX IF EXISTS idx_top_products_score;
+        DROP INDEX IF EXISTS idx_product_rankings_trending;
+        DROP INDEX IF EXISTS idx_product_rankings_trending_all;
+        DROP INDEX IF EXISTS idx_product_rankings_units;
+        DROP INDEX IF EXISTS idx_product_rankings_units_all;
+    """)
@@ -0,0 +1,91 @@
+from flask import current_app, request
+
+
+def page_size():
+    """Page size from ?per_page=, clamped to the configured maximum."""
+    default = current_app.config.get('PAGE_SIZE', 24)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', 100)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+def parse_id_cursor(value):
+    """Decode an ``after=<id>`` cursor; anything invalid starts from the top."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ranked_cursor(value):
+    """Decode an ``after=<score>:<id>`` cursor used for ranked search results."""
+    try:
+        score, last_id = value.split(':', 1)
+        return float(score), int(last_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def ranked_cursor(row):
+    return '{!r}:{}'.format(row['score'], row['id'])
+
+
+def parse_history_cursor(value):
+    """Decode an order history cursor: ``after=<id>``, or ``after=a<id>`` once into the archive.
+
+    Returns ``(archived, id)``, or None to start from the newest order.
+    """
+    archived = bool(value) and value.startswith('a')
+    last_id = parse_id_cursor(value[1:] if archived else value)
+    return (archived, last_id) if last_id is not None else None
+
+
+def history_cursor(row):
+    return '{}{}'.format('a' if row['archived'] else '', row['id'])
+
+
+class KeysetPage:
+    """Iterate one page of rows straight off a cursor, or a list of fetched rows.
+
+    The query should select ``per_page + 1`` rows; the extra row is never
+    yielded and only signals that a next page exists. ``next_cursor`` is set
+    once iteration finishes, so templates can render it after the loop
+    without the rows ever being materialised in a list. ``on_complete`` is
+    called with the page's rows and next cursor after a full iteration, for
+    callers that want to cache the page.
+    """
+
+    def __init__(self, cursor, per_page, key=lambda row: row['id'], on_complete=None):
+        self._cursor = cursor
+        self._key = key
+        self._on_complete = on_complete
+        self.per_page = per_page
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        rows = [] if self._on_complete else None
+        try:
+            for count, row in enumerate(self._cursor):
+                if count == self.per_page:
+                    self.next_cursor = self._key(last)
+                    break
+                last = row
+                if rows is not None:
+                    rows.append(row)
+                yield row
+        finally:
+            close = getattr(self._cursor, 'close', None)
+            if close is not None:
+                close()
+        # Only reached when the page was iterated to the end
+        if self._on_complete:
+            self._on_complete(rows, self.next_cursor)
+
+
+class RenderedPage:
+    """A page served from the fragment cache: its card HTML and next cursor."""
+
+    def __init__(self, html, next_cursor):
+        self.html = html
+        self.next_cursor = next_cursor
@@ -0,0 +1,127 @@
+"""PostgreSQL backend, used when DATABASE_URL is a postgresql:// URL.
+
+PostgresPool has the same interface as database.ConnectionPool, and its
+connections accept the same ``?``-style statements as the SQLite ones, so
+the repositories run unchanged on either backend. Needs ``psycopg`` and
+``psycopg_pool`` (``pip install "psycopg[binary,pool]"``); the schema is
+database/schema_postgres.sql, applied by ``flask initdb``.
+"""
+import logging
+import time
+
+import psycopg
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool as PsycopgPool
+
+import database
+
+SCHEMA_PATH = 'database/schema_postgres.sql'
+
+
+def to_pyformat(sql):
+    """Rewrite ``?`` placeholders as psycopg's ``%s`` (escaping any literal ``%``)."""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+
+class PostgresConnection:
+    """A pooled psycopg connection with the sqlite3-style calls the app uses."""
+
+    dialect = 'postgresql'
+
+    def __init__(self, raw, pool):
+        self.raw = raw
+        self.pool = pool
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return self.raw.execute(to_pyformat(sql), parameters)
+        finally:
+            database._notify(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            cursor = self.raw.cursor()
+            cursor.executemany(to_pyformat(sql), seq_of_parameters)
+            return cursor
+        finally:
+            database._notify(sql, time.perf_counter() - started)
+
+    @property
+    def in_transaction(self):
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def transaction(self):
+        """BEGIN ... COMMIT, rolled back if the block raises."""
+        return self.raw.transaction()
+
+    def commit(self):
+        # Connections are in autocommit mode, so this only matters inside a
+        # transaction started outside transaction()
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+class PostgresPool:
+    """Pooled connections to a primary and, optionally, a read replica.
+
+    Statements run ``prepare_threshold`` times on a connection are turned
+    into server-side prepared statements by psycopg.
+    """
+
+    dialect = 'postgresql'
+
+    def __init__(self, url, replica_url=None, size=8, timeout=10.0, prepare_threshold=1):
+        kwargs = {'autocommit': True, 'row_factory': dict_row, 'prepare_threshold': prepare_threshold}
+        self.timeout = timeout
+        self._primary = PsycopgPool(url, min_size=1, max_size=size, timeout=timeout,
+                                    kwargs=kwargs, name='primary', open=True)
+        self._replica = None
+        if replica_url:
+            self._replica = PsycopgPool(replica_url, min_size=1, max_size=size, timeout=timeout,
+                                        kwargs=kwargs, name='replica', open=True)
+        self.has_replica = self._replica is not None
+
+    def acquire(self, readonly=False):
+        pool = self._replica if readonly and self._replica is not None else self._primary
+        return PostgresConnection(pool.getconn(), pool)
+
+    def release(self, conn):
+        """Return a connection to its pool, discarding any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except psycopg.Error:
+            logging.warning("Discarding a PostgreSQL connection that failed to roll back.")
+        conn.pool.putconn(conn.raw)
+
+    def close_all(self):
+        for pool in (self._primary, self._replica):
+            if pool is not None:
+                pool.close()
+
+    def stats(self):
+        stats = {}
+        for prefix, pool in (('', self._primary), ('replica_', self._replica)):
+            if pool is not None:
+                stats.update((prefix + key, value) for key, value in pool.get_stats().items())
+        return stats
+
+
+def init_schema(url, schema_path=SCHEMA_PATH):
+    """Create the schema in an empty database; existing databases are left to ``flask migrate``."""
+    from migrations import Migrator
+
+    with psycopg.connect(url, autocommit=True, row_factory=dict_row) as raw:
+        conn = PostgresConnection(raw, None)
+        if conn.execute("SELECT to_regclass('products') AS found").fetchone()['found'] is not None:
+            print("PostgreSQL schema already exists; run 'flask migrate' to upgrade it.")
+            return
+        with open(schema_path, 'r') as schema_file:
+            raw.execute(schema_file.read())
+        Migrator(conn).stamp()
+    print("PostgreSQL schema created.")
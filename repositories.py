@@ -0,0 +1,1103 @@
+"""Data access for users, products, orders, the cart, dashboard totals, marketplace
+facets, sales rankings and the background job queue.
+
+Views talk to these repositories instead of writing SQL. Statements are
+written once with ``?`` placeholders and run on either backend; the
+PostgreSQL classes only override what differs (full-text search and stock
+locking at checkout). Get a bundle bound to the request's connection with
+``get_repositories()``, or run one on the database executor from an async
+view with ``await run_repos(...)``.
+"""
+import json
+import re
+import time
+
+from database import get_db, run_db, write_transaction
+from geo import EARTH_RADIUS_KM, bounding_box
+
+# Columns rendered by the marketplace product cards
+PRODUCT_CARD_COLUMNS = "products.id, products.name, products.price, products.quantity, products.description, products.image"
+
+# Products at or below this stock are flagged on the farmer dashboard
+LOW_STOCK_THRESHOLD = 5
+
+# Order columns the dashboard aggregates are computed from
+ORDER_STATS_COLUMNS = "product_id, quantity, total_price, status"
+
+# Columns moved from orders to orders_archive
+ORDER_COLUMNS = "id, product_id, customer_id, quantity, total_price, payment_option, status, completed_at"
+
+# Haversine distance in km from the point bound to its (latitude, latitude, longitude) parameters
+DISTANCE_KM = f"""(2 * {EARTH_RADIUS_KM} * asin(sqrt(
+    power(sin(radians(products.latitude - ?) / 2), 2)
+    + cos(radians(?)) * cos(radians(products.latitude)) * power(sin(radians(products.longitude - ?) / 2), 2))))"""
+
+# Upper bounds of the marketplace price facets; prices at or above the last are one open bucket
+PRICE_BUCKETS = (5, 10, 25, 50)
+
+# Products in each precomputed ranking, per category and for the whole catalogue
+RANKING_SIZE = 100
+
+# Seconds after which a sale counts half as much towards the trending ranking
+TRENDING_HALF_LIFE = 3 * 24 * 3600
+
+# Compaction drops trending scores that have decayed below this many units
+TRENDING_MIN_SCORE = 0.01
+
+# The product_rankings column each ranking is ordered by
+RANKINGS = {'trending': 'trending', 'bestselling': 'units'}
+
+# Farm location used for a product created without coordinates of its own
+FARM_LATITUDE = "COALESCE(?, (SELECT latitude FROM users WHERE id = ?))"
+FARM_LONGITUDE = "COALESCE(?, (SELECT longitude FROM users WHERE id = ?))"
+
+
+def search_terms(text):
+    """Split free-text search into the word terms both backends match as prefixes."""
+    return re.findall(r'\w+', text)
+
+
+def price_buckets():
+    """``(label, low, high)`` for each price facet, e.g. ('5-10', 5, 10); the last has no ``high``."""
+    lows = (0,) + PRICE_BUCKETS
+    return [(f'{low}-{high}', low, high) for low, high in zip(lows, PRICE_BUCKETS)] + [(f'{lows[-1]}+', lows[-1], None)]
+
+
+def price_bucket(price):
+    """The label of the price facet ``price`` falls in."""
+    for label, low, high in price_buckets():
+        if high is None or price < high:
+            return label
+
+
+def price_range(label):
+    """``(low, high)`` of a price facet label, or None if it is not one."""
+    for bucket, low, high in price_buckets():
+        if bucket == label:
+            return low, high
+    return None
+
+
+class Repository:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def transaction(self):
+        """A write transaction; SQLite takes its write lock up front."""
+        return write_transaction(self.conn)
+
+    @property
+    def _bundle(self):
+        """The Repositories class of this backend, which names the classes write paths delegate to."""
+        return Repositories
+
+    @property
+    def _stats(self):
+        return self._bundle.stats_class(self.conn)
+
+    @property
+    def _facets(self):
+        return self._bundle.facets_class(self.conn)
+
+    @property
+    def _jobs(self):
+        return self._bundle.jobs_class(self.conn)
+
+    @property
+    def _rankings(self):
+        return self._bundle.rankings_class(self.conn)
+
+
+class UserRepository(Repository):
+    def create(self, name, email, password_hash, role):
+        self.conn.execute("INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)",
+                          (name, email, password_hash, role))
+        self.conn.commit()
+
+    def by_email(self, email):
+        return self.conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+
+    def set_location(self, farmer_id, latitude, longitude):
+        """Move a farm; its products that were at the old location (or had none) move with it."""
+        with self.transaction():
+            self.conn.execute("""
+                UPDATE products SET latitude = ?, longitude = ?, version = version + 1
+                WHERE farmer_id = ? AND ((latitude IS NULL AND longitude IS NULL) OR EXISTS (
+                    SELECT 1 FROM users WHERE users.id = products.farmer_id
+                    AND users.latitude = products.latitude AND users.longitude = products.longitude))
+            """, (latitude, longitude, farmer_id))
+            self.conn.execute("UPDATE users SET latitude = ?, longitude = ? WHERE id = ?", (latitude, longitude, farmer_id))
+
+    def set_password(self, user_id, password_hash):
+        self.conn.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+        self.conn.commit()
+
+
+class ProductRepository(Repository):
+    def get(self, product_id):
+        return self.conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
+
+    def get_many(self, product_ids, columns):
+        """The products with these ids in one query, in id order, with ``id``, ``version`` and
+        ``columns`` (trusted column names, never request input)."""
+        selected = ['id', 'version', *(column for column in columns if column not in ('id', 'version'))]
+        return self.conn.execute(f"""
+            SELECT {', '.join(selected)} FROM products
+            WHERE id IN ({', '.join('?' * len(product_ids))})
+            ORDER BY id
+        """, list(product_ids)).fetchall()
+
+    def create(self, name, price, quantity, description, contact, image, farmer_id, category,
+               latitude=None, longitude=None):
+        """Insert a product, located at the farm unless coordinates are given; returns its id."""
+        with self.transaction():
+            product = self.conn.execute(f'''INSERT INTO products (name, price, quantity, description, contact, image, farmer_id, category,
+                                                                     latitude, longitude)
+                                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, {FARM_LATITUDE}, {FARM_LONGITUDE})
+                                               RETURNING id, category, price, quantity''',
+                                           (name, price, quantity, description, contact, image, farmer_id, category,
+                                            latitude, farmer_id, longitude, farmer_id)).fetchall()[0]
+            self._stats.product_added(product['id'])
+            self._facets.products_changed([product])
+        return product['id']
+
+    def create_many(self, farmer_id, products):
+        """Insert many products in one transaction; each is a (name, price, quantity, category,
+        description, contact, image, latitude, longitude) tuple."""
+        with self.transaction():
+            last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) AS id FROM products").fetchone()['id']
+            self.conn.executemany(f'''INSERT INTO products (name, price, quantity, category, description, contact, image,
+                                                            latitude, longitude, farmer_id)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, {FARM_LATITUDE}, {FARM_LONGITUDE}, ?)''',
+                                  [(*product[:7], product[7], farmer_id, product[8], farmer_id, farmer_id)
+                                   for product in products])
+            self._stats.products_added(farmer_id, last_id)
+            self._facets.products_changed([{'category': product[3], 'price': product[1], 'quantity': product[2]}
+                                           for product in products])
+
+    def delete(self, product_id, farmer_id):
+        with self.transaction():
+            deleted = self.conn.execute("""
+                DELETE FROM products WHERE id = ? AND farmer_id = ?
+                RETURNING id, farmer_id, quantity, category, price
+            """, (product_id, farmer_id)).fetchall()
+            for product in deleted:
+                self._stats.product_removed(product)
+            self._facets.products_changed(deleted, sign=-1)
+            self._rankings.products_removed(deleted)
+
+    def clear_image(self, image):
+        """Drop an upload whose variants could not be made; returns the ids of the products that used it."""
+        with self.transaction():
+            return [row['id'] for row in self.conn.execute("""
+                UPDATE products SET image = NULL, version = version + 1 WHERE image = ? RETURNING id
+            """, (image,)).fetchall()]
+
+    def for_farmer(self, farmer_id, after, limit):
+        """A page of the farmer's products with their sales totals."""
+        return self.conn.execute("""
+            SELECT products.id, products.name, products.price, products.quantity, products.description,
+                   COALESCE(product_stats.units_sold, 0) AS units_sold, COALESCE(product_stats.revenue, 0) AS revenue,
+                   products.quantity <= ? AS low_stock
+            FROM products
+            LEFT JOIN product_stats ON product_stats.product_id = products.id
+            WHERE products.farmer_id = ? AND products.id > ?
+            ORDER BY products.id LIMIT ?
+        """, (LOW_STOCK_THRESHOLD, farmer_id, after or 0, limit)).fetchall()
+
+    def export_page(self, farmer_id, after, limit):
+        return self.conn.execute("""
+            SELECT id, name, price, quantity, category, description, contact, image, latitude, longitude
+            FROM products
+            WHERE farmer_id = ? AND id > ?
+            ORDER BY id LIMIT ?
+        """, (farmer_id, after, limit)).fetchall()
+
+    @staticmethod
+    def _filters(category, price, in_stock):
+        """Conditions and params for the marketplace facets: a category, a ``(low, high)`` price
+        range whose ``high`` may be None, and in-stock only."""
+        conditions = []
+        params = []
+        if category:
+            conditions.append("products.category = ?")
+            params.append(category)
+        if price:
+            conditions.append("products.price >= ?")
+            params.append(price[0])
+            if price[1] is not None:
+                conditions.append("products.price < ?")
+                params.append(price[1])
+        if in_stock:
+            conditions.append("products.quantity > 0")
+        return conditions, params
+
+    def catalogue_page(self, category, after, limit, price=None, in_stock=False):
+        """Products in id order, optionally filtered by facets, after the ``after`` id."""
+        conditions, params = self._filters(category, price, in_stock)
+        if after is not None:
+            conditions.append("products.id > ?")
+            params.append(after)
+        query = f"SELECT {PRODUCT_CARD_COLUMNS} FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY products.id LIMIT ?"
+        params.append(limit)
+        return self.conn.execute(query, params).fetchall()
+
+    def search_page(self, terms, category, after, limit, price=None, in_stock=False):
+        """Ranked search results with a ``score`` column, lowest (best) first.
+
+        Pages are keyed on ``(score, id)`` so ranking stays stable across pages.
+        """
+        conditions, params = self._filters(category, price, in_stock)
+        # bm25 weights name above category and description
+        query = f"""
+            SELECT * FROM (
+                SELECT {PRODUCT_CARD_COLUMNS}, bm25(products_fts, 10.0, 1.0, 2.0) AS score
+                FROM products_fts
+                JOIN products ON products.id = products_fts.rowid
+                WHERE {' AND '.join(['products_fts MATCH ?', *conditions])}
+            )
+        """
+        return self._ranked(query, [self.match_query(terms), *params], after, limit)
+
+    def ranked_page(self, ranking, category, after, limit, price=None, in_stock=False):
+        """A page of a precomputed ranking ('trending' or 'bestselling'), best first.
+
+        Only the at most RANKING_SIZE products of the ranking are read, so
+        this costs the same whatever the number of orders. The negated
+        ranking score is the ``score`` column, so pages are keyed on
+        ``(score, id)`` like search results.
+        """
+        conditions, params = self._filters(None, price, in_stock)
+        query = f"""
+            SELECT * FROM (
+                SELECT {PRODUCT_CARD_COLUMNS}, -top_products.score AS score
+                FROM top_products
+                JOIN products ON products.id = top_products.product_id
+                WHERE {' AND '.join(['top_products.ranking = ? AND top_products.category = ?', *conditions])}
+            ) AS ranked
+        """
+        return self._ranked(query, [ranking, category or '', *params], after, limit)
+
+    # Spatial index and full-text filter used by nearby_page
+    located = "products_location JOIN products ON products.id = products_location.id"
+    in_box = ("products_location.min_lat <= ? AND products_location.max_lat >= ? "
+              "AND products_location.min_lon <= ? AND products_location.max_lon >= ?")
+    matches = "products.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+
+    @staticmethod
+    def box_params(min_lat, max_lat, min_lon, max_lon):
+        return max_lat, min_lat, max_lon, min_lon
+
+    def nearby_page(self, point, radius_km, terms, category, after, limit, price=None, in_stock=False):
+        """Products within ``radius_km`` of ``point`` (latitude, longitude), nearest first.
+
+        The bounding box is answered from the spatial index, and only rows
+        inside it get an exact distance. The distance in km is the ``score``
+        column, so pages are keyed on ``(score, id)`` like search results.
+        """
+        latitude, longitude = point
+        distance_params = [latitude, latitude, longitude]
+        conditions = [self.in_box, f"{DISTANCE_KM} <= ?"]
+        params = [*distance_params, *self.box_params(*bounding_box(latitude, longitude, radius_km)),
+                  *distance_params, radius_km]
+        if terms:
+            conditions.append(self.matches)
+            params.append(self.match_query(terms))
+        filters, filter_params = self._filters(category, price, in_stock)
+        conditions.extend(filters)
+        params.extend(filter_params)
+        query = f"""
+            SELECT * FROM (
+                SELECT {PRODUCT_CARD_COLUMNS}, {DISTANCE_KM} AS score
+                FROM {self.located}
+                WHERE {' AND '.join(conditions)}
+            ) AS nearby
+        """
+        return self._ranked(query, params, after, limit)
+
+    @staticmethod
+    def match_query(terms):
+        """Quote each term and match it as a prefix, e.g. ['ban', 'yel'] -> '"ban"* "yel"*'."""
+        return ' '.join('"{}"*'.format(term) for term in terms)
+
+    def _ranked(self, query, params, after, limit):
+        if after:
+            query += " WHERE score > ? OR (score = ? AND id > ?)"
+            params.extend((after[0], after[0], after[1]))
+        query += " ORDER BY score, id LIMIT ?"
+        params.append(limit)
+        return self.conn.execute(query, params).fetchall()
+
+
+class OrderRepository(Repository):
+    def for_customer(self, customer_id, after, limit):
+        """A page of the customer's order history; see ``_history``."""
+        return self._history("""
+            SELECT {table}.id, products.name AS product_name, {table}.quantity, {table}.payment_option,
+                   {table}.status, {archived} AS archived
+            FROM {table}
+            JOIN products ON {table}.product_id = products.id
+            WHERE {table}.customer_id = ?
+        """, (customer_id,), after, limit)
+
+    def for_farmer(self, farmer_id, after, limit):
+        """A page of the history of orders for the farmer's products; see ``_history``."""
+        return self._history("""
+            SELECT {table}.id, {table}.quantity, {table}.status, products.name AS product_name, {archived} AS archived
+            FROM {table}
+            JOIN products ON {table}.product_id = products.id
+            WHERE products.farmer_id = ?
+        """, (farmer_id,), after, limit)
+
+    def _history(self, query, params, after, limit):
+        """Page through ``orders`` newest first, then on into ``orders_archive``.
+
+        ``query`` is run once per table, formatted with ``{table}`` and an
+        ``{archived}`` flag; the archive is only read once a page reaches past
+        the current orders. ``after`` is ``(archived, id)`` from
+        ``parse_history_cursor``.
+        """
+        rows = []
+        for table, archived in (('orders', 0), ('orders_archive', 1)):
+            if after and after[0] and not archived:
+                continue
+            sql = query.format(table=table, archived=archived)
+            args = list(params)
+            if after and after[0] == archived:
+                sql += f" AND {table}.id < ?"
+                args.append(after[1])
+            sql += f" ORDER BY {table}.id DESC LIMIT ?"
+            args.append(limit - len(rows))
+            rows.extend(self.conn.execute(sql, args).fetchall())
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def with_farmers(self, order_ids):
+        """Orders with their product and the farmer selling it, for notifications."""
+        if not order_ids:
+            return []
+        return self.conn.execute(f"""
+            SELECT orders.id, orders.quantity, orders.status, products.name AS product_name,
+                   users.name AS farmer_name, users.email AS farmer_email
+            FROM orders
+            JOIN products ON orders.product_id = products.id
+            JOIN users ON products.farmer_id = users.id
+            WHERE orders.id IN ({', '.join('?' * len(order_ids))})
+            ORDER BY orders.id
+        """, list(order_ids)).fetchall()
+
+    def export_page(self, farmer_id, after, limit):
+        """A page of the farmer's full order history, archive included, in id order."""
+        # Spelled out per table rather than read from order_history, whose halves
+        # cannot be searched by the farmer's products through a join
+        page = """
+            SELECT {table}.id, {table}.product_id, products.name AS product_name, {table}.quantity,
+                   {table}.total_price, {table}.payment_option, {table}.status
+            FROM {table}
+            JOIN products ON {table}.product_id = products.id
+            WHERE products.farmer_id = ? AND {table}.id > ?
+        """
+        return self.conn.execute(f"""
+            SELECT * FROM ({page.format(table='orders')} UNION ALL {page.format(table='orders_archive')}) AS history
+            ORDER BY id LIMIT ?
+        """, (farmer_id, after, farmer_id, after, limit)).fetchall()
+
+    def archive(self, completed_before, limit):
+        """Move up to ``limit`` orders completed before ``completed_before`` (a timestamp) to
+        ``orders_archive`` in one transaction; returns how many moved.
+
+        Archived orders still count in the dashboard totals.
+        """
+        with self.transaction():
+            moved = self.conn.execute(f"""
+                DELETE FROM orders WHERE id IN (
+                    SELECT id FROM orders WHERE status = 'Completed' AND completed_at < ?
+                    ORDER BY completed_at LIMIT ?)
+                RETURNING {ORDER_COLUMNS}
+            """, (completed_before, limit)).fetchall()
+            self.conn.executemany(f"INSERT INTO orders_archive ({ORDER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [tuple(order[column] for column in ORDER_COLUMNS.split(', ')) for order in moved])
+        return len(moved)
+
+    def delete(self, order_id, customer_id):
+        with self.transaction():
+            deleted = self.conn.execute(f"DELETE FROM orders WHERE id = ? AND customer_id = ? RETURNING {ORDER_STATS_COLUMNS}",
+                                        (order_id, customer_id)).fetchall()
+            self._stats.orders_changed(deleted, sign=-1)
+
+    def confirm_delivery(self, order_id, customer_id):
+        """Mark a Pending order Completed; returns False if there was none to confirm."""
+        with self.transaction():
+            confirmed = self.conn.execute(f"""
+                UPDATE orders
+                SET status = 'Completed', completed_at = ?
+                WHERE id = ? AND customer_id = ? AND status = 'Pending'
+                RETURNING id, {ORDER_STATS_COLUMNS}
+            """, (time.time(), order_id, customer_id)).fetchall()
+            self._stats.status_changed(confirmed, 'Pending')
+            if confirmed:
+                self._jobs.enqueue('delivery.confirmed', {'order_ids': [order['id'] for order in confirmed]})
+        return bool(confirmed)
+
+    def place(self, customer_id, payment_option):
+        """Reserve stock and create orders for every cart line, all or nothing.
+
+        Returns ``(placed, out_of_stock)``: the ids of the products ordered and
+        the names of products that could not be reserved. Nothing is written
+        unless every line can be reserved.
+        """
+        # Take the write lock up front so the stock check and decrement cannot
+        # interleave with another checkout.
+        with self.transaction():
+            lines = self.conn.execute("""
+                SELECT products.id, products.name
+                FROM cart
+                JOIN products ON cart.product_id = products.id
+                WHERE cart.customer_id = ?
+                GROUP BY products.id
+            """, (customer_id,)).fetchall()
+            if not lines:
+                self.conn.rollback()
+                return 0, []
+
+            reserved = {row['id']: row for row in self.conn.execute("""
+                UPDATE products
+                SET quantity = quantity - (SELECT SUM(cart.quantity) FROM cart
+                                           WHERE cart.customer_id = ? AND cart.product_id = products.id),
+                    version = version + 1
+                WHERE id IN (SELECT product_id FROM cart WHERE customer_id = ?)
+                  AND quantity >= (SELECT SUM(cart.quantity) FROM cart
+                                   WHERE cart.customer_id = ? AND cart.product_id = products.id)
+                RETURNING id, quantity, category, price
+            """, (customer_id, customer_id, customer_id)).fetchall()}
+            out_of_stock = [line['name'] for line in lines if line['id'] not in reserved]
+            if out_of_stock:
+                self.conn.rollback()
+                return 0, out_of_stock
+
+            ordered = self._create_orders(customer_id, payment_option)
+            changes = [(reserved[order['product_id']], reserved[order['product_id']]['quantity'] + order['quantity'])
+                       for order in ordered]
+            self._stats.stock_changed([(product['id'], old, product['quantity']) for product, old in changes])
+            self._facets.stock_changed(changes)
+        return [line['id'] for line in lines], []
+
+    def _create_orders(self, customer_id, payment_option):
+        """Turn the cart into orders, one per product, and queue an ``orders.placed`` job;
+        returns the new orders' ids and stats columns."""
+        ordered = self.conn.execute(f"""
+            INSERT INTO orders (product_id, customer_id, quantity, total_price, payment_option)
+            SELECT cart.product_id, cart.customer_id, SUM(cart.quantity), SUM(cart.quantity) * products.price, ?
+            FROM cart
+            JOIN products ON cart.product_id = products.id
+            WHERE cart.customer_id = ?
+            GROUP BY cart.product_id, cart.customer_id, products.price
+            RETURNING id, {ORDER_STATS_COLUMNS}
+        """, (payment_option, customer_id)).fetchall()
+        self.conn.execute("DELETE FROM cart WHERE customer_id = ?", (customer_id,))
+        self._stats.orders_changed(ordered)
+        self._rankings.orders_placed(ordered)
+        self._jobs.enqueue('orders.placed', {'order_ids': [order['id'] for order in ordered]})
+        return ordered
+
+
+class CartRepository(Repository):
+    def items(self, customer_id):
+        return self.conn.execute("""
+            SELECT cart.id AS cart_id, cart.product_id, products.name AS product_name, cart.quantity, products.price,
+                   (cart.quantity * products.price) AS total_price
+            FROM cart
+            JOIN products ON cart.product_id = products.id
+            WHERE cart.customer_id = ?
+        """, (customer_id,)).fetchall()
+
+    def add(self, customer_id, product_id, quantity):
+        """Add ``quantity`` of a product in one upsert; returns the new line quantity."""
+        new_quantity = self.conn.execute("""
+            INSERT INTO cart (customer_id, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT(customer_id, product_id) DO UPDATE SET quantity = cart.quantity + excluded.quantity
+            RETURNING quantity
+        """, (customer_id, product_id, quantity)).fetchall()[0]['quantity']
+        self.conn.commit()
+        return new_quantity
+
+    def update_many(self, customer_id, quantities):
+        """Set many line quantities at once ({product_id: quantity}); 0 removes the line."""
+        with self.transaction():
+            self.conn.executemany("""
+                INSERT INTO cart (customer_id, product_id, quantity)
+                SELECT ?, id, ? FROM products WHERE id = ?
+                ON CONFLICT(customer_id, product_id) DO UPDATE SET quantity = excluded.quantity
+            """, [(customer_id, quantity, product_id) for product_id, quantity in quantities.items() if quantity > 0])
+            self.conn.executemany("DELETE FROM cart WHERE customer_id = ? AND product_id = ?",
+                                  [(customer_id, product_id) for product_id, quantity in quantities.items() if quantity <= 0])
+
+    def remove(self, cart_id, customer_id):
+        self.conn.execute("DELETE FROM cart WHERE id = ? AND customer_id = ?", (cart_id, customer_id))
+        self.conn.commit()
+
+
+class StatsRepository(Repository):
+    """Per-product and per-farmer dashboard totals.
+
+    The product and order write paths update these inside their own
+    transactions, so totals change together with the rows they count.
+    Orders of deleted products stop being counted; archived orders still do.
+    """
+
+    def for_farmer(self, farmer_id):
+        return self.conn.execute("SELECT * FROM farmer_stats WHERE farmer_id = ?", (farmer_id,)).fetchone()
+
+    def product_added(self, product_id):
+        self.conn.execute("INSERT INTO product_stats (product_id, farmer_id) SELECT id, farmer_id FROM products WHERE id = ?",
+                          (product_id,))
+        self.conn.execute("""
+            INSERT INTO farmer_stats (farmer_id, products, low_stock_products)
+            SELECT farmer_id, 1, CASE WHEN quantity <= ? THEN 1 ELSE 0 END FROM products WHERE id = ?
+            ON CONFLICT(farmer_id) DO UPDATE SET products = farmer_stats.products + 1,
+                low_stock_products = farmer_stats.low_stock_products + excluded.low_stock_products
+        """, (LOW_STOCK_THRESHOLD, product_id))
+
+    def products_added(self, farmer_id, after_id):
+        """Count the farmer's products above ``after_id`` that are not counted yet."""
+        added = self.conn.execute("""
+            SELECT id, quantity FROM products
+            WHERE farmer_id = ? AND id > ?
+              AND NOT EXISTS (SELECT 1 FROM product_stats WHERE product_id = products.id)
+        """, (farmer_id, after_id)).fetchall()
+        if not added:
+            return
+        self.conn.executemany("INSERT INTO product_stats (product_id, farmer_id) VALUES (?, ?)",
+                              [(row['id'], farmer_id) for row in added])
+        self.conn.execute("""
+            INSERT INTO farmer_stats (farmer_id, products, low_stock_products) VALUES (?, ?, ?)
+            ON CONFLICT(farmer_id) DO UPDATE SET products = farmer_stats.products + excluded.products,
+                low_stock_products = farmer_stats.low_stock_products + excluded.low_stock_products
+        """, (farmer_id, len(added), sum(row['quantity'] <= LOW_STOCK_THRESHOLD for row in added)))
+
+    def product_removed(self, product):
+        """Drop a deleted product (a row with id, farmer_id and quantity) from the totals."""
+        removed = self.conn.execute("""
+            DELETE FROM product_stats WHERE product_id = ?
+            RETURNING units_sold, revenue, pending_orders, completed_orders
+        """, (product['id'],)).fetchall()
+        totals = removed[0] if removed else {'units_sold': 0, 'revenue': 0, 'pending_orders': 0, 'completed_orders': 0}
+        self.conn.execute("""
+            UPDATE farmer_stats
+            SET products = products - 1, low_stock_products = low_stock_products - ?,
+                units_sold = units_sold - ?, revenue = revenue - ?,
+                pending_orders = pending_orders - ?, completed_orders = completed_orders - ?
+            WHERE farmer_id = ?
+        """, (int(product['quantity'] <= LOW_STOCK_THRESHOLD), totals['units_sold'], totals['revenue'],
+              totals['pending_orders'], totals['completed_orders'], product['farmer_id']))
+
+    def orders_changed(self, orders, sign=1):
+        """Count ``orders`` (rows of ORDER_STATS_COLUMNS) in, or out with ``sign=-1``."""
+        deltas = [(sign * order['quantity'], sign * order['total_price'], sign * (order['status'] == 'Pending'),
+                   sign * (order['status'] == 'Completed'), order['product_id']) for order in orders]
+        if not deltas:
+            return
+        self.conn.executemany("""
+            UPDATE product_stats
+            SET units_sold = units_sold + ?, revenue = revenue + ?,
+                pending_orders = pending_orders + ?, completed_orders = completed_orders + ?
+            WHERE product_id = ?
+        """, deltas)
+        self.conn.executemany("""
+            UPDATE farmer_stats
+            SET units_sold = units_sold + ?, revenue = revenue + ?,
+                pending_orders = pending_orders + ?, completed_orders = completed_orders + ?
+            WHERE farmer_id = (SELECT farmer_id FROM product_stats WHERE product_id = ?)
+        """, deltas)
+
+    def status_changed(self, orders, old_status):
+        """Move ``orders``, now in their new status, out of ``old_status``."""
+        self.orders_changed([dict(order, status=old_status) for order in orders], sign=-1)
+        self.orders_changed(orders)
+
+    def stock_changed(self, changes):
+        """Update low-stock counts for ``(product_id, old_quantity, new_quantity)`` changes."""
+        deltas = [((new <= LOW_STOCK_THRESHOLD) - (old <= LOW_STOCK_THRESHOLD), product_id)
+                  for product_id, old, new in changes
+                  if (new <= LOW_STOCK_THRESHOLD) != (old <= LOW_STOCK_THRESHOLD)]
+        if deltas:
+            self.conn.executemany("""
+                UPDATE farmer_stats SET low_stock_products = low_stock_products + ?
+                WHERE farmer_id = (SELECT farmer_id FROM product_stats WHERE product_id = ?)
+            """, deltas)
+
+    def rebuild(self, batch_size=1000, history='order_history'):
+        """Recompute every total from products and the full order history.
+
+        Products are recomputed ``batch_size`` at a time so the write lock is
+        only held briefly; writes in between keep the batches already done
+        current. Migrations that run before the archive exists pass
+        ``history='orders'``. Returns the number of products counted.
+        """
+        last_id = 0
+        counted = 0
+        while True:
+            ids = self.conn.execute("SELECT id FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                                    (last_id, batch_size)).fetchall()
+            if not ids:
+                break
+            previous_id, last_id = last_id, ids[-1]['id']
+            with self.transaction():
+                # Also clears rows left behind by deleted products in this id range
+                self.conn.execute("DELETE FROM product_stats WHERE product_id > ? AND product_id <= ?",
+                                  (previous_id, last_id))
+                self.conn.execute(f"""
+                    INSERT INTO product_stats (product_id, farmer_id, units_sold, revenue, pending_orders, completed_orders)
+                    SELECT products.id, products.farmer_id,
+                           COALESCE(SUM(orders.quantity), 0), COALESCE(SUM(orders.total_price), 0),
+                           COUNT(CASE WHEN orders.status = 'Pending' THEN 1 END),
+                           COUNT(CASE WHEN orders.status = 'Completed' THEN 1 END)
+                    FROM products
+                    LEFT JOIN (SELECT {ORDER_STATS_COLUMNS} FROM {history}
+                               WHERE product_id > ? AND product_id <= ?) AS orders ON orders.product_id = products.id
+                    WHERE products.id > ? AND products.id <= ?
+                    GROUP BY products.id, products.farmer_id
+                """, (previous_id, last_id, previous_id, last_id))
+            counted += len(ids)
+        with self.transaction():
+            self.conn.execute("DELETE FROM product_stats WHERE product_id > ?", (last_id,))
+            self.conn.execute("DELETE FROM farmer_stats")
+            self.conn.execute("""
+                INSERT INTO farmer_stats (farmer_id, products, low_stock_products, units_sold, revenue,
+                                          pending_orders, completed_orders)
+                SELECT products.farmer_id, COUNT(*), SUM(CASE WHEN products.quantity <= ? THEN 1 ELSE 0 END),
+                       SUM(product_stats.units_sold), SUM(product_stats.revenue),
+                       SUM(product_stats.pending_orders), SUM(product_stats.completed_orders)
+                FROM products
+                JOIN product_stats ON product_stats.product_id = products.id
+                WHERE products.farmer_id IS NOT NULL
+                GROUP BY products.farmer_id
+            """, (LOW_STOCK_THRESHOLD,))
+        return counted
+
+
+class FacetRepository(Repository):
+    """Marketplace facet counts: products and in-stock products per category, per price bucket
+    and in total (the ``'all'`` facet).
+
+    Like the dashboard totals, the product and checkout write paths adjust
+    these inside their own transactions. Each adjustment adds to the stored
+    counts rather than overwriting them, and the rows are updated in key
+    order, so concurrent writers neither lose updates nor deadlock.
+    """
+
+    def counts(self):
+        """``{facet: {value: (products, in_stock)}}`` for the values that have products."""
+        facets = {}
+        for row in self.conn.execute("SELECT facet, value, products, in_stock FROM catalogue_facets WHERE products > 0"):
+            facets.setdefault(row['facet'], {})[row['value']] = (row['products'], row['in_stock'])
+        return facets
+
+    @staticmethod
+    def _keys(product):
+        keys = [('all', ''), ('price', price_bucket(product['price']))]
+        if product['category']:
+            keys.append(('category', product['category']))
+        return keys
+
+    def _add(self, deltas):
+        self.conn.executemany("""
+            INSERT INTO catalogue_facets (facet, value, products, in_stock) VALUES (?, ?, ?, ?)
+            ON CONFLICT(facet, value) DO UPDATE SET products = catalogue_facets.products + excluded.products,
+                in_stock = catalogue_facets.in_stock + excluded.in_stock
+        """, [(*key, *deltas[key]) for key in sorted(deltas) if deltas[key] != (0, 0)])
+
+    def products_changed(self, products, sign=1):
+        """Count ``products`` (rows with category, price and quantity) in, or out with ``sign=-1``."""
+        deltas = {}
+        for product in products:
+            for key in self._keys(product):
+                count, in_stock = deltas.get(key, (0, 0))
+                deltas[key] = (count + sign, in_stock + sign * (product['quantity'] > 0))
+        self._add(deltas)
+
+    def stock_changed(self, changes):
+        """Update in-stock counts for ``(product, old_quantity)`` changes; ``product`` has the new quantity."""
+        deltas = {}
+        for product, old in changes:
+            change = (product['quantity'] > 0) - (old > 0)
+            if change:
+                for key in self._keys(product):
+                    deltas[key] = (0, deltas.get(key, (0, 0))[1] + change)
+        self._add(deltas)
+
+    def rebuild(self):
+        """Recompute every count from products in one transaction; returns the number of facet values."""
+        bucket = "CASE {} ELSE '{}' END".format(
+            ' '.join(f"WHEN price < {high} THEN '{label}'" for label, _, high in price_buckets()[:-1]),
+            price_buckets()[-1][0])
+        with self.transaction():
+            self.conn.execute("DELETE FROM catalogue_facets")
+            for facet, value in (('all', "''"), ('price', bucket), ('category', 'category')):
+                self.conn.execute(f"""
+                    INSERT INTO catalogue_facets (facet, value, products, in_stock)
+                    SELECT '{facet}', value, COUNT(*), COUNT(CASE WHEN quantity > 0 THEN 1 END)
+                    FROM (SELECT {value} AS value, quantity FROM products
+                          {"WHERE category IS NOT NULL AND category <> ''" if facet == 'category' else ''}) AS facet_values
+                    GROUP BY value
+                """)
+            return self.conn.execute("SELECT COUNT(*) AS count FROM catalogue_facets").fetchone()['count']
+
+
+class RankingRepository(Repository):
+    """Trending and best-selling products, ranked per category and for the whole catalogue ('').
+
+    Checkout adds each product's units to its all-time ``units`` and to its
+    ``trending`` score, and offers it to the RANKING_SIZE lists in
+    ``top_products`` of its category and of the catalogue, so reading a
+    ranking never touches orders. Trending scores decay with a half-life of
+    TRENDING_HALF_LIFE by forward decay: a sale at time t adds
+    ``units * 2 ** ((t - epoch) / TRENDING_HALF_LIFE)``, which keeps every
+    stored score in the same units and the rankings in order without
+    rewriting old scores. ``compact()`` applies the decay by moving the
+    epoch up to now. Rankings count units ordered, so deleted orders stay
+    counted.
+    """
+
+    # Keeps compaction from moving the epoch while a checkout adds scores; SQLite serializes the writers instead
+    epoch_lock = ""
+    # Has checkouts write rows in key order so they cannot deadlock; SQLite serializes the writers instead
+    ordered_writes = False
+
+    def _epoch(self):
+        row = self.conn.execute(f"SELECT epoch FROM ranking_epoch WHERE id = 1 {self.epoch_lock}").fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO ranking_epoch (id, epoch) VALUES (1, ?) ON CONFLICT(id) DO NOTHING",
+                              (time.time(),))
+            row = self.conn.execute(f"SELECT epoch FROM ranking_epoch WHERE id = 1 {self.epoch_lock}").fetchone()
+        return row['epoch']
+
+    def orders_placed(self, orders, now=None):
+        """Count newly placed ``orders`` (rows with product_id and quantity).
+
+        A fixed number of statements whatever the size of the order: one
+        upsert into product_rankings, one upsert into top_products per
+        ranking, and one trim of each list the products belong to.
+        """
+        weight = 2 ** (((now or time.time()) - self._epoch()) / TRENDING_HALF_LIFE)
+        units = {}
+        for order in orders:
+            units[order['product_id']] = units.get(order['product_id'], 0) + order['quantity']
+        if not units:
+            return
+        product_ids = sorted(units)
+        values = ', '.join(['(CAST(? AS INTEGER), CAST(? AS INTEGER))'] * len(product_ids))
+        ranked = self.conn.execute(f"""
+            WITH ordered (product_id, units) AS (VALUES {values})
+            INSERT INTO product_rankings (product_id, category, trending, units)
+            SELECT products.id, products.category, ordered.units * ?, ordered.units
+            FROM ordered, products WHERE products.id = ordered.product_id
+            {'ORDER BY 1' if self.ordered_writes else ''}
+            ON CONFLICT(product_id) DO UPDATE SET trending = product_rankings.trending + excluded.trending,
+                units = product_rankings.units + excluded.units
+            RETURNING category
+        """, (*(value for product_id in product_ids for value in (product_id, units[product_id])), weight)).fetchall()
+        placeholders = ', '.join('?' * len(product_ids))
+        for ranking, column in RANKINGS.items():
+            # Scores only go up, so a product joins or moves up its lists; the trims below drop the overflow
+            self.conn.execute(f"""
+                INSERT INTO top_products (ranking, category, product_id, score)
+                SELECT ?, '', product_id, {column} FROM product_rankings WHERE product_id IN ({placeholders})
+                UNION ALL
+                SELECT ?, category, product_id, {column} FROM product_rankings
+                WHERE product_id IN ({placeholders}) AND category <> ''
+                {'ORDER BY 2, 3' if self.ordered_writes else ''}
+                ON CONFLICT(ranking, category, product_id) DO UPDATE SET score = excluded.score
+            """, (ranking, *product_ids, ranking, *product_ids))
+        categories = sorted({''} | {row['category'] for row in ranked if row['category']})
+        for ranking in RANKINGS:
+            for category in categories:
+                self._trim(ranking, category, len(product_ids))
+
+    @staticmethod
+    def _lists(category):
+        return ('', category) if category else ('',)
+
+    def _trim(self, ranking, category, added):
+        """Cut one list that grew by at most ``added`` products back to its RANKING_SIZE best."""
+        self.conn.execute("""
+            DELETE FROM top_products WHERE ranking = ? AND category = ? AND product_id IN (
+                SELECT product_id FROM top_products WHERE ranking = ? AND category = ?
+                ORDER BY score DESC, product_id LIMIT ? OFFSET ?)
+        """, (ranking, category, ranking, category, added, RANKING_SIZE))
+
+    def _reload(self, ranking, category):
+        """Refill one list from product_rankings."""
+        column = RANKINGS[ranking]
+        self.conn.execute("DELETE FROM top_products WHERE ranking = ? AND category = ?", (ranking, category))
+        self.conn.execute(f"""
+            INSERT INTO top_products (ranking, category, product_id, score)
+            SELECT ?, ?, product_id, {column} FROM product_rankings
+            WHERE {column} > 0 {'AND category = ?' if category else ''}
+            ORDER BY {column} DESC, product_id LIMIT ?
+        """, (ranking, category, *((category,) if category else ()), RANKING_SIZE))
+
+    def products_removed(self, products):
+        """Drop deleted ``products`` (rows with id and category) and refill the lists they were in."""
+        lists = set()
+        for product in products:
+            self.conn.execute("DELETE FROM product_rankings WHERE product_id = ?", (product['id'],))
+            for ranking in RANKINGS:
+                for category in self._lists(product['category']):
+                    if self.conn.execute("DELETE FROM top_products WHERE ranking = ? AND category = ? AND product_id = ?",
+                                         (ranking, category, product['id'])).rowcount:
+                        lists.add((ranking, category))
+        for ranking, category in sorted(lists):
+            self._reload(ranking, category)
+
+    def compact(self, now=None, min_score=TRENDING_MIN_SCORE):
+        """Apply the decay since the last compaction to the trending scores; returns the number of
+        products still trending.
+
+        Only products with a trending score are rewritten, and scores that
+        decayed below ``min_score`` units drop out. Decay keeps the order,
+        so the lists only lose the products that dropped out.
+        """
+        now = now or time.time()
+        with self.transaction():
+            factor = 2 ** ((self._epoch() - now) / TRENDING_HALF_LIFE)
+            # Move the epoch first: on PostgreSQL this waits for checkouts that read the old one
+            self.conn.execute("UPDATE ranking_epoch SET epoch = ? WHERE id = 1", (now,))
+            self.conn.execute("""
+                UPDATE product_rankings SET trending = CASE WHEN trending * ? >= ? THEN trending * ? ELSE 0 END
+                WHERE trending > 0
+            """, (factor, min_score, factor))
+            self.conn.execute("UPDATE top_products SET score = score * ? WHERE ranking = 'trending'", (factor,))
+            self.conn.execute("DELETE FROM top_products WHERE ranking = 'trending' AND score < ?", (min_score,))
+            return self.conn.execute("SELECT COUNT(*) AS count FROM product_rankings WHERE trending > 0").fetchone()['count']
+
+    def rebuild(self, history='order_history'):
+        """Recount all-time units from the order history and refill every list in one transaction.
+
+        Orders do not record when they were placed, so trending scores are
+        kept as they are. Returns the number of products ranked.
+        """
+        with self.transaction():
+            self.conn.execute("DELETE FROM product_rankings WHERE product_id NOT IN (SELECT id FROM products)")
+            self.conn.execute("UPDATE product_rankings SET units = 0")
+            self.conn.execute(f"""
+                INSERT INTO product_rankings (product_id, category, units)
+                SELECT products.id, products.category, SUM(history.quantity)
+                FROM {history} AS history JOIN products ON products.id = history.product_id
+                GROUP BY products.id, products.category
+                ON CONFLICT(product_id) DO UPDATE SET units = excluded.units, category = excluded.category
+            """)
+            self.conn.execute("DELETE FROM product_rankings WHERE units = 0 AND trending = 0")
+            self.conn.execute("DELETE FROM top_products")
+            categories = [row['category'] for row in self.conn.execute(
+                "SELECT DISTINCT category FROM product_rankings WHERE category IS NOT NULL AND category <> ''")]
+            for ranking in RANKINGS:
+                for category in ['', *categories]:
+                    self._reload(ranking, category)
+            return self.conn.execute("SELECT COUNT(*) AS count FROM product_rankings").fetchone()['count']
+
+
+class JobRepository(Repository):
+    """The durable job queue run by ``flask worker`` (see jobs.py).
+
+    A leased job's ``run_at`` is moved to the end of its lease, so a job
+    whose worker died becomes due again by itself. ``attempts`` doubles as
+    the lease token: a worker can only finish or reschedule the attempt it
+    leased.
+    """
+
+    # Lets concurrent workers lease different rows; SQLite serializes the writers instead
+    skip_locked = ""
+
+    def enqueue(self, kind, payload, delay=0):
+        """Queue a job; it is committed with the caller's transaction."""
+        now = time.time()
+        self.conn.execute("INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+                          (kind, json.dumps(payload), now + delay, now))
+
+    def lease(self, limit, visibility_timeout):
+        """Take up to ``limit`` due jobs, oldest first, for ``visibility_timeout`` seconds."""
+        now = time.time()
+        with self.transaction():
+            return self.conn.execute(f"""
+                UPDATE jobs SET attempts = attempts + 1, run_at = ?
+                WHERE id IN (SELECT id FROM jobs WHERE failed_at IS NULL AND run_at <= ?
+                             ORDER BY run_at, id LIMIT ? {self.skip_locked})
+                RETURNING id, kind, payload, attempts, created_at
+            """, (now + visibility_timeout, now, limit)).fetchall()
+
+    def complete(self, jobs):
+        """Delete finished jobs, unless their lease ran out and another worker took them."""
+        if jobs:
+            with self.transaction():
+                self.conn.executemany("DELETE FROM jobs WHERE id = ? AND attempts = ?",
+                                      [(job['id'], job['attempts']) for job in jobs])
+
+    def retry(self, job, delay, error):
+        with self.transaction():
+            self.conn.execute("UPDATE jobs SET run_at = ?, last_error = ? WHERE id = ? AND attempts = ?",
+                              (time.time() + delay, error, job['id'], job['attempts']))
+
+    def fail(self, job, error):
+        """Stop retrying a job; it is kept with its error for inspection."""
+        with self.transaction():
+            self.conn.execute("UPDATE jobs SET failed_at = ?, last_error = ? WHERE id = ? AND attempts = ?",
+                              (time.time(), error, job['id'], job['attempts']))
+
+    def stats(self):
+        """Queue depth by state, and how long the oldest due job has been waiting."""
+        now = time.time()
+        row = self.conn.execute("""
+            SELECT COUNT(CASE WHEN failed_at IS NULL AND run_at <= ? THEN 1 END) AS due,
+                   COUNT(CASE WHEN failed_at IS NULL AND run_at > ? THEN 1 END) AS scheduled,
+                   COUNT(failed_at) AS failed,
+                   MIN(CASE WHEN failed_at IS NULL AND run_at <= ? THEN run_at END) AS oldest_due
+            FROM jobs
+        """, (now, now, now)).fetchone()
+        return {'due': row['due'], 'scheduled': row['scheduled'], 'failed': row['failed'],
+                'lag_seconds': round(now - row['oldest_due'], 3) if row['oldest_due'] is not None else 0}
+
+
+class PostgresRepository(Repository):
+    def transaction(self):
+        return self.conn.transaction()
+
+    @property
+    def _bundle(self):
+        return PostgresRepositories
+
+
+class PostgresProductRepository(PostgresRepository, ProductRepository):
+    located = "products"
+    in_box = "point(products.longitude, products.latitude) <@ box(point(?, ?), point(?, ?))"
+    matches = "products.search_vector @@ to_tsquery('simple', ?)"
+
+    @staticmethod
+    def box_params(min_lat, max_lat, min_lon, max_lon):
+        return min_lon, min_lat, max_lon, max_lat
+
+    def search_page(self, terms, category, after, limit, price=None, in_stock=False):
+        # ts_rank grows with relevance; negate it so pages share the SQLite (score, id) order
+        conditions, params = self._filters(category, price, in_stock)
+        query = f"""
+            SELECT * FROM (
+                SELECT {PRODUCT_CARD_COLUMNS}, -ts_rank(products.search_vector, query) AS score
+                FROM products, to_tsquery('simple', ?) AS query
+                WHERE {' AND '.join(['products.search_vector @@ query', *conditions])}
+            ) AS ranked
+        """
+        return self._ranked(query, [self.match_query(terms), *params], after, limit)
+
+    @staticmethod
+    def match_query(terms):
+        return ' & '.join('{}:*'.format(term.lower()) for term in terms)
+
+
+class PostgresOrderRepository(PostgresRepository, OrderRepository):
+    def place(self, customer_id, payment_option):
+        with self.transaction():
+            # Lock the stock rows in id order so concurrent checkouts cannot deadlock
+            products = self.conn.execute("""
+                SELECT id, name, quantity, category, price FROM products
+                WHERE id IN (SELECT product_id FROM cart WHERE customer_id = ?)
+                ORDER BY id
+                FOR UPDATE
+            """, (customer_id,)).fetchall()
+            if not products:
+                return 0, []
+            wanted = {row['product_id']: row['quantity'] for row in self.conn.execute(
+                "SELECT product_id, SUM(quantity) AS quantity FROM cart WHERE customer_id = ? GROUP BY product_id",
+                (customer_id,))}
+            out_of_stock = [row['name'] for row in products if row['quantity'] < wanted[row['id']]]
+            if out_of_stock:
+                return 0, out_of_stock
+
+            self.conn.executemany("UPDATE products SET quantity = quantity - ?, version = version + 1 WHERE id = ?",
+                                  [(wanted[row['id']], row['id']) for row in products])
+            self._create_orders(customer_id, payment_option)
+            self._stats.stock_changed([(row['id'], row['quantity'], row['quantity'] - wanted[row['id']])
+                                       for row in products])
+            self._facets.stock_changed([(dict(row, quantity=row['quantity'] - wanted[row['id']]), row['quantity'])
+                                        for row in products])
+        return [row['id'] for row in products], []
+
+
+class PostgresCartRepository(PostgresRepository, CartRepository):
+    pass
+
+
+class PostgresUserRepository(PostgresRepository, UserRepository):
+    pass
+
+
+class PostgresStatsRepository(PostgresRepository, StatsRepository):
+    pass
+
+
+class PostgresFacetRepository(PostgresRepository, FacetRepository):
+    pass
+
+
+class PostgresRankingRepository(PostgresRepository, RankingRepository):
+    epoch_lock = "FOR SHARE"
+    ordered_writes = True
+
+
+class PostgresJobRepository(PostgresRepository, JobRepository):
+    skip_locked = "FOR UPDATE SKIP LOCKED"
+
+
+class Repositories:
+    """The repositories for one connection."""
+
+    users_class = UserRepository
+    products_class = ProductRepository
+    orders_class = OrderRepository
+    cart_class = CartRepository
+    stats_class = StatsRepository
+    facets_class = FacetRepository
+    jobs_class = JobRepository
+    rankings_class = RankingRepository
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.users = self.users_class(conn)
+        self.products = self.products_class(conn)
+        self.orders = self.orders_class(conn)
+        self.cart = self.cart_class(conn)
+        self.stats = self.stats_class(conn)
+        self.facets = self.facets_class(conn)
+        self.jobs = self.jobs_class(conn)
+        self.rankings = self.rankings_class(conn)
+
+
+class PostgresRepositories(Repositories):
+    users_class = PostgresUserRepository
+    products_class = PostgresProductRepository
+    orders_class = PostgresOrderRepository
+    cart_class = PostgresCartRepository
+    stats_class = PostgresStatsRepository
+    facets_class = PostgresFacetRepository
+    jobs_class = PostgresJobRepository
+    rankings_class = PostgresRankingRepository
+
+
+def get_repositories(conn=None, readonly=False):
+    """Repositories for ``conn``, or for the request's connection.
+
+    ``readonly`` requests may be served from a read replica, so use it only
+    for catalogue reads that tolerate replication lag.
+    """
+    conn = conn or get_db(readonly=readonly)
+    if getattr(conn, 'dialect', 'sqlite') == 'postgresql':
+        return PostgresRepositories(conn)
+    return Repositories(conn)
+
+
+async def run_repos(func, *args, readonly=False):
+    """Await ``func(repositories, *args)`` on the database executor."""
+    return await run_db(lambda conn: func(get_repositories(conn), *args), readonly=readonly)
@@ -0,0 +1,96 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_app_context, request
+
+import database
+
+REQUEST_LOGGER = 'farmers.request'
+request_logger = logging.getLogger(REQUEST_LOGGER)
+
+
+class _Formatter(logging.Formatter):
+    """Plain text for application logs; request log lines are already JSON."""
+
+    def format(self, record):
+        if record.name == REQUEST_LOGGER:
+            return record.getMessage()
+        return super().format(record)
+
+
+def configure_logging(level='INFO'):
+    """Send all records through a queue so handlers never block a request thread."""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(_Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    request_logger.setLevel(logging.INFO)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def _record_query(sql, seconds):
+    if has_app_context() and 'request_stats' in g:
+        stats = g.request_stats
+        # Async views run queries on several executor threads that share this g
+        with g.request_stats_lock:
+            stats['db_time'] += seconds
+            stats['queries'] += 1
+
+
+def _start_request():
+    g.request_stats = {'started': time.perf_counter(), 'db_time': 0.0, 'queries': 0}
+    g.request_stats_lock = threading.Lock()
+
+
+def _sample_rate(app):
+    rates = app.config.get('REQUEST_LOG_SAMPLE_RATES', {})
+    return rates.get(request.endpoint, app.config.get('REQUEST_LOG_SAMPLE_RATE', 1.0))
+
+
+def init_app(app):
+    """Configure logging and emit one JSON line per (sampled) request."""
+    app.extensions['log_listener'] = configure_logging(app.config.get('LOG_LEVEL', 'INFO'))
+    database.query_listeners.append(_record_query)
+    app.before_request(_start_request)
+
+    @app.after_request
+    def log_request(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        rate = _sample_rate(app)
+        # Server errors are always logged; everything else is sampled per endpoint
+        if response.status_code < 500 and random.random() >= rate:
+            return response
+
+        entry = {
+            'ts': round(time.time(), 3),
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'sample_rate': rate,
+        }
+
+        def emit():
+            # Runs when the server closes the response, so streamed bodies are included
+            entry['duration_ms'] = round((time.perf_counter() - stats['started']) * 1000, 2)
+            entry['db_ms'] = round(stats['db_time'] * 1000, 2)
+            entry['queries'] = stats['queries']
+            request_logger.info(json.dumps(entry))
+
+        response.call_on_close(emit)
+        return response
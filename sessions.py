@@ -0,0 +1,250 @@
+"""Server-side sessions: the cookie carries only an opaque session id.
+
+Session data lives in the ``sessions`` table (``SESSION_BACKEND =
+'database'``) or, for a single process, in an in-memory LRU (``'memory'``).
+It is serialized with Flask's compact tagged JSON and written back only
+when the view changed it. Unchanged permanent sessions have their expiry
+extended at most once per ``SESSION_REFRESH_FRACTION`` of the lifetime, so
+most responses neither write the store nor send a cookie. Expired sessions
+are deleted lazily, ``SESSION_PURGE_BATCH`` rows at a time, at most every
+``SESSION_PURGE_INTERVAL`` seconds.
+"""
+import logging
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from database import get_pool
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')  # secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """Move the data to a new id, e.g. at login, so an old id cannot be reused."""
+        if self.sid is not None:
+            self.previous_sid, self.sid = self.sid, None
+        self.modified = True
+
+
+class DatabaseSessionStore:
+    """Sessions in the application database; works on either backend.
+
+    Async views fetch on the database executor with connections of their
+    own, so the store must not pin one for the whole request: it reuses the
+    request's connection when a sync view already holds one, and otherwise
+    borrows a connection for each call.
+    """
+
+    @contextmanager
+    def _connection(self):
+        if 'db' in g:
+            yield g.db
+            return
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    def load(self, sid, now):
+        with self._connection() as conn:
+            return conn.execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+                                (sid, now)).fetchone()
+
+    def save(self, sid, data, expires_at):
+        with self._connection() as conn:
+            conn.execute("""
+                INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            """, (sid, data, expires_at))
+            conn.commit()
+
+    def touch(self, sid, expires_at):
+        with self._connection() as conn:
+            conn.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, sid))
+            conn.commit()
+
+    def delete(self, sid):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+            conn.commit()
+
+    def purge(self, now, limit):
+        with self._connection() as conn:
+            cursor = conn.execute("""
+                DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)
+            """, (now, limit))
+            conn.commit()
+            return max(cursor.rowcount, 0)
+
+
+class MemorySessionStore:
+    """Least-recently-used sessions in process memory, for single-process deployments."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # sid -> (data, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None or item[1] <= now:
+                return None
+            self._data.move_to_end(sid)
+            return {'data': item[0], 'expires_at': item[1]}
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._data[sid] = (data, expires_at)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            if sid in self._data:
+                self._data[sid] = (self._data[sid][0], expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def purge(self, now, limit):
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at <= now][:limit]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, refresh_fraction=0.1, purge_interval=60, purge_batch=500):
+        self.store = store
+        self.refresh_fraction = refresh_fraction
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        self._counts = {'loaded': 0, 'saved': 0, 'refreshed': 0, 'deleted': 0, 'purged': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def open_session(self, app, request):
+        # Static files never use the session, so skip the lookup for them
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return None
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.match(sid):
+            row = self.store.load(sid, time.time())
+            if row is not None:
+                self._count('loaded')
+                return ServerSession(self.serializer.loads(row['data']), sid, row['expires_at'])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.modified and (session.sid or session.previous_sid):
+                if session.sid:
+                    self.store.delete(session.sid)
+                self._count('deleted')
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            session.sid = session.sid or secrets.token_urlsafe(32)
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), now + lifetime)
+            self._count('saved')
+        elif (session.permanent and self.should_set_cookie(app, session)
+              and session.expires_at - now < lifetime * (1 - self.refresh_fraction)):
+            self.store.touch(session.sid, now + lifetime)
+            self._count('refreshed')
+        else:
+            return
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        self._purge(now)
+
+    def _purge(self, now):
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        purged = self.store.purge(now, self.purge_batch)
+        if purged:
+            self._count('purged', purged)
+            logging.debug("Purged %d expired sessions.", purged)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def init_app(app):
+    """Replace the signed-cookie session with SESSION_BACKEND ('database' or 'memory')."""
+    backend = app.config.get('SESSION_BACKEND', 'database')
+    if backend == 'memory':
+        store = MemorySessionStore(app.config.get('SESSION_MEMORY_MAX_ENTRIES', 10000))
+    elif backend == 'database':
+        store = DatabaseSessionStore()
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}")
+    app.session_interface = ServerSessionInterface(
+        store,
+        refresh_fraction=app.config.get('SESSION_REFRESH_FRACTION', 0.1),
+        purge_interval=app.config.get('SESSION_PURGE_INTERVAL', 60),
+        purge_batch=app.config.get('SESSION_PURGE_BATCH', 500),
+    )
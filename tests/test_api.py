@@ -0,0 +1,59 @@
+import gzip
+import json
+
+from conftest import log_in, make_user
+
+
+def create_products(repos, count, description='fresh'):
+    farmer = make_user(repos, 'farmer')
+    return [repos.products.create(f'Tea {n}', 4, 9, description, None, None, farmer['id'], 'Drinks')
+            for n in range(count)]
+
+
+def test_products_are_fetched_together_with_only_the_fields_asked_for(app, repos):
+    ids = create_products(repos, 3)
+    client = app.test_client()
+    response = client.get(f"/api/v1/products?ids={ids[2]},{ids[0]},{ids[1]}&fields=name,price")
+    assert response.get_json() == {'products': [{'name': f'Tea {n}', 'price': 4.0} for n in range(3)]}
+    assert client.get(f"/api/v1/products?ids={ids[0]}&fields=password").status_code == 400
+    assert client.get("/api/v1/products?ids=1,x").status_code == 400
+
+
+def test_etag_holds_until_a_product_row_changes(app, repos):
+    ids = create_products(repos, 2)
+    client = app.test_client()
+    url = f"/api/v1/products?ids={ids[0]},{ids[1]}"
+    etag = client.get(url).headers['ETag']
+    not_modified = client.get(url, headers={'If-None-Match': etag})
+    assert (not_modified.status_code, not_modified.get_data()) == (304, b'')
+
+    with repos.products.transaction():
+        repos.conn.execute("UPDATE products SET price = 5, version = version + 1 WHERE id = ?", (ids[1],))
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_large_responses_are_gzipped_for_clients_that_accept_it(app, repos):
+    ids = create_products(repos, 5, description='a long description ' * 20)
+    url = f"/api/v1/products?ids={','.join(map(str, ids))}&fields=id,description"
+    response = app.test_client().get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert [product['id'] for product in json.loads(gzip.decompress(response.get_data()))['products']] == ids
+    assert 'Content-Encoding' not in app.test_client().get(url).headers
+
+
+def test_order_listing_pages_with_a_cursor(app, repos):
+    [product_id] = create_products(repos, 1)
+    customer = make_user(repos, 'customer')
+    for _ in range(3):
+        repos.cart.add(customer['id'], product_id, 1)
+        repos.orders.place(customer['id'], 'cash')
+    client = app.test_client()
+    log_in(client, customer)
+
+    first = client.get('/api/v1/orders?per_page=2').get_json()
+    rest = client.get(f"/api/v1/orders?per_page=2&after={first['next']}").get_json()
+    ids = [order['id'] for order in first['orders'] + rest['orders']]
+    assert len(first['orders']) == 2 and rest['next'] is None
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 3
+    assert app.test_client().get('/api/v1/orders').status_code == 401
@@ -0,0 +1,52 @@
+from conftest import log_in, make_user
+
+from pagination import history_cursor, parse_history_cursor
+
+
+def place_orders(repos, count):
+    """``count`` one-line orders of a fresh customer; returns the customer and the order ids, oldest first."""
+    farmer, customer = make_user(repos, 'farmer'), make_user(repos, 'customer')
+    product_id = repos.products.create('Sorghum', 2, 100, 'grain', None, None, farmer['id'], 'Cereal')
+    for _ in range(count):
+        repos.cart.add(customer['id'], product_id, 1)
+        repos.orders.place(customer['id'], 'cash')
+    return farmer, customer, [row['id'] for row in repos.conn.execute(
+        "SELECT id FROM orders WHERE customer_id = ? ORDER BY id", (customer['id'],))]
+
+
+def complete(repos, customer, order_ids, completed_at):
+    for order_id in order_ids:
+        repos.orders.confirm_delivery(order_id, customer['id'])
+    with repos.orders.transaction():
+        repos.conn.executemany("UPDATE orders SET completed_at = ? WHERE id = ?",
+                               [(completed_at, order_id) for order_id in order_ids])
+
+
+def test_only_old_completed_orders_move_in_batches(repos):
+    farmer, customer, (old, recent, pending) = place_orders(repos, 3)
+    complete(repos, customer, [old], 1000)
+    complete(repos, customer, [recent], 9000)
+    totals = dict(repos.stats.for_farmer(farmer['id']))
+
+    assert repos.orders.archive(completed_before=5000, limit=1) == 1
+    assert repos.orders.archive(completed_before=5000, limit=1) == 0
+    assert [row['id'] for row in repos.conn.execute("SELECT id FROM orders_archive WHERE customer_id = ?",
+                                                    (customer['id'],))] == [old]
+    assert dict(repos.stats.for_farmer(farmer['id'])) == totals  # Archived orders still count
+
+
+def test_history_pages_from_current_orders_into_the_archive(app, repos):
+    _, customer, (first, second, third) = place_orders(repos, 3)
+    complete(repos, customer, [first, second], 1000)
+    repos.orders.archive(completed_before=5000, limit=10)
+
+    page = repos.orders.for_customer(customer['id'], None, 2)
+    assert [(row['id'], row['archived']) for row in page] == [(third, 0), (second, 1)]
+    after = parse_history_cursor(history_cursor(page[-1]))
+    assert after == (True, second)
+    assert [row['id'] for row in repos.orders.for_customer(customer['id'], after, 2)] == [first]
+
+    client = app.test_client()
+    log_in(client, customer)
+    html = client.get(f'/orders?per_page=2&after=a{second}').get_data(as_text=True)
+    assert 'Sorghum' in html and 'Completed' in html
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+from flask import g
+
+from database import get_pool, run_db
+
+
+def test_run_db_uses_the_executor_and_its_own_connection(app):
+    with app.test_request_context():
+        thread, in_transaction = asyncio.run(run_db(
+            lambda conn: (threading.current_thread().name, conn.in_transaction)))
+        assert thread.startswith('db') and not in_transaction
+        assert 'db' not in g  # Nothing was pinned to the request
+        stats = get_pool().stats()
+        assert stats['idle'] == stats['opened']
+
+
+def test_asgi_application_serves_the_marketplace(app):
+    import asgi
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': '/marketplace', 'raw_path': b'/marketplace', 'query_string': b'', 'root_path': '',
+             'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    assert messages[0]['status'] == 200
+    assert b'product-cards' in b''.join(message.get('body', b'') for message in messages[1:])
@@ -0,0 +1,40 @@
+import re
+
+from flask import url_for
+
+import assets
+
+
+def hashed_url(app, filename):
+    with app.test_request_context():
+        return url_for('static', filename=filename)
+
+
+def test_hashed_binary_asset_is_cached_as_immutable(app):
+    response = app.test_client().get(hashed_url(app, 'css/OIP.jpg'))
+    assert response.status_code == 200
+    assert not response.cache_control.no_cache
+    assert response.cache_control.public and response.cache_control.immutable
+    assert response.cache_control.max_age == app.config['ASSET_MAX_AGE']
+
+
+def test_hashed_text_asset_is_cached_as_immutable(app):
+    response = app.test_client().get(hashed_url(app, 'css/style.css'), headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert not response.cache_control.no_cache
+    assert response.cache_control.max_age == app.config['ASSET_MAX_AGE']
+
+
+def test_hashed_url_from_another_process_is_served(app):
+    url = hashed_url(app, 'css/OIP.jpg')
+    saved = app.extensions['asset_manifest']
+    app.extensions['asset_manifest'] = assets.AssetManifest(app.static_folder)  # As in a fresh worker
+    try:
+        response = app.test_client().get(url)
+        assert response.status_code == 200
+        assert response.cache_control.immutable
+        wrong_digest = app.test_client().get(re.sub(r'\.[0-9a-f]{12}\.', '.000000000000.', url))
+        assert wrong_digest.status_code == 404
+    finally:
+        app.extensions['asset_manifest'] = saved
@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+from auth import HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    hasher._run(time.sleep, 0)  # Start the process before timing anything
+    hasher.timeout = 0.2
+    yield hasher
+    hasher.shutdown()
+
+
+def test_a_timed_out_hash_keeps_its_slot_until_it_finishes(hasher):
+    with pytest.raises(HasherBusy):
+        hasher._run(time.sleep, 0.6)
+    with pytest.raises(HasherBusy):
+        hasher._run(time.sleep, 0)  # Rejected at once: the process is still busy
+    assert hasher.stats()['in_flight'] == 1
+    time.sleep(0.6)
+    hasher._run(time.sleep, 0)
+    assert hasher.stats()['in_flight'] == 0
+
+
+def test_in_flight_hashes_stay_below_the_request_threads(app):
+    hasher = app.extensions['password_hasher']
+    assert hasher.max_in_flight < app.config['ASGI_THREADS']
+    assert PasswordHasher(workers=4, max_queue=32, max_in_flight=5).max_in_flight == 5
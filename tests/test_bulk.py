@@ -0,0 +1,27 @@
+import io
+import zipfile
+
+from conftest import log_in, make_user
+
+import bulk
+
+
+def test_malformed_csv_is_reported_not_a_server_error(app, repos):
+    client = app.test_client()
+    log_in(client, make_user(repos, 'farmer'))
+    text = 'name,price,category\nPear,1,Fruit\n"' + 'x' * 200000 + '",1,Fruit\n'
+    response = client.post('/import_products', data={'file': (io.BytesIO(text.encode()), 'products.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert 'malformed CSV after line 2: field larger than field limit' in response.get_data(as_text=True)
+
+
+def test_oversized_archive_images_are_rejected_before_reading(repos):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as images:
+        images.writestr('big.jpg', b'\0' * 4096)
+    archive.seek(0)
+    farmer = make_user(repos, 'farmer')
+    importer = bulk.ProductImporter(repos, farmer['id'], None, images=archive, max_image_size=1024)
+    report = importer.run([(2, {'name': 'Pear', 'price': '1', 'category': 'Fruit', 'image': 'big.jpg'})])
+    assert (report.imported, report.errors) == (0, [(2, 'big.jpg is larger than 1024 bytes')])
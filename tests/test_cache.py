@@ -0,0 +1,54 @@
+import uuid
+
+from conftest import log_in, make_user
+
+from cache import LocalBackend, ProductCache
+
+
+class SharedBackend:
+    """Stands in for Redis: a backend the caches do not treat as process-local."""
+
+    def __init__(self):
+        self._local = LocalBackend()
+        self.get, self.set, self.incr = self._local.get, self._local.set, self._local.incr
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ProductCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+
+def test_expired_entries_are_not_served():
+    cache = ProductCache(ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_a_write_in_one_worker_invalidates_the_others():
+    backend = SharedBackend()
+    writer, reader = ProductCache(backend=backend), ProductCache(backend=backend)
+    key = reader.product_key(7)
+    reader.set(key, {'name': 'Kale'})
+    assert writer.get(key) == {'name': 'Kale'}
+
+    writer.invalidate_products([7])
+    assert reader.product_key(7) != key
+    assert reader.get(reader.product_key(7)) is None
+
+
+def test_adding_a_product_refreshes_the_cached_marketplace(app, repos):
+    category = uuid.uuid4().hex[:12]
+    customer, farmer = app.test_client(), app.test_client()
+    log_in(customer, make_user(repos, 'customer'))
+    log_in(farmer, make_user(repos, 'farmer'))
+    assert 'Okra' not in customer.get(f'/marketplace?category={category}').get_data(as_text=True)
+
+    farmer.post('/addproduct', data=dict(name='Okra', description='green', price='2', quantity='4',
+                                         category=category, contact='0700'))
+    assert 'Okra' in customer.get(f'/marketplace?category={category}').get_data(as_text=True)
@@ -0,0 +1,36 @@
+from conftest import log_in, make_user
+
+
+def cart_lines(repos, customer):
+    return {row['product_id']: row['quantity'] for row in repos.cart.items(customer['id'])}
+
+
+def test_adding_a_product_twice_keeps_one_line_and_no_session_cart(app, repos):
+    farmer, customer = make_user(repos, 'farmer'), make_user(repos, 'customer')
+    product_id = repos.products.create('Beans', 3, 10, 'dry', None, None, farmer['id'], 'Legumes')
+    client = app.test_client()
+    log_in(client, customer)
+
+    client.post(f'/productpage/{product_id}', data={'quantity': '2'})
+    client.post('/add_to_cart', data={'product_id': str(product_id), 'quantity': '3'})
+    assert cart_lines(repos, customer) == {product_id: 5}
+    with client.session_transaction() as session:
+        assert 'cart' not in session
+
+
+def test_update_cart_sets_and_removes_lines_in_one_request(app, repos):
+    farmer, customer = make_user(repos, 'farmer'), make_user(repos, 'customer')
+    kept, dropped, added = (repos.products.create(name, 3, 10, 'dry', None, None, farmer['id'], 'Legumes')
+                            for name in ('Peas', 'Lentils', 'Gram'))
+    repos.cart.add(customer['id'], kept, 1)
+    repos.cart.add(customer['id'], dropped, 1)
+    client = app.test_client()
+    log_in(client, customer)
+
+    response = client.post('/update_cart', json={'items': [{'product_id': kept, 'quantity': 4},
+                                                           {'product_id': dropped, 'quantity': 0},
+                                                           {'product_id': added, 'quantity': 2},
+                                                           {'product_id': 10 ** 9, 'quantity': 1}]})
+    assert response.get_json() == {'updated': 4}
+    assert cart_lines(repos, customer) == {kept: 4, added: 2}
+    assert client.post('/update_cart', json={'items': [{'product_id': 'x'}]}).status_code == 400
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from database import ConnectionPool, get_db, get_pool
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(os.path.join(tempfile.mkdtemp(), 'pool.db'), size=1, timeout=0.05)
+    yield pool
+    pool.close_all()
+
+
+def test_pooled_connections_are_configured_once_and_reused(pool):
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert (pool.misses, pool.hits) == (1, 1)
+
+
+def test_exhausted_pool_times_out_instead_of_opening_more(pool):
+    conn = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError, match="Timed out"):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.stats() == {'size': 1, 'opened': 1, 'idle': 1, 'hits': 0, 'misses': 1, 'waits': 1}
+
+
+def test_a_request_borrows_one_connection_and_returns_it(app):
+    with app.app_context():
+        get_db()  # Make sure the pool has an idle connection to hand out
+    idle = get_pool(app).stats()['idle']
+    with app.test_request_context():
+        assert get_db() is get_db()
+        assert get_pool().stats()['idle'] == idle - 1
+    assert get_pool(app).stats()['idle'] == idle
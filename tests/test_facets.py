@@ -0,0 +1,24 @@
+import uuid
+
+from conftest import RecordingConnection, make_user
+
+from repositories import PostgresProductRepository
+
+
+def test_search_applies_price_and_stock_facets(repos):
+    farmer = make_user(repos, 'farmer')
+    word = uuid.uuid4().hex[:12]  # Only this test's products match
+    cheap = repos.products.create(f'{word} cheap', 3, 10, 'fresh', None, None, farmer['id'], 'Fruit')
+    repos.products.create(f'{word} dear', 30, 10, 'fresh', None, None, farmer['id'], 'Fruit')
+    repos.products.create(f'{word} sold out', 4, 0, 'fresh', None, None, farmer['id'], 'Fruit')
+
+    rows = repos.products.search_page([word], 'Fruit', None, 10, price=(0, 5), in_stock=True)
+    assert [row['id'] for row in rows] == [cheap]
+
+
+def test_postgresql_search_applies_price_and_stock_facets():
+    conn = RecordingConnection()
+    PostgresProductRepository(conn).search_page(['mango'], 'Fruit', None, 10, price=(5, 10), in_stock=True)
+    sql, params = conn.statements[0]
+    assert "products.category = ? AND products.price >= ? AND products.price < ? AND products.quantity > 0" in sql
+    assert params == ('mango:*', 'Fruit', 5, 10, 10)
@@ -0,0 +1,37 @@
+import sqlite3
+
+import pytest
+
+from database import MATH_FUNCTIONS, add_math_functions
+from geo import distance_km
+from repositories import DISTANCE_KM
+
+
+class NoMathConnection(sqlite3.Connection):
+    """A connection that behaves like an SQLite build without the math functions."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.registered = []
+
+    def executescript(self, script):
+        if 'asin' in script:
+            raise sqlite3.OperationalError("no such function: asin")
+        return super().executescript(script)
+
+    def create_function(self, name, narg, func, **kwargs):
+        self.registered.append(name)
+        return super().create_function(name, narg, func, **kwargs)
+
+
+def test_math_functions_are_registered_when_sqlite_lacks_them():
+    conn = sqlite3.connect(':memory:', factory=NoMathConnection)
+    add_math_functions(conn)
+    assert conn.registered == [name for name, _, _ in MATH_FUNCTIONS]
+
+    conn.execute("CREATE TABLE products (latitude REAL, longitude REAL)")
+    conn.executemany("INSERT INTO products VALUES (?, ?)", [(-1.29, 36.82), (None, None)])
+    rows = conn.execute(f"SELECT {DISTANCE_KM} FROM products", (-0.09, -0.09, 34.77)).fetchall()
+    assert rows[0][0] == pytest.approx(distance_km(-0.09, 34.77, -1.29, 36.82))
+    assert rows[1][0] is None
+    assert conn.execute("SELECT asin(2), sqrt(-1)").fetchone() == (None, None)
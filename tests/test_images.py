@@ -0,0 +1,69 @@
+import io
+import os
+import tempfile
+import threading
+from functools import partial
+
+import pytest
+from PIL import Image
+
+import images
+from conftest import make_user
+from images import ImagePipeline, ImagePipelineBusy
+
+
+def jpeg(seed, size=(64, 64)):
+    data = io.BytesIO()
+    Image.frombytes('RGB', size, bytes((seed + i) % 256 for i in range(size[0] * size[1] * 3))).save(data, 'JPEG')
+    return data.getvalue()
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = ImagePipeline(tempfile.mkdtemp(), workers=1, max_queued=1)
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_full_queue_rejects_uploads_until_a_slot_frees(pipeline):
+    gate = threading.Event()
+    pipeline._executor.submit(gate.wait)  # Hold the only worker
+    name = pipeline.submit(io.BytesIO(jpeg(1)))
+    with pytest.raises(ImagePipelineBusy):
+        pipeline.submit(io.BytesIO(jpeg(2)))
+    gate.set()
+    other = pipeline.submit(io.BytesIO(jpeg(2)), block=True)
+    pipeline.shutdown()
+    assert pipeline.is_processed(name) and pipeline.is_processed(other)
+
+
+def test_queued_uploads_are_spooled_to_disk(pipeline, monkeypatch):
+    queued = []
+    monkeypatch.setattr(pipeline._executor, 'submit', lambda func, *args: queued.append(args))
+    data = jpeg(3)
+    pipeline.submit(io.BytesIO(data))
+    [(name, path)] = queued
+    with open(path, 'rb') as spooled:
+        assert spooled.read() == data
+    os.remove(path)
+
+
+def test_non_images_are_not_queued(pipeline):
+    assert pipeline.submit(io.BytesIO(b'GIF89a but not really')) is None
+    assert pipeline.submit(io.BytesIO(b'plain text')) is None
+    assert pipeline._slots.acquire(blocking=False)  # Rejections give their slot back
+
+
+def test_failed_processing_clears_the_image_from_products(app, repos):
+    farmer = make_user(repos, 'farmer')
+    full = jpeg(4, size=(200, 200))
+    truncated = full[:len(full) // 2]  # Passes verify() but cannot be decoded
+    name = images.hashlib.sha256(truncated).hexdigest()[:24]
+    product_id = repos.products.create('Kale', 1.0, 5, 'Leafy', '0700', name, farmer['id'], 'Vegetables')
+
+    pipeline = ImagePipeline(tempfile.mkdtemp(), workers=1, on_failure=partial(images.clear_failed_image, app))
+    assert pipeline.submit(io.BytesIO(truncated)) == name
+    pipeline.shutdown()
+
+    assert not pipeline.is_processed(name)
+    assert repos.products.get(product_id)['image'] is None
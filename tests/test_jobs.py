@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import time
+
+import pytest
+from conftest import make_user
+
+import jobs
+from database import ConnectionPool, init_db
+from jobs import JobWorker
+from repositories import get_repositories
+
+
+@pytest.fixture
+def queue():
+    """Repositories on a database of their own, so other tests' jobs stay out of the way."""
+    path = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    init_db(path)
+    pool = ConnectionPool(path, size=1)
+    yield get_repositories(pool.acquire())
+    pool.close_all()
+
+
+def enqueue(repos, kind):
+    with repos.jobs.transaction():
+        repos.jobs.enqueue(kind, {})
+
+
+def test_failing_jobs_back_off_then_are_kept_as_failed(queue, monkeypatch):
+    def flaky(repos, payload):
+        raise RuntimeError("mail server down")
+    monkeypatch.setitem(jobs.HANDLERS, 'test.flaky', flaky)
+    enqueue(queue, 'test.flaky')
+    worker = JobWorker(queue, max_attempts=3, retry_delay=10)
+
+    delays = []
+    for _ in range(2):
+        worker.run_batch()
+        delays.append(round(queue.conn.execute("SELECT run_at FROM jobs").fetchone()[0] - time.time()))
+        with queue.jobs.transaction():
+            queue.conn.execute("UPDATE jobs SET run_at = 0")  # Due again straight away
+    worker.run_batch()
+
+    assert delays == [10, 20]
+    assert queue.jobs.stats() == {'due': 0, 'scheduled': 0, 'failed': 1, 'lag_seconds': 0}
+    assert tuple(queue.conn.execute("SELECT attempts, last_error FROM jobs").fetchone()) == (3, 'mail server down')
+
+
+def test_expired_leases_are_redelivered_and_only_the_new_lease_completes(queue):
+    enqueue(queue, 'test.slow')
+    [stale] = queue.jobs.lease(10, visibility_timeout=0)
+    [current] = queue.jobs.lease(10, visibility_timeout=60)
+    assert (stale['id'], stale['attempts'], current['attempts']) == (current['id'], 1, 2)
+    assert queue.jobs.lease(10, visibility_timeout=60) == []
+
+    queue.jobs.complete([stale])
+    assert queue.jobs.stats()['scheduled'] == 1
+    queue.jobs.complete([current])
+    assert queue.jobs.stats() == {'due': 0, 'scheduled': 0, 'failed': 0, 'lag_seconds': 0}
+
+
+def test_checkout_and_delivery_queue_jobs_with_their_orders(repos):
+    farmer, customer = make_user(repos, 'farmer'), make_user(repos, 'customer')
+    product_id = repos.products.create('Honey', 6, 5, 'raw', None, None, farmer['id'], 'Other')
+    repos.cart.add(customer['id'], product_id, 1)
+    repos.orders.place(customer['id'], 'cash')
+    order_id = repos.conn.execute("SELECT id FROM orders WHERE customer_id = ?", (customer['id'],)).fetchone()[0]
+    repos.orders.confirm_delivery(order_id, customer['id'])
+
+    queued = repos.conn.execute("SELECT kind, payload FROM jobs ORDER BY id DESC LIMIT 2").fetchall()
+    assert [(row['kind'], json.loads(row['payload'])) for row in reversed(queued)] == [
+        ('orders.placed', {'order_ids': [order_id]}), ('delivery.confirmed', {'order_ids': [order_id]})]
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import dataset  # noqa: E402
+import loadtest  # noqa: E402
+
+
+def test_seeded_dataset_has_dashboard_totals_and_facets():
+    db_path = os.path.join(tempfile.mkdtemp(), 'seed.db')
+    dataset.seed(db_path, farmers=2, customers=3, products=20, orders=50)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT SUM(units_sold) FROM farmer_stats").fetchone() == (
+        conn.execute("SELECT SUM(quantity) FROM orders").fetchone())
+    assert conn.execute("SELECT products FROM catalogue_facets WHERE facet = 'all'").fetchone() == (20,)
+    assert conn.execute("SELECT COUNT(*) FROM top_products WHERE category = ''").fetchone()[0] > 0
+    conn.close()
+
+
+def test_compare_flags_slower_routes_lower_throughput_and_errors():
+    recorder = loadtest.Recorder()
+    for ms in range(1, 101):
+        recorder.record('/marketplace', ms / 1000, 200)
+    recorder.record('/checkout', 0.01, 500)
+    report = recorder.report(elapsed=1.0)
+    assert report['routes']['/marketplace']['p95_ms'] == 95.0
+
+    baseline = {'rps': 101, 'routes': {'/marketplace': {'p95_ms': 95.0}, '/checkout': {'p95_ms': 10.0}}}
+    assert loadtest.compare(report, baseline, tolerance=0.1) == ['/checkout: 1 server errors']
+    baseline = {'rps': 200, 'routes': {'/marketplace': {'p95_ms': 50.0}, '/orders': {'p95_ms': 5.0}}}
+    assert loadtest.compare(report, baseline, tolerance=0.1) == [
+        'throughput 101.0 rps < baseline 200 rps',
+        '/marketplace: p95 95.0 ms > baseline 50.0 ms',
+        '/orders: no requests recorded',
+        '/checkout: 1 server errors',
+    ]
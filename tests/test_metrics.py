@@ -0,0 +1,24 @@
+import asyncio
+
+from flask import g
+
+import metrics
+from repositories import run_repos
+
+
+def test_in_lists_of_any_length_share_one_label():
+    assert metrics.normalize_sql("SELECT * FROM products\n    WHERE id IN (?)") == (
+        metrics.normalize_sql("SELECT * FROM products WHERE id IN (?, ?, ?)")) == (
+        "SELECT * FROM products WHERE id IN (...)")
+
+
+def test_queries_from_concurrent_executor_threads_are_all_counted(app):
+    async def count_queries():
+        await asyncio.gather(*(run_repos(lambda repos: repos.conn.execute("SELECT 1").fetchone(), readonly=True)
+                               for _ in range(200)))
+
+    with app.test_request_context():
+        app.preprocess_request()
+        asyncio.run(count_queries())
+        assert g.metrics_statements['SELECT 1'] == 200
+        assert g.request_stats['queries'] == 200
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from database import init_db
+from migrations import MIGRATIONS, Migrator
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def columns(conn):
+    tables = [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {table: sorted(row['name'] for row in conn.execute(f"PRAGMA table_info('{table}')")) for table in tables}
+
+
+def objects(conn):
+    return {(row['type'], row['name']) for row in conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'")}
+
+
+@pytest.fixture
+def legacy():
+    """A database at version 1, the schema from before migrations, with some history in it."""
+    conn = connect(os.path.join(tempfile.mkdtemp(), 'legacy.db'))
+    Migrator(conn).migrate(target=1)
+    conn.executescript("""
+        INSERT INTO users (name, email, password, role) VALUES ('F', 'f@example.com', 'x', 'farmer'),
+                                                               ('C', 'c@example.com', 'x', 'customer');
+        INSERT INTO products (name, price, quantity, description, farmer_id, category)
+            VALUES ('Kale', 2.5, 3, 'leafy', 1, 'Vegetables');
+        INSERT INTO orders (product_id, customer_id, quantity, payment_option, status)
+            VALUES (1, 2, 4, 'cash', 'Completed');
+        INSERT INTO cart (customer_id, product_id, quantity) VALUES (2, 1, 1), (2, 1, 2);
+    """)
+    yield conn
+    conn.close()
+
+
+def test_legacy_database_migrates_to_the_current_schema_keeping_its_data(legacy):
+    assert Migrator(legacy, batch_size=1).migrate() == sorted(MIGRATIONS)[1:]
+
+    current_path = os.path.join(tempfile.mkdtemp(), 'current.db')
+    init_db(current_path)
+    current = connect(current_path)
+    assert columns(legacy) == columns(current)
+    # The cart's one-line-per-product constraint is a named index rather than a table constraint
+    assert objects(legacy) - objects(current) == {('index', 'idx_cart_customer_product')}
+    assert objects(current) <= objects(legacy)
+    current.close()
+
+    assert legacy.execute("SELECT total_price FROM orders").fetchone()[0] == 10.0
+    assert [tuple(row) for row in legacy.execute("SELECT product_id, quantity FROM cart")] == [(1, 3)]
+    assert tuple(legacy.execute("SELECT units_sold, revenue FROM farmer_stats").fetchone()) == (4, 10.0)
+    assert legacy.execute("SELECT rowid FROM products_fts WHERE products_fts MATCH 'kal*'").fetchone()[0] == 1
+
+
+def test_migrations_are_recorded_once(legacy):
+    migrator = Migrator(legacy)
+    migrator.migrate(target=3)
+    assert migrator.applied() == {1, 2, 3}
+    assert migrator.migrate() == sorted(MIGRATIONS)[3:]
+    assert migrator.migrate() == []
+
+
+def test_backfills_run_in_batches_and_resume(legacy):
+    legacy.executemany("INSERT INTO products (name, price, quantity, description) VALUES (?, 1, 0, '')",
+                       [(f'P{n}',) for n in range(4)])
+    legacy.commit()
+    batches = []
+    legacy.set_trace_callback(lambda sql: batches.append(sql) if sql.startswith('UPDATE') else None)
+    migrator = Migrator(legacy, batch_size=2)
+    assert migrator.backfill('products', "quantity = 1", "quantity = 0") == 4
+    assert len(batches) == 3  # Ids 1-2, 3-4 and 5
+    assert migrator.backfill('products', "quantity = 1", "quantity = 0") == 0
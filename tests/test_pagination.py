@@ -0,0 +1,33 @@
+import re
+import uuid
+
+from conftest import log_in, make_user
+
+from pagination import KeysetPage
+
+
+def test_keyset_page_holds_back_the_extra_row_as_the_cursor():
+    completed = []
+    page = KeysetPage(iter([{'id': 3}, {'id': 5}, {'id': 8}]), 2,
+                      on_complete=lambda rows, cursor: completed.append((rows, cursor)))
+    assert [row['id'] for row in page] == [3, 5]
+    assert page.next_cursor == 5
+    assert completed == [([{'id': 3}, {'id': 5}], 5)]
+
+
+def test_marketplace_pages_cover_a_category_once(app, repos):
+    farmer = make_user(repos, 'farmer')
+    category = uuid.uuid4().hex[:12]
+    created = [repos.products.create(f'Yam {n}', 2, 1, 'fresh', None, None, farmer['id'], category) for n in range(5)]
+
+    client = app.test_client()
+    log_in(client, make_user(repos, 'customer'))  # Cards only link to products for customers
+    seen, after = [], ''
+    while after is not None:
+        html = client.get(f'/marketplace?category={category}&per_page=2&after={after}').get_data(as_text=True)
+        page = [int(product_id) for product_id in re.findall(r'/productpage/(\d+)', html)]
+        assert len(page) <= 2
+        seen += page
+        next_link = re.search(r'after=(\d+)', html)
+        after = next_link.group(1) if next_link else None
+    assert seen == created
@@ -0,0 +1,43 @@
+import database
+import repositories
+from conftest import make_user
+
+
+def checkout(repos, customer, products, quantity=1):
+    for product_id in products:
+        repos.cart.add(customer['id'], product_id, quantity)
+    statements = []
+    database.query_listeners.append(lambda sql, seconds: statements.append(sql))
+    try:
+        placed, out_of_stock = repos.orders.place(customer['id'], 'cash')
+    finally:
+        database.query_listeners.pop()
+    assert out_of_stock == []
+    return statements
+
+
+def test_checkout_runs_the_same_statements_whatever_the_cart_size(repos):
+    farmer = make_user(repos, 'farmer')
+    products = [repos.products.create(f'Produce {n}', 1, 100, 'fresh', None, None, farmer['id'], 'Fruit')
+                for n in range(5)]
+    checkout(repos, make_user(repos, 'customer'), products[:1])  # Creates the ranking epoch
+    one = checkout(repos, make_user(repos, 'customer'), products[:1])
+    five = checkout(repos, make_user(repos, 'customer'), products)
+    assert len(five) == len(one)
+    assert sum('top_products' in sql for sql in five) == 2 + 2 * 2  # Upsert per ranking, trim per list
+
+
+def test_lists_keep_the_best_ranking_size_products(repos, monkeypatch):
+    monkeypatch.setattr(repositories, 'RANKING_SIZE', 2)
+    farmer = make_user(repos, 'farmer')
+    category = f'Ranked {farmer["id"]}'  # Only this test's products are in this category's lists
+    low, middle, high = (repos.products.create(f'Produce {n}', 1, 100, 'fresh', None, None, farmer['id'], category)
+                         for n in range(3))
+    checkout(repos, make_user(repos, 'customer'), [low], quantity=1)
+    checkout(repos, make_user(repos, 'customer'), [middle, high], quantity=2)
+    checkout(repos, make_user(repos, 'customer'), [high], quantity=1)
+    rows = repos.conn.execute("""
+        SELECT product_id, score FROM top_products WHERE ranking = 'bestselling' AND category = ?
+        ORDER BY score DESC, product_id
+    """, (category,)).fetchall()
+    assert [(row['product_id'], row['score']) for row in rows] == [(high, 3), (middle, 2)]
@@ -0,0 +1,69 @@
+import time
+
+from flask import g
+
+from conftest import RecordingConnection
+
+from database import get_db
+from postgres import to_pyformat
+from repositories import (FacetRepository, JobRepository, OrderRepository, PostgresFacetRepository,
+                          PostgresJobRepository, PostgresOrderRepository, PostgresProductRepository,
+                          PostgresRankingRepository, PostgresRepositories, PostgresStatsRepository,
+                          RankingRepository, Repositories, StatsRepository, get_repositories)
+
+
+class ReplicaPool:
+    """Hands out a named stand-in connection for the primary or the replica."""
+
+    has_replica = True
+
+    def __init__(self):
+        self.released = []
+
+    def acquire(self, readonly=False):
+        return 'replica' if readonly else 'primary'
+
+    def release(self, conn):
+        self.released.append(conn)
+
+
+def test_repositories_follow_the_connection_dialect(repos):
+    assert type(get_repositories(repos.conn)) is Repositories
+    assert type(get_repositories(RecordingConnection())) is PostgresRepositories
+
+
+def test_statements_are_rewritten_for_psycopg():
+    assert to_pyformat("SELECT * FROM products WHERE name LIKE '%kale' AND id = ?") == (
+        "SELECT * FROM products WHERE name LIKE '%%kale' AND id = %s")
+
+
+def test_postgresql_checkout_locks_the_stock_rows_in_id_order():
+    conn = RecordingConnection()
+    assert PostgresOrderRepository(conn).place(1, 'cash') == (0, [])
+    sql, params = conn.statements[0]
+    assert sql.endswith("ORDER BY id FOR UPDATE") and params == (1,)
+
+
+def test_catalogue_reads_can_use_the_replica(app, monkeypatch):
+    pool = ReplicaPool()
+    monkeypatch.setitem(app.extensions, 'db_pool', pool)
+    with app.app_context():
+        assert (get_db(readonly=True), get_db()) == ('replica', 'primary')
+        assert (g.db_replica, g.db) == ('replica', 'primary')
+    assert sorted(pool.released) == ['primary', 'replica']
+
+
+def test_write_paths_delegate_to_repositories_of_their_backend():
+    sqlite = OrderRepository(None)
+    assert (type(sqlite._stats), type(sqlite._facets), type(sqlite._jobs), type(sqlite._rankings)) == (
+        StatsRepository, FacetRepository, JobRepository, RankingRepository)
+    postgres = PostgresOrderRepository(None)
+    assert (type(postgres._stats), type(postgres._facets), type(postgres._jobs), type(postgres._rankings)) == (
+        PostgresStatsRepository, PostgresFacetRepository, PostgresJobRepository, PostgresRankingRepository)
+    assert type(PostgresProductRepository(None)._rankings) is PostgresRankingRepository
+
+
+def test_checkout_on_postgresql_reads_the_ranking_epoch_for_share():
+    conn = RecordingConnection(rows=[{'epoch': time.time()}])
+    PostgresOrderRepository(conn)._rankings.orders_placed([])
+    assert conn.statements[0][0].endswith("FOR SHARE")
@@ -0,0 +1,32 @@
+import uuid
+
+from conftest import make_user
+
+from repositories import search_terms
+
+
+def search(repos, text):
+    return [row['id'] for row in repos.products.search_page(search_terms(text), None, None, 10)]
+
+
+def test_prefixes_match_and_names_rank_above_descriptions(repos):
+    farmer = make_user(repos, 'farmer')
+    word = uuid.uuid4().hex[:12]
+    in_description = repos.products.create('Basket', 5, 1, f'holds {word}', None, None, farmer['id'], 'Other')
+    in_name = repos.products.create(f'{word} mangoes', 5, 1, 'sweet', None, None, farmer['id'], 'Fruit')
+
+    assert search(repos, word[:6]) == [in_name, in_description]
+    assert search(repos, f'{word[:6]} mang') == [in_name]
+
+
+def test_index_follows_renames_and_deletes(repos):
+    farmer = make_user(repos, 'farmer')
+    old, new = uuid.uuid4().hex[:12], uuid.uuid4().hex[:12]
+    product_id = repos.products.create(old, 5, 1, 'fresh', None, None, farmer['id'], 'Fruit')
+
+    with repos.products.transaction():
+        repos.conn.execute("UPDATE products SET name = ? WHERE id = ?", (new, product_id))
+    assert (search(repos, old), search(repos, new)) == ([], [product_id])
+
+    repos.products.delete(product_id, farmer['id'])
+    assert search(repos, new) == []
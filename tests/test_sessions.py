@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import log_in, make_user
+
+from database import ConnectionPool
+
+
+@pytest.fixture
+def single_connection_pool(app):
+    """Swap in a pool of one connection (and one DB thread) for the test."""
+    saved = app.extensions['db_pool'], app.extensions['db_executor']
+    app.extensions['db_pool'] = ConnectionPool(app.config['DATABASE'], size=1, timeout=1.0)
+    app.extensions['db_executor'] = ThreadPoolExecutor(max_workers=1)
+    yield app.extensions['db_pool']
+    app.extensions['db_pool'].close_all()
+    app.extensions['db_executor'].shutdown()
+    app.extensions['db_pool'], app.extensions['db_executor'] = saved
+
+
+@pytest.mark.parametrize('role, path', [('customer', '/orders'), ('customer', '/cart'),
+                                        ('customer', '/marketplace'), ('farmer', '/dashboard')])
+def test_logged_in_async_views_work_with_one_pooled_connection(app, repos, single_connection_pool, role, path):
+    client = app.test_client()
+    log_in(client, make_user(repos, role))
+    response = client.get(path)
+    assert response.status_code == 200
+    response.get_data()  # Drain the streamed template
+    assert single_connection_pool.stats()['idle'] == 1
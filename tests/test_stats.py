@@ -0,0 +1,39 @@
+from conftest import make_user
+
+TOTALS = ('products', 'low_stock_products', 'units_sold', 'revenue', 'pending_orders', 'completed_orders')
+
+
+def totals(repos, farmer):
+    return {column: repos.stats.for_farmer(farmer['id'])[column] for column in TOTALS}
+
+
+def test_write_paths_keep_dashboard_totals_equal_to_a_rebuild(repos):
+    farmer, customer = make_user(repos, 'farmer'), make_user(repos, 'customer')
+    kale = repos.products.create('Kale', 2, 10, 'leafy', None, None, farmer['id'], 'Vegetables')
+    eggs = repos.products.create('Eggs', 3, 8, 'brown', None, None, farmer['id'], 'Dairy')
+    gone = repos.products.create('Figs', 4, 2, 'ripe', None, None, farmer['id'], 'Fruit')
+
+    repos.cart.add(customer['id'], kale, 6)
+    repos.cart.add(customer['id'], eggs, 1)
+    repos.orders.place(customer['id'], 'cash')
+    kale_order, eggs_order = (row['id'] for row in repos.conn.execute(
+        "SELECT id FROM orders WHERE customer_id = ? ORDER BY product_id", (customer['id'],)))
+    repos.orders.confirm_delivery(kale_order, customer['id'])
+    repos.orders.delete(eggs_order, customer['id'])
+    repos.products.delete(gone, farmer['id'])
+
+    assert totals(repos, farmer) == {'products': 2, 'low_stock_products': 1, 'units_sold': 6, 'revenue': 12.0,
+                                     'pending_orders': 0, 'completed_orders': 1}
+    incremental = totals(repos, farmer)
+    repos.stats.rebuild()
+    assert totals(repos, farmer) == incremental
+
+
+def test_rebuild_repairs_drifted_totals(repos):
+    farmer = make_user(repos, 'farmer')
+    repos.products.create('Milk', 1, 3, 'fresh', None, None, farmer['id'], 'Dairy')
+    expected = totals(repos, farmer)
+    with repos.stats.transaction():
+        repos.conn.execute("UPDATE farmer_stats SET products = 99, units_sold = 5 WHERE farmer_id = ?", (farmer['id'],))
+    repos.stats.rebuild()
+    assert totals(repos, farmer) == expected
@@ -0,0 +1,19 @@
+from conftest import log_in, make_user
+
+from app import coalesce
+
+
+def test_coalesce_joins_small_chunks_up_to_the_size():
+    assert list(coalesce(['ab', 'cd', 'e', 'fgh', 'i'], 4)) == ['abcd', 'efgh', 'i']
+    assert list(coalesce([], 4)) == []
+
+
+def test_streamed_pages_fit_in_the_asgi_send_queue(app, repos):
+    farmer = make_user(repos, 'farmer')
+    for number in range(30):
+        repos.products.create(f'Produce {number}', 1, 5, 'fresh', None, None, farmer['id'], 'Fruit')
+    client = app.test_client()
+    log_in(client, farmer)
+    for path in ('/marketplace', '/dashboard'):
+        chunks = list(client.get(path).response)
+        assert 0 < len(chunks) <= app.config['ASGI_SEND_QUEUE_SIZE']